@@ -1,10 +1,50 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from app.routes import admin, auth, files
+from app.services.database import POOLS, WRITERS, migrate
+from app.services.expiry import EXPIRY_WHEEL, load_pending_expirations
+from app.services.metrics import REGISTRY, MetricsMiddleware
+from app.services.mfa import get_mfa_store
+from app.services.profiling import ProfilingMiddleware
+from app.services.ratelimit import AdmissionMiddleware
+from app.services.security import SecurityService, get_password_context
+from app.services.tiering import ACCESS_TRACKER
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Do startup I/O once per worker instead of at import time.
 
-from app.routes import auth, files
+    Runs schema migrations (serialized across workers), opens the connection
+    pool, builds the crypto objects so the first requests do not pay for
+    them, and loads pending share and MFA-code expirations.
+    """
+    migrate()
+    for pool in POOLS:
+        pool.prewarm()
+    files.get_cipher()
+    get_password_context()
+    get_mfa_store()
+    SecurityService.decode_token(SecurityService.create_access_token({}))
+    load_pending_expirations()
+    EXPIRY_WHEEL.start()
+    yield
+    EXPIRY_WHEEL.stop()
+    ACCESS_TRACKER.stop()
+    for writer in WRITERS:
+        writer.stop()
+    for pool in POOLS:
+        pool.close()
 
-app = FastAPI()
 
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -12,11 +52,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(files.router)
+app.include_router(admin.router)
 
 
 @app.get("/")
 def read_root():
     return {"message": "Secure File Sharing API"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
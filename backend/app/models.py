@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, EmailStr
 
 
@@ -9,6 +9,13 @@ class FileShare(BaseModel):
     expires_in_hours: Optional[int] = 24
 
 
+class FileShareBatch(BaseModel):
+    file_ids: List[int]
+    usernames: List[str]
+    permissions: str = "view"
+    expires_in_hours: Optional[int] = 24
+
+
 class FileMetadata(BaseModel):
     filename: str
     file_path: str
@@ -41,3 +48,13 @@ class MFAVerify(BaseModel):
 
 class UserRoleUpdate(BaseModel):
     role: str
+
+
+class QuotaUpdate(BaseModel):
+    quota_bytes: Optional[int] = None
+
+
+class ProfilingConfig(BaseModel):
+    enabled: bool = True
+    sample_rate: float = 0.01
+    interval_ms: float = 5.0
@@ -0,0 +1,195 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from app.services.database import (
+    execute_query,
+    fetch_all,
+    fetch_all_shards,
+    fetch_one,
+)
+from app.services.security import SecurityService, check_roles
+from app.services.profiling import PROFILER
+from app.services.audit import AUDIT_LOG
+from app.services.packs import pack_stats
+from app.services.tiering import tier_stats
+from app.models import ProfilingConfig, QuotaUpdate
+
+router = APIRouter(prefix="/admin", tags=["Administration"])
+
+
+@router.get("/profiling")
+@check_roles(["admin"])
+def profiling_status(current_user: dict = Depends(SecurityService.get_current_user)):
+    return PROFILER.status()
+
+
+@router.put("/profiling")
+@check_roles(["admin"])
+def configure_profiling(
+    config: ProfilingConfig,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    if not 0 <= config.sample_rate <= 1:
+        raise HTTPException(
+            status_code=400, detail="Sample rate must be between 0 and 1"
+        )
+    if config.interval_ms < 1:
+        raise HTTPException(
+            status_code=400, detail="Sampling interval must be at least 1 ms"
+        )
+
+    PROFILER.configure(config.enabled, config.sample_rate, config.interval_ms)
+    return PROFILER.status()
+
+
+@router.get("/profiling/profile")
+@check_roles(["admin"])
+def export_profile(
+    route: str,
+    format: str = "collapsed",
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    profile = PROFILER.snapshot(route)
+    if not profile:
+        raise HTTPException(status_code=404, detail="No samples for this route")
+
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed())
+    if format == "top":
+        return {"route": route, "functions": profile.top_functions()}
+    raise HTTPException(status_code=400, detail="Format must be 'collapsed' or 'top'")
+
+
+@router.delete("/profiling/profile")
+@check_roles(["admin"])
+def reset_profiles(current_user: dict = Depends(SecurityService.get_current_user)):
+    PROFILER.reset()
+    return {"message": "Profiles cleared"}
+
+
+@router.get("/storage/usage")
+@check_roles(["admin"])
+def storage_usage(current_user: dict = Depends(SecurityService.get_current_user)):
+    usage = {
+        row[0]: row[1:]
+        for row in fetch_all_shards(
+            "SELECT user_id, bytes_used, file_count FROM user_storage"
+        )
+    }
+    users = [
+        {
+            "user_id": user_id,
+            "username": username,
+            "bytes_used": usage.get(user_id, (0, 0))[0],
+            "file_count": usage.get(user_id, (0, 0))[1],
+            "quota_bytes": quota_bytes,
+        }
+        for user_id, username, quota_bytes in fetch_all(
+            "SELECT id, username, quota_bytes FROM users"
+        )
+    ]
+    users.sort(key=lambda user: user["bytes_used"], reverse=True)
+    return {"users": users, "total_bytes": sum(user["bytes_used"] for user in users)}
+
+
+@router.get("/storage/packs")
+@check_roles(["admin"])
+def pack_usage(current_user: dict = Depends(SecurityService.get_current_user)):
+    return pack_stats()
+
+
+@router.get("/storage/tiers")
+@check_roles(["admin"])
+def tier_usage(current_user: dict = Depends(SecurityService.get_current_user)):
+    return tier_stats()
+
+
+@router.put("/users/{user_id}/quota")
+@check_roles(["admin"])
+def update_user_quota(
+    user_id: int,
+    quota: QuotaUpdate,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    if quota.quota_bytes is not None and quota.quota_bytes < 0:
+        raise HTTPException(status_code=400, detail="Quota cannot be negative")
+
+    user = fetch_one("SELECT id FROM users WHERE id = ?", (user_id,))
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    execute_query(
+        "UPDATE users SET quota_bytes = ? WHERE id = ?", (quota.quota_bytes, user_id)
+    )
+    return {"message": "Quota updated successfully"}
+
+
+@router.get("/integrity")
+@check_roles(["admin"])
+def integrity_report(current_user: dict = Depends(SecurityService.get_current_user)):
+    rows = fetch_all_shards(
+        """
+        SELECT f.id, f.filename, u.username, f.integrity_status, f.last_verified_at
+        FROM files f
+        JOIN users u ON u.id = f.user_id
+        WHERE f.integrity_status IN ('corrupt', 'missing')
+        """
+    )
+    rows.sort(key=lambda row: row[4] or "", reverse=True)
+    summaries = fetch_all_shards(
+        """
+        SELECT COUNT(*), COUNT(last_verified_at), MIN(last_verified_at)
+        FROM files
+        """
+    )
+    oldest = [summary[2] for summary in summaries if summary[2] is not None]
+    return {
+        "files": sum(summary[0] for summary in summaries),
+        "verified": sum(summary[1] for summary in summaries),
+        "oldest_verification": min(oldest, default=None),
+        "damaged": [
+            {
+                "file_id": row[0],
+                "filename": row[1],
+                "owner": row[2],
+                "status": row[3],
+                "verified_at": row[4],
+            }
+            for row in rows
+        ],
+    }
+
+
+@router.get("/audit")
+@check_roles(["admin"])
+def query_audit_log(
+    actor: Optional[str] = None,
+    action: Optional[str] = None,
+    file_id: Optional[int] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    before_id: Optional[int] = None,
+    limit: int = 100,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    events = AUDIT_LOG.query(
+        actor=actor,
+        action=action,
+        file_id=file_id,
+        since=since,
+        until=until,
+        before_id=before_id,
+        limit=max(1, min(limit, 1000)),
+    )
+    return {"events": events}
+
+
+@router.post("/audit/compact")
+@check_roles(["admin"])
+def compact_audit_log(
+    retention_days: Optional[float] = None,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    if retention_days is not None and retention_days < 0:
+        raise HTTPException(status_code=400, detail="Retention cannot be negative")
+    return {"deleted": AUDIT_LOG.compact(retention_days)}
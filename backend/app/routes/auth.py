@@ -1,14 +1,35 @@
 from fastapi import APIRouter, HTTPException, Depends
-from app.services.database import execute_query, fetch_one, fetch_all
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.services.database import (
+    all_shards,
+    execute_many_async,
+    execute_query,
+    execute_query_async,
+    fetch_one,
+    fetch_all,
+    iter_rows,
+    shard_for_user,
+)
 from app.services.security import SecurityService, check_roles
+from app.services.changes import CHANGE_FEED, shared_listing_changes
+from app.services.metrics import stage_timer
+from app.services.ratelimit import (
+    AUTH_IP_LIMITER,
+    LOGIN_USER_LIMITER,
+    enforce,
+    limit_by_ip,
+)
+from app.services.mfa import get_mfa_store
+from app.services.storage import get_storage
+from app.services.versions import get_chunk_store
 from app.models import UserCreate, UserLogin, MFAVerify
-import os
-from datetime import datetime, timedelta
+from app.utils.streaming import json_object_stream, rows_as_dicts
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 
-@router.post("/register")
+@router.post("/register", dependencies=[Depends(limit_by_ip(AUTH_IP_LIMITER))])
 def register_user(user: UserCreate):
     existing_user = fetch_one(
         "SELECT * FROM users WHERE username = ? OR email = ?",
@@ -32,31 +53,34 @@ def register_user(user: UserCreate):
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
 
-@router.post("/login")
+@router.post("/login", dependencies=[Depends(limit_by_ip(AUTH_IP_LIMITER))])
 def login_user(user: UserLogin):
-    db_user = fetch_one("SELECT * FROM users WHERE username = ?", (user.username,))
+    enforce(LOGIN_USER_LIMITER, f"user:{user.username}")
+
+    with stage_timer("login_user", "db"):
+        db_user = fetch_one("SELECT * FROM users WHERE username = ?", (user.username,))
 
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    if not SecurityService.verify_password(user.password, db_user[3]):
+    with stage_timer("login_user", "bcrypt"):
+        password_valid = SecurityService.verify_password(user.password, db_user[3])
+    if not password_valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     if db_user[6]:  # mfa_enabled
         code = SecurityService.generate_mfa_code()
-        expiry = datetime.utcnow() + timedelta(minutes=10)
+        with stage_timer("login_user", "mfa_store"):
+            get_mfa_store().issue(db_user[0], code)
 
-        execute_query(
-            "INSERT INTO mfa_codes (user_id, code, expires_at) VALUES (?, ?, ?)",
-            (db_user[0], code, expiry),
-        )
-
-        SecurityService.send_mfa_code(db_user[2], code)
+        with stage_timer("login_user", "send_mfa"):
+            SecurityService.send_mfa_code(db_user[2], code)
         return {"message": "MFA code sent", "require_mfa": True}
 
-    access_token = SecurityService.create_access_token(
-        data={"sub": user.username, "role": db_user[4]}
-    )
+    with stage_timer("login_user", "token"):
+        access_token = SecurityService.create_access_token(
+            data={"sub": user.username, "role": db_user[4]}
+        )
     return {
         "access_token": access_token,
         "token_type": "bearer",
@@ -64,26 +88,17 @@ def login_user(user: UserLogin):
     }
 
 
-@router.post("/verify-mfa")
+@router.post("/verify-mfa", dependencies=[Depends(limit_by_ip(AUTH_IP_LIMITER))])
 def verify_mfa(mfa: MFAVerify):
+    enforce(LOGIN_USER_LIMITER, f"user:{mfa.username}")
+
     user = fetch_one("SELECT * FROM users WHERE username = ?", (mfa.username,))
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    code_record = fetch_one(
-        """
-        SELECT * FROM mfa_codes 
-        WHERE user_id = ? AND code = ? AND expires_at > ? 
-        ORDER BY created_at DESC LIMIT 1
-        """,
-        (user[0], mfa.code, datetime.utcnow()),
-    )
-
-    if not code_record:
+    if not get_mfa_store().verify(user[0], mfa.code):
         raise HTTPException(status_code=401, detail="Invalid or expired MFA code")
 
-    execute_query("DELETE FROM mfa_codes WHERE user_id = ?", (user[0],))
-
     access_token = SecurityService.create_access_token(
         data={"sub": mfa.username, "role": user[4]}
     )
@@ -110,29 +125,70 @@ def toggle_mfa(current_user: dict = Depends(SecurityService.get_current_user)):
 
 
 @router.delete("/account")
-def delete_user_account(current_user: dict = Depends(SecurityService.get_current_user)):
+async def delete_user_account(
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
     user = fetch_one("SELECT id FROM users WHERE username = ?", (current_user["sub"],))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user_id = user[0]
 
+    await delete_user_data(user[0])
+    return {"message": "Account deleted successfully"}
+
+
+async def delete_user_data(user_id: int):
+    """
+    Delete a user with their files, blobs and shares.
+
+    The user's files live in their own shard; shares by or with the user may
+    be in any shard. Admins see the owned files go, and other users the files
+    shared with them by the user or owned by the user.
+    """
+    shard = shard_for_user(user_id)
     user_files = fetch_all(
-        "SELECT id, file_path FROM files WHERE user_id = ?", (user_id,)
+        "SELECT id, file_path FROM files WHERE user_id = ?", (user_id,), shard=shard
     )
+    recipients = {
+        other: fetch_all(
+            """
+            SELECT DISTINCT fs.file_id, fs.shared_with FROM file_shares fs
+            LEFT JOIN files f ON f.id = fs.file_id
+            WHERE (fs.shared_by = ? OR f.user_id = ?)
+              AND fs.shared_with IS NOT NULL AND fs.shared_with != ?
+            """,
+            (user_id, user_id, user_id),
+            shard=other,
+        )
+        for other in all_shards()
+    }
+    await get_chunk_store().release_files(file[0] for file in user_files)
+    storage = get_storage()
     for file in user_files:
-        try:
-            os.remove(file[1])
-        except FileNotFoundError:
-            pass
+        await storage.delete(file[1])
 
-    execute_query(
-        "DELETE FROM file_shares WHERE shared_by = ? OR shared_with = ?",
-        (user_id, user_id),
+    await execute_many_async(
+        "DELETE FROM share_tokens WHERE file_id = ?",
+        [(file[0],) for file in user_files],
+    )
+    for other in all_shards():
+        await execute_query_async(
+            "DELETE FROM file_shares WHERE shared_by = ? OR shared_with = ?",
+            (user_id, user_id),
+            shard=other,
+        )
+    await execute_query_async(
+        "DELETE FROM files WHERE user_id = ?", (user_id,), shard=shard
     )
-    execute_query("DELETE FROM files WHERE user_id = ?", (user_id,))
-    execute_query("DELETE FROM users WHERE id = ?", (user_id,))
+    await execute_query_async(
+        "DELETE FROM user_storage WHERE user_id = ?", (user_id,), shard=shard
+    )
+    await execute_query_async("DELETE FROM users WHERE id = ?", (user_id,))
 
-    return {"message": "Account deleted successfully"}
+    changes = [(user_id, "owned", file[0], None) for file in user_files]
+    for other, pairs in recipients.items():
+        # Recipients keep a file shared with them by someone else.
+        changes.extend(await run_in_threadpool(shared_listing_changes, other, pairs))
+    await CHANGE_FEED.publish_async(changes)
 
 
 @router.get("/validate-token")
@@ -142,18 +198,20 @@ def validate_token(token_data: dict = Depends(SecurityService.get_current_user))
 
 @router.get("/users")
 @check_roles(["admin"])
-async def list_users(current_user: dict = Depends(SecurityService.get_current_user)):
-    users_raw = fetch_all("SELECT id, username, email, role, created_at FROM users")
-    formatted_users = [
-        {
-            "id": user[0],
-            "username": user[1],
-            "email": user[2],
-            "role": user[3],
-            "created_at": user[4],
-        }
-        for user in users_raw
-    ]
+async def list_users(
+    stream: bool = False,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    query = "SELECT id, username, email, role, created_at FROM users"
+    keys = ("id", "username", "email", "role", "created_at")
+    if stream:
+        return StreamingResponse(
+            json_object_stream({"users": rows_as_dicts(iter_rows(query), keys)}),
+            media_type="application/json",
+        )
+
+    users_raw = fetch_all(query)
+    formatted_users = [dict(zip(keys, user)) for user in users_raw]
     return {"users": formatted_users}
 
 
@@ -177,20 +235,5 @@ async def delete_user(user_id: int):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_files = fetch_all(
-        "SELECT id, file_path FROM files WHERE user_id = ?", (user_id,)
-    )
-    for file in user_files:
-        try:
-            os.remove(file[1])
-        except FileNotFoundError:
-            pass
-
-    execute_query(
-        "DELETE FROM file_shares WHERE shared_by = ? OR shared_with = ?",
-        (user_id, user_id),
-    )
-    execute_query("DELETE FROM files WHERE user_id = ?", (user_id,))
-    execute_query("DELETE FROM users WHERE id = ?", (user_id,))
-
+    await delete_user_data(user_id)
     return {"message": "User deleted successfully"}
@@ -1,81 +1,259 @@
+import heapq
 import os
-import uuid
+import re
+import sqlite3
+import tempfile
 from datetime import datetime, timedelta
-from fastapi import APIRouter, File, UploadFile, Depends, HTTPException
-from fastapi.responses import Response
-from app.services.database import execute_query, fetch_one, fetch_all
-from app.services.security import SecurityService, check_roles
-from app.models import FileShare
+from functools import lru_cache
+from itertools import islice
+from typing import AsyncIterator, Optional
+from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from app.services.database import (
+    DB_SHARDS,
+    all_shards,
+    execute_many,
+    execute_query,
+    execute_query_async,
+    fetch_one,
+    fetch_all,
+    fetch_all_shards,
+    get_db_connection,
+    group_by_shard,
+    iter_rows_shards,
+    next_row_id,
+    shard_for_row,
+    shard_for_user,
+)
+from app.services.security import SecurityService, check_roles, get_server_key
+from app.services.metrics import CRYPTO_BYTES, stage_timer
+from app.services.ratelimit import UPLOAD_USER_LIMITER, client_ip, enforce
+from app.services.audit import AUDIT_LOG
+from app.services.bandwidth import DOWNLOAD_SCHEDULER, shape
+from app.services.changes import CHANGE_FEED, file_entry, shared_listing_changes
+from app.services.expiry import EXPIRY_WHEEL, utc_timestamp
+from app.services.storage import CHUNK_SIZE, get_storage
+from app.services.tiering import ACCESS_TRACKER, is_cold, promote, read_blob
+from app.services.versions import get_chunk_store
+from app.models import FileShare, FileShareBatch
 import base64
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from app.utils.sanitization import sanitize_filename, sanitize_input, sanitize_token
+from app.utils.multipart import MultipartError, MultipartStream
+from app.utils.streaming import json_object_stream, rows_as_dicts
 
 router = APIRouter(prefix="/files", tags=["File Management"])
 
-UPLOAD_DIRECTORY = "uploads"
-os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 
-SERVER_KEY = os.getenv("SERVER_KEY", os.urandom(32))
+@lru_cache(maxsize=None)
+def get_cipher() -> AESGCM:
+    return AESGCM(get_server_key())
+
+
+GCM_TAG_BYTES = 16
+DEFAULT_USER_QUOTA_BYTES = int(os.getenv("USER_QUOTA_BYTES", str(10 * 1024**3)))
+MAX_SEARCH_RESULTS = 200
+MAX_BATCH_SHARE_ITEMS = 1000
+MAX_SEARCH_TOKENS = 8
+MAX_UPLOAD_FIELD_BYTES = 1024
+
+
+def check_quota(quota_bytes, bytes_used: int, incoming_bytes: int):
+    """
+    Reject an upload that would take a user over their storage quota.
+
+    Args:
+        quota_bytes (int, optional): Per-user quota, or None for the default
+        bytes_used (int): Bytes the user already stores
+        incoming_bytes (int): Stored size of the new blob
+
+    Raises:
+        HTTPException: 413 if the quota would be exceeded
+    """
+    if quota_bytes is None:
+        quota_bytes = DEFAULT_USER_QUOTA_BYTES
+    if quota_bytes and bytes_used + incoming_bytes > quota_bytes:
+        raise HTTPException(status_code=413, detail="Storage quota exceeded")
+
+
+def build_search_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 query matching every token as a prefix.
+
+    Args:
+        query (str): User-supplied search text
+
+    Returns:
+        str: FTS5 MATCH expression, empty if the text has no searchable tokens
+    """
+    tokens = re.findall(r"\w+", query.lower())[:MAX_SEARCH_TOKENS]
+    return " ".join(f'"{token}"*' for token in tokens)
 
 
 def encrypt_file(data: bytes, iv: bytes) -> bytes:
     if len(iv) != 12:
         raise ValueError("IV must be 12 bytes long for AES GCM mode")
 
-    aesgcm = AESGCM(SERVER_KEY)
-    return aesgcm.encrypt(iv, data, None)
+    CRYPTO_BYTES.inc(len(data), direction="encrypt")
+    return get_cipher().encrypt(iv, data, None)
 
 
 def decrypt_file(encrypted_data: bytes, iv: bytes) -> bytes:
-    aesgcm = AESGCM(SERVER_KEY)
-    return aesgcm.decrypt(iv, encrypted_data, None)
+    plaintext = get_cipher().decrypt(iv, encrypted_data, None)
+    CRYPTO_BYTES.inc(len(plaintext), direction="decrypt")
+    return plaintext
+
+
+async def encrypt_stream(
+    chunks: AsyncIterator[bytes], iv: bytes
+) -> AsyncIterator[bytes]:
+    """
+    Encrypt a stream with AES-GCM as it arrives.
+
+    The output is byte-for-byte what ``encrypt_file`` returns for the whole
+    content: the ciphertext followed by the 16-byte tag. Input is gathered
+    into CHUNK_SIZE pieces so each trip to the thread pool does real work.
+    """
+    encryptor = Cipher(algorithms.AES(get_server_key()), modes.GCM(iv)).encryptor()
+    buffered = bytearray()
+    async for chunk in chunks:
+        buffered += chunk
+        if len(buffered) >= CHUNK_SIZE:
+            CRYPTO_BYTES.inc(len(buffered), direction="encrypt")
+            yield await run_in_threadpool(encryptor.update, bytes(buffered))
+            buffered.clear()
+    CRYPTO_BYTES.inc(len(buffered), direction="encrypt")
+    tail = await run_in_threadpool(encryptor.update, bytes(buffered))
+    yield tail + encryptor.finalize() + encryptor.tag
+
+
+async def _read_spool(spool) -> AsyncIterator[bytes]:
+    await run_in_threadpool(spool.seek, 0)
+    while chunk := await run_in_threadpool(spool.read, CHUNK_SIZE):
+        yield chunk
 
 
 @router.post("/upload")
 @check_roles(["user", "admin"])
 async def upload_file(
-    file: UploadFile = File(...),
-    iv: UploadFile = File(...),
-    salt: UploadFile = File(...),
+    request: Request,
     current_user: dict = Depends(SecurityService.get_current_user),
 ):
-    file.filename = sanitize_filename(file.filename)
-    user = fetch_one("SELECT id FROM users WHERE username = ?", (current_user["sub"],))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    user_id = user[0]
-
-    unique_filename = f"{uuid.uuid4()}_{file.filename}"
-    file_path = os.path.join(UPLOAD_DIRECTORY, unique_filename)
+    """
+    Store an uploaded file, encrypting it while the request body streams in.
 
-    iv_bytes = await iv.read()
-    if len(iv_bytes) != 12:
-        raise HTTPException(
-            status_code=400, detail="Invalid IV size. Must be 12 bytes for AES GCM mode"
+    The multipart body is parsed incrementally. When the ``iv`` field comes
+    before ``file``, file data goes straight through the encryptor to its
+    final blob, with no temporary copy. Clients that send the file first
+    have it spooled (in memory up to CHUNK_SIZE) until the IV arrives.
+    """
+    enforce(UPLOAD_USER_LIMITER, f"user:{current_user['sub']}")
+    with stage_timer("upload_file", "db"):
+        user = fetch_one(
+            "SELECT id, quota_bytes FROM users WHERE username = ?",
+            (current_user["sub"],),
         )
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_id, quota_bytes = user
+        shard = shard_for_user(user_id)
+        usage = fetch_one(
+            "SELECT bytes_used FROM user_storage WHERE user_id = ?",
+            (user_id,),
+            shard=shard,
+        )
+    bytes_used = usage[0] if usage else 0
 
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        try:
-            encrypted_content = encrypt_file(content, iv_bytes)
-            buffer.write(encrypted_content)
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail=str(e))
+    async def within_quota(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        received = 0
+        async for chunk in chunks:
+            received += len(chunk)
+            check_quota(quota_bytes, bytes_used, received + GCM_TAG_BYTES)
+            yield chunk
 
-    salt_bytes = await salt.read()
+    storage = get_storage()
+    fields, file_path, filename, size, spool = {}, None, None, 0, None
+    try:
+        form = MultipartStream(
+            request.headers.get("content-type", ""), request.stream()
+        )
+        async for part in form.parts():
+            if part.name in ("iv", "salt"):
+                fields[part.name] = await part.read(MAX_UPLOAD_FIELD_BYTES)
+                if part.name == "iv" and len(fields["iv"]) != 12:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Invalid IV size. Must be 12 bytes for AES GCM mode",
+                    )
+            elif part.name == "file" and filename is None:
+                filename = sanitize_filename(part.filename or "")
+                if "iv" not in fields:
+                    spool = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+                    async for chunk in within_quota(part):
+                        await run_in_threadpool(spool.write, chunk)
+                    continue
+                file_path = storage.new_key(filename)
+                with stage_timer("upload_file", "write"):
+                    size = await storage.write(
+                        file_path, encrypt_stream(within_quota(part), fields["iv"])
+                    )
 
-    execute_query(
-        """INSERT INTO files 
-           (filename, user_id, file_path, iv, salt) 
-           VALUES (?, ?, ?, ?, ?)""",
-        (
-            file.filename,
-            user_id,
-            file_path,
-            iv_bytes,
-            salt_bytes,
-        ),
-    )
+        if filename is None or "iv" not in fields or "salt" not in fields:
+            raise HTTPException(
+                status_code=400, detail="Fields file, iv and salt are required"
+            )
+        if spool is not None:
+            file_path = storage.new_key(filename)
+            with stage_timer("upload_file", "write"):
+                size = await storage.write(
+                    file_path, encrypt_stream(_read_spool(spool), fields["iv"])
+                )
+    except MultipartError as e:
+        if file_path is not None:
+            await storage.delete(file_path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        if file_path is not None:
+            await storage.delete(file_path)
+        raise
+    finally:
+        if spool is not None:
+            spool.close()
+
+    with stage_timer("upload_file", "db"):
+        cursor = await execute_query_async(
+            f"""INSERT INTO files 
+               (id, filename, user_id, file_path, iv, salt, size_bytes) 
+               VALUES ({next_row_id("files", shard)}, ?, ?, ?, ?, ?, ?)""",
+            (
+                filename,
+                user_id,
+                file_path,
+                fields["iv"],
+                fields["salt"],
+                size,
+            ),
+            shard=shard,
+        )
+        await CHANGE_FEED.publish_async(
+            [
+                (
+                    user_id,
+                    "owned",
+                    cursor.lastrowid,
+                    file_entry(
+                        cursor.lastrowid,
+                        filename,
+                        file_path,
+                        user_id,
+                        owner_username=current_user["sub"],
+                    ),
+                )
+            ]
+        )
 
     return {"message": "File uploaded successfully"}
 
@@ -84,13 +262,17 @@ async def upload_file(
 @check_roles(["user", "admin"])
 def share_file(
     share_details: FileShare,
+    request: Request,
     current_user: dict = Depends(SecurityService.get_current_user),
 ):
     if share_details.shared_with_username:
         share_details.shared_with_username = sanitize_input(
             share_details.shared_with_username
         )
-    file = fetch_one("SELECT * FROM files WHERE id = ?", (share_details.file_id,))
+    shard = shard_for_row(share_details.file_id)
+    file = fetch_one(
+        "SELECT * FROM files WHERE id = ?", (share_details.file_id,), shard=shard
+    )
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
@@ -118,10 +300,10 @@ def share_file(
             raise HTTPException(status_code=404, detail="Shared user not found")
         shared_with_id = shared_with[0]
 
-    execute_query(
-        """INSERT INTO file_shares 
-           (file_id, shared_by, shared_with, permissions, token, expires_at) 
-           VALUES (?, ?, ?, ?, ?, ?)""",
+    cursor = execute_query(
+        f"""INSERT INTO file_shares 
+           (id, file_id, shared_by, shared_with, permissions, token, expires_at) 
+           VALUES ({next_row_id("file_shares", shard)}, ?, ?, ?, ?, ?, ?)""",
         (
             share_details.file_id,
             sharer[0],
@@ -130,56 +312,211 @@ def share_file(
             token,
             expires_at,
         ),
+        shard=shard,
+    )
+    if token:
+        execute_query(
+            "INSERT INTO share_tokens (token, share_id, file_id) VALUES (?, ?, ?)",
+            (token, cursor.lastrowid, share_details.file_id),
+        )
+    EXPIRY_WHEEL.schedule(
+        "share", cursor.lastrowid, utc_timestamp(expires_at), share_details.file_id
+    )
+    if shared_with_id:
+        CHANGE_FEED.publish(
+            [
+                (
+                    shared_with_id,
+                    "shared",
+                    file[0],
+                    file_entry(
+                        file[0],
+                        file[1],
+                        file[3],
+                        file[2],
+                        permission=share_details.permissions,
+                    ),
+                )
+            ]
+        )
+    AUDIT_LOG.record(
+        "share_create",
+        actor=current_user["sub"],
+        file_id=share_details.file_id,
+        share_id=cursor.lastrowid,
+        target=share_details.shared_with_username or "link",
+        ip=client_ip(request),
     )
 
     return {"message": "File shared successfully", "share_token": token}
 
 
+@router.post("/share/batch")
+@check_roles(["user", "admin"])
+def share_files_batch(
+    batch: FileShareBatch,
+    request: Request,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    file_ids = list(dict.fromkeys(batch.file_ids))
+    usernames = list(dict.fromkeys(sanitize_input(name) for name in batch.usernames))
+    if not file_ids or not usernames:
+        raise HTTPException(
+            status_code=400, detail="At least one file and one user are required"
+        )
+    if len(file_ids) > MAX_BATCH_SHARE_ITEMS or len(usernames) > MAX_BATCH_SHARE_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_SHARE_ITEMS} files and users per batch",
+        )
+
+    sharer = fetch_one(
+        "SELECT id, role FROM users WHERE username = ?", (current_user["sub"],)
+    )
+    if not sharer:
+        raise HTTPException(status_code=404, detail="User not found")
+    sharer_id, sharer_role = sharer
+
+    file_rows = {}
+    for shard, ids in group_by_shard(file_ids).items():
+        file_rows.update(
+            (row[0], row)
+            for row in fetch_all(
+                f"SELECT id, filename, file_path, user_id FROM files WHERE id IN ({','.join('?' * len(ids))})",
+                ids,
+                shard=shard,
+            )
+        )
+    recipients = {
+        username: user_id
+        for user_id, username in fetch_all(
+            f"SELECT id, username FROM users WHERE username IN ({','.join('?' * len(usernames))})",
+            usernames,
+        )
+    }
+
+    file_status = {}
+    for file_id in file_ids:
+        if file_id not in file_rows:
+            file_status[file_id] = "file_not_found"
+        elif sharer_role != "admin" and file_rows[file_id][3] != sharer_id:
+            file_status[file_id] = "not_owner"
+        else:
+            file_status[file_id] = "shared"
+
+    expires_at = datetime.utcnow() + timedelta(hours=batch.expires_in_hours)
+    results, rows = [], {}
+    for file_id in file_ids:
+        for username in usernames:
+            status = file_status[file_id]
+            if status == "shared" and username not in recipients:
+                status = "user_not_found"
+            if status == "shared":
+                rows.setdefault(shard_for_row(file_id), []).append(
+                    (
+                        file_id,
+                        sharer_id,
+                        recipients[username],
+                        batch.permissions,
+                        None,
+                        expires_at,
+                    )
+                )
+            results.append({"file_id": file_id, "username": username, "status": status})
+
+    for shard, shard_rows in rows.items():
+        # The ids are assigned here rather than read back afterwards, so that
+        # exactly the inserted shares are scheduled to expire.
+        with get_db_connection(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            first_id = cursor.execute(
+                f"SELECT {next_row_id('file_shares', shard)}"
+            ).fetchone()[0]
+            share_ids = range(
+                first_id, first_id + len(shard_rows) * DB_SHARDS, DB_SHARDS
+            )
+            cursor.executemany(
+                """INSERT INTO file_shares
+                   (id, file_id, shared_by, shared_with, permissions, token, expires_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                [(share_id, *row) for share_id, row in zip(share_ids, shard_rows)],
+            )
+            conn.commit()
+        for share_id, row in zip(share_ids, shard_rows):
+            EXPIRY_WHEEL.schedule("share", share_id, utc_timestamp(expires_at), row[0])
+    if rows:
+        CHANGE_FEED.publish(
+            (
+                recipients[result["username"]],
+                "shared",
+                result["file_id"],
+                file_entry(*file_rows[result["file_id"]], permission=batch.permissions),
+            )
+            for result in results
+            if result["status"] == "shared"
+        )
+        ip = client_ip(request)
+        for result in results:
+            if result["status"] == "shared":
+                AUDIT_LOG.record(
+                    "share_create",
+                    actor=current_user["sub"],
+                    file_id=result["file_id"],
+                    target=result["username"],
+                    ip=ip,
+                )
+
+    return {"shared": sum(map(len, rows.values())), "results": results}
+
+
 @router.get("/list")
 @check_roles(["guest", "user", "admin"])
-def list_user_files(current_user: dict = Depends(SecurityService.get_current_user)):
+def list_user_files(
+    response: Response,
+    stream: bool = False,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    """
+    List the user's own files and the files shared with them.
+
+    The X-Changes-Version header carries the change feed version the listing
+    is current with; clients pass it as ``since`` to /files/changes or
+    /files/changes/stream to keep the listing up to date without reloading it.
+    """
     user = fetch_one(
         "SELECT id, role FROM users WHERE username = ?", (current_user["sub"],)
     )
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     user_id, user_role = user[0], user[1]
+    # Read before the listing, so changes made while it is built are replayed.
+    version_headers = {
+        "X-Changes-Version": str(CHANGE_FEED.current_version()),
+        "Access-Control-Expose-Headers": "X-Changes-Version",
+    }
 
+    file_keys = ("id", "filename", "file_path", "user_id")
     if user_role == "admin":
-        owned_files_raw = fetch_all(
+        owned_query = (
             """
             SELECT f.id, f.filename, f.file_path, f.user_id, u.username as owner_username 
             FROM files f 
             JOIN users u ON f.user_id = u.id
-        """
+            """,
+            (),
+            file_keys + ("owner_username",),
+            None,
         )
-        owned_files = [
-            {
-                "id": file[0],
-                "filename": file[1],
-                "file_path": file[2],
-                "user_id": file[3],
-                "owner_username": file[4],
-            }
-            for file in owned_files_raw
-        ]
-        shared_files = []
+        shared_query = None
     else:
-        owned_files_raw = fetch_all(
+        owned_query = (
             "SELECT id, filename, file_path, user_id FROM files WHERE user_id = ?",
             (user_id,),
+            file_keys,
+            [shard_for_user(user_id)],
         )
-        owned_files = [
-            {
-                "id": file[0],
-                "filename": file[1],
-                "file_path": file[2],
-                "user_id": file[3],
-            }
-            for file in owned_files_raw
-        ]
-
-        shared_files_raw = fetch_all(
+        shared_query = (
             """
             SELECT f.id, f.filename, f.file_path, f.user_id, fs.permissions
             FROM files f
@@ -187,35 +524,204 @@ def list_user_files(current_user: dict = Depends(SecurityService.get_current_use
             WHERE fs.shared_with = ? AND fs.expires_at > CURRENT_TIMESTAMP
             """,
             (user_id,),
+            file_keys + ("permission",),
+            None,
         )
-        shared_files = [
-            {
-                "id": file[0],
-                "filename": file[1],
-                "file_path": file[2],
-                "user_id": file[3],
-                "permission": file[4],
-            }
-            for file in shared_files_raw
+
+    # Shares point at files in their owners' shards, so they are gathered from
+    # every shard, as are the admin's listings.
+    if stream:
+        return StreamingResponse(
+            json_object_stream(
+                {
+                    "owned_files": rows_as_dicts(
+                        iter_rows_shards(*owned_query[:2], owned_query[3]),
+                        owned_query[2],
+                    ),
+                    "shared_files": (
+                        rows_as_dicts(
+                            iter_rows_shards(*shared_query[:2], shared_query[3]),
+                            shared_query[2],
+                        )
+                        if shared_query
+                        else ()
+                    ),
+                }
+            ),
+            media_type="application/json",
+            headers=version_headers,
+        )
+
+    response.headers.update(version_headers)
+    owned_files = [
+        dict(zip(owned_query[2], file))
+        for file in fetch_all_shards(*owned_query[:2], owned_query[3])
+    ]
+    shared_files = (
+        [
+            dict(zip(shared_query[2], file))
+            for file in fetch_all_shards(*shared_query[:2], shared_query[3])
         ]
+        if shared_query
+        else []
+    )
 
     return {"owned_files": owned_files, "shared_files": shared_files}
 
 
-@router.get("/download/{file_id}")
-async def download_file(
-    file_id: int,
+def _feed_user(current_user: dict) -> tuple:
+    user = fetch_one(
+        "SELECT id, role FROM users WHERE username = ?", (current_user["sub"],)
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user[0], user[1] == "admin"
+
+
+@router.get("/changes")
+@check_roles(["guest", "user", "admin"])
+def list_changes(
+    since: int,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    """
+    Changes to the user's listings after version ``since``.
+
+    Returns at most one page; while ``more`` is true the client asks again
+    with the returned ``version``. If ``reset`` is true the changes are no
+    longer available and the client reloads /files/list instead.
+    """
+    return CHANGE_FEED.changes_since(*_feed_user(current_user), since)
+
+
+@router.get("/changes/stream")
+@check_roles(["guest", "user", "admin"])
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = None,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    """
+    Server-sent event stream of the user's listing changes.
+
+    Events have the shape of /files/changes replies. A reconnecting
+    EventSource resumes from its Last-Event-ID.
+    """
+    user_id, admin = _feed_user(current_user)
+    last_event_id = request.headers.get("last-event-id", "")
+    if since is None and last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(
+        CHANGE_FEED.stream(user_id, admin, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/search")
+@check_roles(["guest", "user", "admin"])
+def search_files(
+    q: str,
+    limit: int = 50,
+    offset: int = 0,
     current_user: dict = Depends(SecurityService.get_current_user),
 ):
+    match_query = build_search_query(q)
+    if not match_query:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    offset = max(0, offset)
+
+    user = fetch_one(
+        "SELECT id, role FROM users WHERE username = ?", (current_user["sub"],)
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_id, user_role = user[0], user[1]
+
+    # Each shard ranks its own matches; the first offset + limit + 1 of every
+    # shard are merged by rank and the requested page is cut from the merge.
+    if user_role == "admin":
+        query = """
+            SELECT f.id, f.filename, f.file_path, f.user_id, NULL, files_fts.rank
+            FROM files_fts
+            JOIN files f ON f.id = files_fts.rowid
+            WHERE files_fts MATCH ?
+            ORDER BY files_fts.rank
+            LIMIT ?
+            """
+        params = (match_query, offset + limit + 1)
+    else:
+        query = """
+            SELECT f.id, f.filename, f.file_path, f.user_id,
+                   CASE WHEN f.user_id = ? THEN NULL ELSE (
+                       SELECT fs.permissions FROM file_shares fs
+                       WHERE fs.file_id = f.id AND fs.shared_with = ?
+                       AND fs.expires_at > CURRENT_TIMESTAMP
+                       LIMIT 1
+                   ) END,
+                   files_fts.rank
+            FROM files_fts
+            JOIN files f ON f.id = files_fts.rowid
+            WHERE files_fts MATCH ? AND (
+                f.user_id = ? OR EXISTS (
+                    SELECT 1 FROM file_shares fs
+                    WHERE fs.file_id = f.id AND fs.shared_with = ?
+                    AND fs.expires_at > CURRENT_TIMESTAMP
+                )
+            )
+            ORDER BY files_fts.rank
+            LIMIT ?
+            """
+        params = (user_id, user_id, match_query, user_id, user_id, offset + limit + 1)
+    ranked = heapq.merge(
+        *(fetch_all(query, params, shard=shard) for shard in all_shards()),
+        key=lambda row: row[5],
+    )
+    rows = list(islice(ranked, offset, offset + limit + 1))
+
+    results = [
+        {
+            "id": row[0],
+            "filename": row[1],
+            "file_path": row[2],
+            "user_id": row[3],
+            "owned": row[3] == user_id,
+            "permission": row[4],
+        }
+        for row in rows[:limit]
+    ]
+    return {
+        "results": results,
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(rows) > limit,
+    }
+
+
+def authorize_download(file_id: int, current_user: dict):
+    """
+    Check that the current user may download a file.
+
+    Admins may download any file, owners their own, and other users files
+    shared with them with a permission other than "view".
+
+    Returns:
+        tuple: (filename, file_path, iv, salt, current_version)
+
+    Raises:
+        HTTPException: 404 if the user or file does not exist, 403 if access is denied
+    """
     user = fetch_one(
         "SELECT id, role FROM users WHERE username = ?", (current_user["sub"],)
     )
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     user_id, user_role = user[0], user[1]
+    shard = shard_for_row(file_id)
 
     if user_role == "admin":
-        file = fetch_one("SELECT * FROM files WHERE id = ?", (file_id,))
+        file = fetch_one("SELECT * FROM files WHERE id = ?", (file_id,), shard=shard)
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
     else:
@@ -228,6 +734,7 @@ async def download_file(
              (fs.file_id IS NOT NULL AND fs.expires_at > CURRENT_TIMESTAMP))
             """,
             (user_id, file_id, user_id),
+            shard=shard,
         )
 
         if not file_and_permission:
@@ -236,33 +743,270 @@ async def download_file(
         if file_and_permission[-1] == "view":
             raise HTTPException(status_code=403, detail="Download not permitted")
 
-        file = file_and_permission[:-1]
-
     file = fetch_one(
-        "SELECT filename, file_path, iv, salt FROM files WHERE id = ?", (file_id,)
+        "SELECT filename, file_path, iv, salt, current_version FROM files WHERE id = ?",
+        (file_id,),
+        shard=shard,
     )
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
+    return file
 
-    filename, file_path, iv, salt = file
 
-    headers = {
+def authorize_owner(file_id: int, current_user: dict) -> int:
+    """
+    Check that the current user owns a file, or is an admin.
+
+    Returns:
+        int: Id of the current user
+
+    Raises:
+        HTTPException: 404 if the user does not exist, 403 otherwise
+    """
+    user = fetch_one(
+        "SELECT id, role FROM users WHERE username = ?", (current_user["sub"],)
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    file = fetch_one(
+        "SELECT user_id FROM files WHERE id = ?",
+        (file_id,),
+        shard=shard_for_row(file_id),
+    )
+    if not file or (user[1] != "admin" and file[0] != user[0]):
+        raise HTTPException(status_code=403, detail="Not authorized for this file")
+    return user[0]
+
+
+def download_headers(filename: str, iv: bytes, salt: bytes) -> dict:
+    return {
         "X-IV": base64.b64encode(iv).decode("utf-8").strip(),
         "X-Salt": base64.b64encode(salt).decode("utf-8").strip(),
         "Content-Disposition": f'attachment; filename="{filename}"',
         "Access-Control-Expose-Headers": "X-IV, X-Salt",
     }
 
-    with open(file_path, "rb") as f:
-        encrypted_content = f.read()
-        decrypted_content = decrypt_file(encrypted_content, iv)
 
-    return Response(
-        content=decrypted_content,
+async def read_file_blob(file_id: int, file_path: str) -> tuple:
+    """
+    Read a file's ciphertext for a download and count the access.
+
+    Returns:
+        tuple: (ciphertext, task moving a cold blob back to the hot tier or None)
+    """
+    storage = get_storage()
+    encrypted_content, file_path = await read_blob(storage, file_id, file_path)
+    ACCESS_TRACKER.record(file_id)
+    promotion = None
+    if is_cold(file_path):
+        promotion = BackgroundTask(
+            promote, storage, file_id, file_path, encrypted_content
+        )
+    return encrypted_content, promotion
+
+
+def download_response(
+    body,
+    headers: dict,
+    flow: str,
+    kind: str = "user",
+    background: Optional[BackgroundTask] = None,
+):
+    """
+    Send a download body, paced by the bandwidth scheduler when it is enabled.
+
+    Args:
+        body (bytes | AsyncIterable[bytes]): Decrypted content
+        headers (dict): Response headers
+        flow (str): Scheduler flow the bytes are charged to
+        kind (str): Flow kind, "user" or "share"
+        background (BackgroundTask, optional): Task run after the response is sent
+    """
+    if not DOWNLOAD_SCHEDULER.enabled:
+        if isinstance(body, bytes):
+            return Response(
+                content=body,
+                headers=headers,
+                media_type="application/octet-stream",
+                background=background,
+            )
+        return StreamingResponse(
+            body,
+            headers=headers,
+            media_type="application/octet-stream",
+            background=background,
+        )
+    if isinstance(body, bytes):
+        headers["Content-Length"] = str(len(body))
+    return StreamingResponse(
+        shape(body, flow, kind),
         headers=headers,
         media_type="application/octet-stream",
+        background=background,
+    )
+
+
+def stream_version(
+    file_id: int, filename: str, version: tuple, flow: str
+) -> StreamingResponse:
+    _, file_path, iv, salt, size_bytes = version
+    headers = download_headers(filename, iv, salt)
+    if file_path is None:
+        headers["Content-Length"] = str(size_bytes)
+    return download_response(
+        get_chunk_store().read_version(file_id, version), headers, flow
+    )
+
+
+@router.get("/download/{file_id}")
+async def download_file(
+    file_id: int,
+    request: Request,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    with stage_timer("download_file", "db"):
+        filename, file_path, iv, salt, current_version = authorize_download(
+            file_id, current_user
+        )
+        if current_version is not None:
+            version = get_chunk_store().get_version(file_id, current_version)
+
+    if current_version is not None:
+        ACCESS_TRACKER.record(file_id)
+        AUDIT_LOG.record(
+            "download",
+            actor=current_user["sub"],
+            file_id=file_id,
+            ip=client_ip(request),
+        )
+        return stream_version(file_id, filename, version, f"user:{current_user['sub']}")
+
+    headers = download_headers(filename, iv, salt)
+
+    with stage_timer("download_file", "read"):
+        encrypted_content, promotion = await read_file_blob(file_id, file_path)
+    with stage_timer("download_file", "decrypt"):
+        decrypted_content = await run_in_threadpool(decrypt_file, encrypted_content, iv)
+    AUDIT_LOG.record(
+        "download", actor=current_user["sub"], file_id=file_id, ip=client_ip(request)
     )
 
+    return download_response(
+        decrypted_content,
+        headers,
+        f"user:{current_user['sub']}",
+        background=promotion,
+    )
+
+
+@router.get("/{file_id:int}/versions")
+def list_file_versions(
+    file_id: int, current_user: dict = Depends(SecurityService.get_current_user)
+):
+    authorize_download(file_id, current_user)
+    versions = get_chunk_store().versions(file_id)
+    if not versions:
+        current = fetch_one(
+            "SELECT MAX(size_bytes - ?, 0), created_at FROM files WHERE id = ?",
+            (GCM_TAG_BYTES, file_id),
+            shard=shard_for_row(file_id),
+        )
+        versions = [
+            {
+                "version": 1,
+                "size_bytes": current[0],
+                "created_at": current[1],
+                "chunks": 0,
+            }
+        ]
+    return {"file_id": file_id, "versions": versions}
+
+
+@router.post("/{file_id:int}/versions")
+@check_roles(["user", "admin"])
+async def upload_file_version(
+    file_id: int,
+    file: UploadFile = File(...),
+    iv: UploadFile = File(...),
+    salt: UploadFile = File(...),
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    enforce(UPLOAD_USER_LIMITER, f"user:{current_user['sub']}")
+    authorize_owner(file_id, current_user)
+    owner = fetch_one(
+        """
+        SELECT u.quota_bytes, COALESCE(s.bytes_used, 0) FROM files f
+        JOIN users u ON u.id = f.user_id
+        LEFT JOIN user_storage s ON s.user_id = u.id
+        WHERE f.id = ?
+        """,
+        (file_id,),
+        shard=shard_for_row(file_id),
+    )
+    check_quota(owner[0], owner[1], file.size or 0)
+
+    iv_bytes = await iv.read()
+    if len(iv_bytes) != 12:
+        raise HTTPException(
+            status_code=400, detail="Invalid IV size. Must be 12 bytes for AES GCM mode"
+        )
+    salt_bytes = await salt.read()
+
+    try:
+        result = await get_chunk_store().add_version(
+            file_id, _read_spool(file.file), iv_bytes, salt_bytes
+        )
+    except sqlite3.IntegrityError:
+        raise HTTPException(
+            status_code=409, detail="File was modified concurrently, retry"
+        )
+    return result
+
+
+@router.get("/{file_id:int}/versions/{version:int}")
+async def download_file_version(
+    file_id: int,
+    version: int,
+    request: Request,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    filename, file_path, iv, salt, current_version = authorize_download(
+        file_id, current_user
+    )
+    AUDIT_LOG.record(
+        "download", actor=current_user["sub"], file_id=file_id, ip=client_ip(request)
+    )
+    flow = f"user:{current_user['sub']}"
+    if current_version is None and version == 1:
+        encrypted_content, promotion = await read_file_blob(file_id, file_path)
+        return download_response(
+            await run_in_threadpool(decrypt_file, encrypted_content, iv),
+            download_headers(filename, iv, salt),
+            flow,
+            background=promotion,
+        )
+
+    row = get_chunk_store().get_version(file_id, version)
+    if not row:
+        raise HTTPException(status_code=404, detail="Version not found")
+    ACCESS_TRACKER.record(file_id)
+    return stream_version(file_id, filename, row, flow)
+
+
+@router.post("/{file_id:int}/versions/{version:int}/restore")
+@check_roles(["user", "admin"])
+def restore_file_version(
+    file_id: int,
+    version: int,
+    current_user: dict = Depends(SecurityService.get_current_user),
+):
+    authorize_owner(file_id, current_user)
+    try:
+        new_version = get_chunk_store().restore(file_id, version)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return {"message": "Version restored", "version": new_version}
+
 
 @router.delete("/delete/{file_id}")
 @check_roles(["user", "admin"])
@@ -275,12 +1019,15 @@ async def delete_file(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     user_id, user_role = user[0], user[1]
+    shard = shard_for_row(file_id)
 
     if user_role == "admin":
-        file = fetch_one("SELECT * FROM files WHERE id = ?", (file_id,))
+        file = fetch_one("SELECT * FROM files WHERE id = ?", (file_id,), shard=shard)
     else:
         file = fetch_one(
-            "SELECT * FROM files WHERE id = ? AND user_id = ?", (file_id, user_id)
+            "SELECT * FROM files WHERE id = ? AND user_id = ?",
+            (file_id, user_id),
+            shard=shard,
         )
 
     if not file:
@@ -288,36 +1035,50 @@ async def delete_file(
             status_code=403, detail="Not authorized to delete this file"
         )
 
-    try:
-        os.remove(file[3])
-    except FileNotFoundError:
-        pass
+    await get_chunk_store().release_files([file_id])
+    await get_storage().delete(file[3])
 
-    execute_query("DELETE FROM file_shares WHERE file_id = ?", (file_id,))
-    execute_query("DELETE FROM files WHERE id = ?", (file_id,))
+    recipients = fetch_all(
+        "SELECT DISTINCT shared_with FROM file_shares WHERE file_id = ? AND shared_with IS NOT NULL",
+        (file_id,),
+        shard=shard,
+    )
+    await execute_query_async("DELETE FROM share_tokens WHERE file_id = ?", (file_id,))
+    await execute_query_async(
+        "DELETE FROM file_shares WHERE file_id = ?", (file_id,), shard=shard
+    )
+    await execute_query_async("DELETE FROM files WHERE id = ?", (file_id,), shard=shard)
+    await CHANGE_FEED.publish_async(
+        [(file[2], "owned", file_id, None)]
+        + [(recipient, "shared", file_id, None) for (recipient,) in recipients]
+    )
 
     return {"message": "File deleted successfully"}
 
 
 @router.get("/shared/{token}")
-def access_shared_file(token: str, password: str):
+async def access_shared_file(token: str, password: str, request: Request):
     sanitized_token = sanitize_token(token)
     sanitized_password = sanitize_input(password)
 
-    file_data = fetch_one(
+    indexed = fetch_one(
+        "SELECT file_id FROM share_tokens WHERE token = ?", (sanitized_token,)
+    )
+    file_data = indexed and fetch_one(
         """
-        SELECT f.filename, f.file_path, f.iv, f.salt 
+        SELECT f.filename, f.file_path, f.iv, f.salt, f.id, fs.id
         FROM files f
         JOIN file_shares fs ON f.id = fs.file_id
         WHERE fs.token = ? AND fs.expires_at > CURRENT_TIMESTAMP
         """,
         (sanitized_token,),
+        shard=shard_for_row(indexed[0]),
     )
 
     if not file_data:
         raise HTTPException(status_code=404, detail="Invalid or expired share link")
 
-    filename, file_path, iv, salt = file_data
+    filename, file_path, iv, salt, file_id, share_id = file_data
 
     headers = {
         "X-IV": base64.b64encode(iv).decode("utf-8").strip(),
@@ -326,25 +1087,32 @@ def access_shared_file(token: str, password: str):
         "Access-Control-Expose-Headers": "X-IV, X-Salt, Content-Disposition",
     }
 
-    with open(file_path, "rb") as f:
-        encrypted_content = f.read()
-        decrypted_content = decrypt_file(encrypted_content, iv)
+    encrypted_content, promotion = await read_file_blob(file_id, file_path)
+    decrypted_content = await run_in_threadpool(decrypt_file, encrypted_content, iv)
+    AUDIT_LOG.record(
+        "shared_download", file_id=file_id, share_id=share_id, ip=client_ip(request)
+    )
 
-    return Response(
-        content=decrypted_content,
-        headers=headers,
-        media_type="application/octet-stream",
+    return download_response(
+        decrypted_content,
+        headers,
+        f"share:{share_id}",
+        kind="share",
+        background=promotion,
     )
 
 
 @router.delete("/revoke-share/{share_id}")
 def revoke_share(
-    share_id: int, current_user: dict = Depends(SecurityService.get_current_user)
+    share_id: int,
+    request: Request,
+    current_user: dict = Depends(SecurityService.get_current_user),
 ):
     user = fetch_one("SELECT id FROM users WHERE username = ?", (current_user["sub"],))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    shard = shard_for_row(share_id)
     share = fetch_one(
         """
         SELECT fs.* FROM file_shares fs
@@ -352,6 +1120,7 @@ def revoke_share(
         WHERE fs.id = ? AND f.user_id = ?
         """,
         (share_id, user[0]),
+        shard=shard,
     )
 
     if not share:
@@ -359,5 +1128,16 @@ def revoke_share(
             status_code=403, detail="Not authorized to revoke this share"
         )
 
-    execute_query("DELETE FROM file_shares WHERE id = ?", (share_id,))
+    execute_query("DELETE FROM file_shares WHERE id = ?", (share_id,), shard=shard)
+    execute_query("DELETE FROM share_tokens WHERE share_id = ?", (share_id,))
+    EXPIRY_WHEEL.cancel("share", share_id)
+    if share[3] is not None:
+        CHANGE_FEED.publish(shared_listing_changes(shard, [(share[1], share[3])]))
+    AUDIT_LOG.record(
+        "share_revoke",
+        actor=current_user["sub"],
+        file_id=share[1],
+        share_id=share_id,
+        ip=client_ip(request),
+    )
     return {"message": "Share access revoked successfully"}
@@ -0,0 +1,295 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional
+
+from app.services.metrics import REGISTRY
+
+AUDIT_DATABASE_PATH = os.environ.get(
+    "AUDIT_DATABASE_PATH", os.path.join(os.path.dirname(__file__), "audit.db")
+)
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL_SECONDS", "0.5"))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "1000"))
+AUDIT_MAX_BUFFER = int(os.environ.get("AUDIT_MAX_BUFFER", "100000"))
+AUDIT_RETENTION_DAYS = float(os.environ.get("AUDIT_RETENTION_DAYS", "90"))
+AUDIT_COMPACTION_INTERVAL = float(
+    os.environ.get("AUDIT_COMPACTION_INTERVAL_SECONDS", "3600")
+)
+
+AUDIT_EVENTS = REGISTRY.counter(
+    "audit_events_total", "Audit events recorded, by action.", ("action",)
+)
+AUDIT_DROPPED = REGISTRY.counter(
+    "audit_events_dropped_total", "Audit events dropped because the buffer was full."
+)
+AUDIT_FLUSH_DURATION = REGISTRY.histogram(
+    "audit_flush_duration_seconds", "Time spent writing one batch of audit events."
+)
+
+_COLUMNS = ("ts", "action", "actor", "file_id", "share_id", "target", "ip")
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    """
+    Append-only audit log with buffered, group-committed writes.
+
+    ``record`` only appends to an in-memory buffer. A background thread writes
+    the buffer to a separate SQLite database every ``flush_interval`` seconds,
+    or sooner once ``batch_size`` events are waiting, with one transaction per
+    batch. A crash loses at most the events of one flush interval. If the
+    writer falls behind by more than ``max_buffer`` events, new events are
+    dropped and counted rather than growing memory without bound.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        max_buffer: int = AUDIT_MAX_BUFFER,
+        retention_days: float = AUDIT_RETENTION_DAYS,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.retention_days = retention_days
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._initialized = False
+        self._last_compaction = time.monotonic()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def init_db(self):
+        """Create the audit schema in its own database file."""
+        with self._connect() as conn:
+            conn.executescript(
+                """
+            CREATE TABLE IF NOT EXISTS audit_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                action TEXT NOT NULL,
+                actor TEXT,
+                file_id INTEGER,
+                share_id INTEGER,
+                target TEXT,
+                ip TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_events (ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_actor ON audit_events (actor, ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_events (action, ts);
+            CREATE INDEX IF NOT EXISTS idx_audit_file ON audit_events (file_id, ts);
+            """
+            )
+        self._initialized = True
+
+    def record(
+        self,
+        action: str,
+        actor: Optional[str] = None,
+        file_id: Optional[int] = None,
+        share_id: Optional[int] = None,
+        target: Optional[str] = None,
+        ip: Optional[str] = None,
+    ):
+        """
+        Buffer one audit event for the next group commit.
+
+        Args:
+            action (str): What happened, e.g. "download" or "share_revoke"
+            actor (str, optional): Username performing the action
+            file_id (int, optional): File involved
+            share_id (int, optional): Share involved
+            target (str, optional): Recipient username or other object of the action
+            ip (str, optional): Client address
+        """
+        event = (time.time(), action, actor, file_id, share_id, target, ip)
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                AUDIT_DROPPED.inc()
+                return
+            self._buffer.append(event)
+            pending = len(self._buffer)
+            if self._writer is None:
+                self._start_writer()
+        AUDIT_EVENTS.inc(action=action)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _start_writer(self):
+        self._stopped.clear()
+        self._writer = threading.Thread(
+            target=self._run, name="audit-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if (
+                    time.monotonic() - self._last_compaction
+                    >= AUDIT_COMPACTION_INTERVAL
+                ):
+                    self.compact()
+            except Exception:
+                # A failed write must not stop the writer; flush kept the
+                # batch, so it is retried on the next interval.
+                logger.exception("Writing audit events failed")
+
+    def flush(self) -> int:
+        """
+        Write every buffered event in one transaction.
+
+        If the write fails, the batch goes back to the front of the buffer
+        and the error is raised.
+
+        Returns:
+            int: Number of events written
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                batch, self._buffer = self._buffer, deque()
+
+            try:
+                if not self._initialized:
+                    self.init_db()
+                with AUDIT_FLUSH_DURATION.time():
+                    with self._connect() as conn:
+                        conn.executemany(
+                            f"INSERT INTO audit_events ({', '.join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            batch,
+                        )
+            except Exception:
+                with self._lock:
+                    batch.extend(self._buffer)
+                    self._buffer = batch
+                raise
+            return len(batch)
+
+    def compact(self, retention_days: Optional[float] = None) -> int:
+        """
+        Apply the retention policy and return freed pages to the filesystem.
+
+        Events older than the retention period are deleted in bounded chunks so
+        the writer never holds the database lock for long.
+
+        Args:
+            retention_days (float, optional): Override for the configured retention
+
+        Returns:
+            int: Number of events deleted
+        """
+        self._last_compaction = time.monotonic()
+        if retention_days is None:
+            retention_days = self.retention_days
+        if not self._initialized:
+            self.init_db()
+
+        cutoff = time.time() - retention_days * 86400
+        deleted = 0
+        with self._connect() as conn:
+            while True:
+                cursor = conn.execute(
+                    """
+                    DELETE FROM audit_events WHERE id IN (
+                        SELECT id FROM audit_events WHERE ts < ? ORDER BY ts LIMIT 10000
+                    )
+                    """,
+                    (cutoff,),
+                )
+                conn.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < 10000:
+                    break
+            if deleted:
+                conn.execute("PRAGMA incremental_vacuum")
+        return deleted
+
+    def query(
+        self,
+        actor: Optional[str] = None,
+        action: Optional[str] = None,
+        file_id: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        before_id: Optional[int] = None,
+        limit: int = 100,
+    ) -> List[dict]:
+        """
+        Return matching events, newest first.
+
+        Pending events are flushed first so the result includes everything
+        recorded before the call. Use the smallest returned ``id`` as
+        ``before_id`` to fetch the next page.
+        """
+        self.flush()
+        if not self._initialized:
+            self.init_db()
+
+        conditions, params = [], []
+        for column, value in (
+            ("actor", actor),
+            ("action", action),
+            ("file_id", file_id),
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("ts < ?")
+            params.append(until)
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id, {', '.join(_COLUMNS)} FROM audit_events {where} ORDER BY id DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [dict(zip(("id",) + _COLUMNS, row)) for row in rows]
+
+    def close(self):
+        """Stop the writer thread and flush what is left."""
+        self._stopped.set()
+        self._wakeup.set()
+        writer = self._writer
+        if writer is not None:
+            writer.join(timeout=5)
+        self._writer = None
+        self.flush()
+
+
+AUDIT_LOG = AuditLog(AUDIT_DATABASE_PATH)
+atexit.register(AUDIT_LOG.close)
@@ -0,0 +1,402 @@
+"""
+Online, incremental backups of the databases and blobs.
+
+Each backup is a directory under ``BACKUP_DIRECTORY`` holding a snapshot of
+every database file and a ``manifest.json``. Blobs are copied once into the
+shared ``blobs/`` store next to the backups, under their storage key, and are
+never deleted by later backups, so every snapshot stays restorable::
+
+    python -m app.services.backup create
+    python -m app.services.backup list
+    python -m app.services.backup restore 20261019T120000Z
+
+The databases are copied with SQLite's online backup API from one read
+transaction, so all files come from the same moment and writers are not
+blocked (the databases run in WAL mode). Triggers record the storage key of
+every blob added in ``blob_journal``; a backup copies the journaled keys since
+the previous backup that its snapshot still references, or every referenced
+key for the first backup. Blob copies run ``BACKUP_WORKERS`` at a time and,
+together with the database copy, are capped at ``BACKUP_BYTES_PER_SECOND``.
+
+Restoring needs the service stopped: it writes the snapshot over
+``DATABASE_PATH`` (and the shard files) and copies back blobs that are missing
+from storage.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+from app.services.database import (
+    DATABASE_PATH,
+    DB_SHARDS,
+    execute_query,
+    shard_path,
+)
+from app.services.ratelimit import TokenBucketLimiter, throttle_stream
+from app.services.storage import CHUNK_SIZE, LocalStorage, StorageBackend
+
+BACKUP_DIRECTORY = os.environ.get("BACKUP_DIRECTORY", "backups")
+BACKUP_WORKERS = int(os.environ.get("BACKUP_WORKERS", "4"))
+BACKUP_BYTES_PER_SECOND = int(
+    os.environ.get("BACKUP_BYTES_PER_SECOND", str(50 * 1024 * 1024))
+)
+BACKUP_PAGES_PER_STEP = 256
+BLOB_STORE_NAME = "blobs"
+MANIFEST_NAME = "manifest.json"
+MAX_REPORTED_MISSING = 1000
+
+_REFERENCED_KEYS = """
+    SELECT file_path FROM files
+    UNION SELECT file_path FROM file_versions WHERE file_path IS NOT NULL
+    UNION SELECT storage_key FROM chunks
+"""
+
+
+def _database_files() -> List[tuple]:
+    """``(schema name, backup file name, live path, has blob tables)`` per database."""
+    if DB_SHARDS == 1:
+        return [("main", "main.db", DATABASE_PATH, True)]
+    return [("main", "main.db", DATABASE_PATH, False)] + [
+        (f"shard{shard}", f"shard{shard}.db", shard_path(shard), True)
+        for shard in range(DB_SHARDS)
+    ]
+
+
+def blob_path(blob_root: str, key: str) -> str:
+    """Location of the copy of blob ``key`` in a backup blob store."""
+    relative = os.path.normpath(key.lstrip("/\\"))
+    if relative == ".." or relative.startswith(".." + os.sep):
+        raise ValueError(f"Storage key escapes the blob store: {key}")
+    return os.path.join(blob_root, relative)
+
+
+def list_backups(backup_root: str = BACKUP_DIRECTORY) -> List[dict]:
+    """Manifests of completed backups, oldest first."""
+    if not os.path.isdir(backup_root):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(backup_root)):
+        path = os.path.join(backup_root, name, MANIFEST_NAME)
+        if os.path.exists(path):
+            with open(path) as handle:
+                manifests.append(json.load(handle))
+    return manifests
+
+
+def _byte_limiter(bytes_per_second: int) -> Optional[TokenBucketLimiter]:
+    if not bytes_per_second:
+        return None
+    return TokenBucketLimiter(
+        "backup",
+        rate=bytes_per_second,
+        burst=max(bytes_per_second, CHUNK_SIZE),
+        max_keys=1,
+    )
+
+
+def snapshot_databases(
+    target: str, limiter: Optional[TokenBucketLimiter] = None
+) -> dict:
+    """
+    Copy every database into ``target`` as of a single moment.
+
+    Returns:
+        dict: ``{schema name: {"file", "journal_seq"}}``; ``journal_seq`` is
+        the last ``blob_journal`` entry included, or None for databases
+        without blob tables
+    """
+    databases = _database_files()
+    source = sqlite3.connect(DATABASE_PATH, isolation_level=None)
+    try:
+        for name, _, path, _ in databases[1:]:
+            source.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+        # Reading every schema inside one transaction pins one WAL snapshot
+        # per file; the backup API then copies exactly those snapshots.
+        source.execute("BEGIN")
+        snapshot = {}
+        for name, filename, _, has_blobs in databases:
+            seq = None
+            source.execute(f"SELECT COUNT(*) FROM {name}.sqlite_master").fetchone()
+            if has_blobs:
+                seq = source.execute(
+                    f"SELECT COALESCE(MAX(seq), 0) FROM {name}.blob_journal"
+                ).fetchone()[0]
+            snapshot[name] = {"file": filename, "journal_seq": seq}
+
+        page_size = source.execute("PRAGMA page_size").fetchone()[0]
+
+        def pace(status, remaining, total):
+            if limiter:
+                nbytes = BACKUP_PAGES_PER_STEP * page_size
+                while nbytes > 0:
+                    cost = min(nbytes, limiter.burst)
+                    wait_seconds = limiter.acquire(limiter.name, cost)
+                    if wait_seconds:
+                        time.sleep(wait_seconds)
+                        continue
+                    nbytes -= cost
+
+        for name, filename, _, _ in databases:
+            destination = sqlite3.connect(os.path.join(target, filename))
+            try:
+                source.backup(
+                    destination, pages=BACKUP_PAGES_PER_STEP, progress=pace, name=name
+                )
+            finally:
+                destination.close()
+        source.execute("COMMIT")
+    finally:
+        source.close()
+    return snapshot
+
+
+def _keys_to_copy(snapshot_file: str, since_seq: Optional[int]) -> Iterator[str]:
+    conn = sqlite3.connect(f"file:{snapshot_file}?mode=ro", uri=True)
+    try:
+        if since_seq is None:
+            rows = conn.execute(_REFERENCED_KEYS)
+        else:
+            rows = conn.execute(
+                f"""
+                SELECT DISTINCT storage_key FROM blob_journal
+                WHERE seq > ? AND storage_key IN ({_REFERENCED_KEYS})
+                """,
+                (since_seq,),
+            )
+        for (key,) in rows:
+            yield key
+    finally:
+        conn.close()
+
+
+async def _for_each(items: Iterator, handler, workers: int):
+    # The workers share one iterator, so items are produced lazily.
+    async def worker():
+        for item in items:
+            await handler(item)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
+async def _copy_blobs(
+    storage: StorageBackend,
+    keys: Iterator[str],
+    blob_root: str,
+    workers: int,
+    limiter: Optional[TokenBucketLimiter],
+) -> dict:
+    store = LocalStorage(blob_root, io_threads=workers)
+    report = {"copied": 0, "bytes": 0, "present": 0, "missing": 0}
+    missing = []
+
+    async def copy(key: str):
+        destination = blob_path(blob_root, key)
+        if os.path.exists(destination):
+            report["present"] += 1
+            return
+        await asyncio.to_thread(
+            os.makedirs, os.path.dirname(destination), exist_ok=True
+        )
+        try:
+            size = await store.write(
+                destination, throttle_stream(storage.read(key), limiter)
+            )
+        except FileNotFoundError:
+            # Deleted between the snapshot and the copy.
+            report["missing"] += 1
+            if len(missing) < MAX_REPORTED_MISSING:
+                missing.append(key)
+            return
+        report["copied"] += 1
+        report["bytes"] += size
+
+    try:
+        await _for_each(keys, copy, workers)
+    finally:
+        await store.close()
+    report["missing_sample"] = missing
+    return report
+
+
+async def create_backup(
+    storage: StorageBackend,
+    backup_root: str = BACKUP_DIRECTORY,
+    workers: int = BACKUP_WORKERS,
+    bytes_per_second: int = BACKUP_BYTES_PER_SECOND,
+    full: bool = False,
+) -> dict:
+    """
+    Take a consistent backup, copying only blobs added since the last one.
+
+    Args:
+        storage (StorageBackend): Storage the blobs are read from
+        backup_root (str): Directory holding the backups and the blob store
+        workers (int): Blob copies in flight
+        bytes_per_second (int): Combined copy rate cap; 0 for no cap
+        full (bool): Check every referenced blob, not just journaled ones
+
+    Returns:
+        dict: The backup's manifest
+    """
+    started = time.monotonic()
+    created = datetime.now(timezone.utc)
+    backup_id = created.strftime("%Y%m%dT%H%M%S%fZ")
+    target = os.path.join(backup_root, backup_id)
+    os.makedirs(target)
+    previous = list_backups(backup_root)
+    previous = previous[-1] if previous and not full else None
+
+    limiter = _byte_limiter(bytes_per_second)
+    snapshot = await asyncio.to_thread(snapshot_databases, target, limiter)
+
+    blobs = {"copied": 0, "bytes": 0, "present": 0, "missing": 0, "missing_sample": []}
+    for name, database in snapshot.items():
+        if database["journal_seq"] is None:
+            continue
+        since = None
+        if previous and name in previous["databases"]:
+            since = previous["databases"][name]["journal_seq"]
+        report = await _copy_blobs(
+            storage,
+            _keys_to_copy(os.path.join(target, database["file"]), since),
+            os.path.join(backup_root, BLOB_STORE_NAME),
+            workers,
+            limiter,
+        )
+        for field in ("copied", "bytes", "present", "missing"):
+            blobs[field] += report[field]
+        blobs["missing_sample"].extend(report["missing_sample"])
+
+    manifest = {
+        "id": backup_id,
+        "created_at": created.isoformat(),
+        "previous": previous["id"] if previous else None,
+        "shards": DB_SHARDS,
+        "databases": snapshot,
+        "blobs": blobs,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    temp_path = os.path.join(target, f"{MANIFEST_NAME}.part")
+    with open(temp_path, "w") as handle:
+        json.dump(manifest, handle, indent=2)
+    os.replace(temp_path, os.path.join(target, MANIFEST_NAME))
+
+    # The journal is only trimmed once the manifest that covers it exists.
+    blob_databases = [name for name, _, _, has_blobs in _database_files() if has_blobs]
+    for shard, name in enumerate(blob_databases):
+        execute_query(
+            "DELETE FROM blob_journal WHERE seq <= ?",
+            (snapshot[name]["journal_seq"],),
+            shard=shard,
+        )
+    return manifest
+
+
+async def restore_backup(
+    storage: StorageBackend,
+    backup_id: str,
+    backup_root: str = BACKUP_DIRECTORY,
+    workers: int = BACKUP_WORKERS,
+) -> dict:
+    """
+    Restore the databases of a backup and any of its blobs missing from storage.
+
+    Returns:
+        dict: Counts of restored and missing blobs
+    """
+    target = os.path.join(backup_root, backup_id)
+    with open(os.path.join(target, MANIFEST_NAME)) as handle:
+        manifest = json.load(handle)
+    if manifest["shards"] != DB_SHARDS:
+        raise ValueError(
+            f"Backup has {manifest['shards']} shards, DB_SHARDS is {DB_SHARDS}"
+        )
+
+    live_paths = {name: path for name, _, path, _ in _database_files()}
+    for name, database in manifest["databases"].items():
+        path = live_paths[name]
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        shutil.copyfile(os.path.join(target, database["file"]), path)
+
+    blob_root = os.path.join(backup_root, BLOB_STORE_NAME)
+    report = {"restored": 0, "present": 0, "missing": 0}
+
+    async def restore(key: str):
+        if await storage.exists(key):
+            report["present"] += 1
+            return
+        source = blob_path(blob_root, key)
+        if not os.path.exists(source):
+            report["missing"] += 1
+            return
+        await storage.write(key, _read_file(source))
+        report["restored"] += 1
+
+    for database in manifest["databases"].values():
+        if database["journal_seq"] is not None:
+            keys = _keys_to_copy(os.path.join(target, database["file"]), None)
+            await _for_each(keys, restore, workers)
+    return report
+
+
+async def _read_file(path: str):
+    with open(path, "rb") as handle:
+        while chunk := await asyncio.to_thread(handle.read, CHUNK_SIZE):
+            yield chunk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Back up or restore the service.")
+    parser.add_argument("command", choices=("create", "list", "restore"))
+    parser.add_argument("backup_id", nargs="?")
+    parser.add_argument("--directory", default=BACKUP_DIRECTORY)
+    parser.add_argument("--workers", type=int, default=BACKUP_WORKERS)
+    parser.add_argument("--bytes-per-second", type=int, default=BACKUP_BYTES_PER_SECOND)
+    parser.add_argument(
+        "--full", action="store_true", help="Check every blob, not just new ones"
+    )
+    args = parser.parse_args(argv)
+
+    from app.services.database import migrate
+    from app.services.storage import get_storage
+
+    if args.command == "list":
+        print(json.dumps(list_backups(args.directory), indent=2))
+        return
+    if args.command == "restore" and not args.backup_id:
+        parser.error("restore needs a backup id")
+    if args.command == "create":
+        migrate()
+
+    storage = get_storage()
+
+    async def run():
+        try:
+            if args.command == "create":
+                return await create_backup(
+                    storage,
+                    args.directory,
+                    args.workers,
+                    args.bytes_per_second,
+                    args.full,
+                )
+            return await restore_backup(
+                storage, args.backup_id, args.directory, args.workers
+            )
+        finally:
+            await storage.close()
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
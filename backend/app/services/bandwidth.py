@@ -0,0 +1,266 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterable, AsyncIterator, Callable, Optional, Union
+
+from app.services.metrics import REGISTRY
+
+DOWNLOAD_RATE_BYTES = float(os.environ.get("DOWNLOAD_RATE_BYTES_PER_SECOND", "0"))
+DOWNLOAD_FLOW_RATE_BYTES = float(
+    os.environ.get("DOWNLOAD_USER_RATE_BYTES_PER_SECOND", "0")
+)
+DOWNLOAD_QUANTUM_BYTES = int(os.environ.get("DOWNLOAD_QUANTUM_BYTES", str(64 * 1024)))
+DOWNLOAD_BURST_SECONDS = float(os.environ.get("DOWNLOAD_BURST_SECONDS", "0.25"))
+
+DOWNLOAD_QUEUE_WAIT = REGISTRY.histogram(
+    "download_queue_wait_seconds",
+    "Time a download chunk waited for the bandwidth scheduler, by flow kind.",
+    ("kind",),
+)
+DOWNLOAD_BYTES = REGISTRY.counter(
+    "download_scheduled_bytes_total",
+    "Bytes released by the bandwidth scheduler, by flow kind.",
+    ("kind",),
+)
+
+
+class _Bucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, size: int) -> float:
+        # A chunk larger than the burst is let through once the bucket is
+        # full and leaves it in debt, so oversized chunks cannot starve.
+        needed = min(size, self.burst)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+
+class _Flow:
+    __slots__ = ("key", "waiters", "deficit", "active", "bucket")
+
+    def __init__(self, key: str, bucket: Optional[_Bucket]):
+        self.key = key
+        self.waiters: deque = deque()
+        self.deficit = 0
+        self.active = False
+        self.bucket = bucket
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FairShareScheduler:
+    """
+    Deficit-round-robin bandwidth scheduler for download streams.
+
+    Each flow (a user, or a public share link) queues the chunks its streams
+    want to send. Flows with queued chunks are visited in turn and each visit
+    earns the flow ``quantum`` bytes of credit, so a flow pulling a 10 GB
+    file gets the same share of the global rate as one fetching a 10 KB file,
+    and the small download finishes after a handful of rounds instead of
+    behind the large one. A global token bucket (``rate``) caps total
+    throughput and an optional per-flow bucket (``flow_rate``) caps each flow.
+
+    A rate of 0 disables that limit; with both at 0, ``acquire`` returns at
+    once. Dispatch runs inline in ``acquire`` and from a timer on the event
+    loop while chunks are waiting for tokens.
+    """
+
+    def __init__(
+        self,
+        rate: float = DOWNLOAD_RATE_BYTES,
+        flow_rate: float = DOWNLOAD_FLOW_RATE_BYTES,
+        quantum: int = DOWNLOAD_QUANTUM_BYTES,
+        burst_seconds: float = DOWNLOAD_BURST_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.flow_rate = flow_rate
+        self.quantum = quantum
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self.enabled = rate > 0 or flow_rate > 0
+        self._global = (
+            _Bucket(rate, max(quantum, rate * burst_seconds), clock()) if rate else None
+        )
+        self._flow_burst = max(quantum, flow_rate * burst_seconds)
+        self._flows: "OrderedDict[str, _Flow]" = OrderedDict()
+        self._active: deque = deque()
+        self._wakeup_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    async def acquire(self, key: str, size: int, kind: str = "user"):
+        """
+        Wait until ``size`` bytes of flow ``key`` may be sent.
+
+        Args:
+            key (str): Flow identifier, e.g. "user:alice" or "share:17"
+            size (int): Bytes about to be sent
+            kind (str): Flow kind, used as the metrics label
+        """
+        if not self.enabled:
+            return
+        future = asyncio.get_running_loop().create_future()
+        queued = self.clock()
+        with self._lock:
+            flow = self._flows.get(key)
+            if flow is None:
+                bucket = (
+                    _Bucket(self.flow_rate, self._flow_burst, queued)
+                    if self.flow_rate
+                    else None
+                )
+                flow = self._flows[key] = _Flow(key, bucket)
+            flow.waiters.append((size, future))
+            if not flow.active:
+                flow.active = True
+                self._active.append(flow)
+        self._dispatch()
+        await future
+        DOWNLOAD_QUEUE_WAIT.observe(self.clock() - queued, kind=kind)
+        DOWNLOAD_BYTES.inc(size, kind=kind)
+
+    def _dispatch(self):
+        granted = []
+        with self._lock:
+            now = self.clock()
+            if self._wakeup_at is not None and now >= self._wakeup_at:
+                self._wakeup_at = None
+            if self._global:
+                self._global.refill(now)
+            wait = None
+            blocked = 0
+            while self._active and blocked < len(self._active):
+                flow = self._active[0]
+                while flow.waiters and flow.waiters[0][1].done():
+                    flow.waiters.popleft()
+                if not flow.waiters:
+                    self._active.popleft()
+                    flow.active = False
+                    flow.deficit = 0
+                    continue
+                size, future = flow.waiters[0]
+                if flow.bucket:
+                    flow.bucket.refill(now)
+                    flow_wait = flow.bucket.wait(size)
+                    if flow_wait:
+                        wait = flow_wait if wait is None else min(wait, flow_wait)
+                        blocked += 1
+                        self._active.rotate(-1)
+                        continue
+                if self._global:
+                    global_wait = self._global.wait(size)
+                    if global_wait:
+                        wait = global_wait if wait is None else min(wait, global_wait)
+                        break
+                if flow.deficit < size:
+                    flow.deficit += self.quantum
+                    blocked = 0
+                if flow.deficit >= size:
+                    flow.waiters.popleft()
+                    flow.deficit -= size
+                    for bucket in (flow.bucket, self._global):
+                        if bucket:
+                            bucket.tokens -= size
+                    self._flows.move_to_end(flow.key)
+                    granted.append(future)
+                    blocked = 0
+                    if flow.waiters and flow.deficit >= flow.waiters[0][0]:
+                        continue
+                self._active.rotate(-1)
+            self._evict_idle(now)
+            if self._active and wait is not None:
+                self._schedule_wakeup(now, wait)
+
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        for future in granted:
+            loop = future.get_loop()
+            if loop is current:
+                _resolve(future)
+            else:
+                loop.call_soon_threadsafe(_resolve, future)
+
+    def _schedule_wakeup(self, now: float, wait: float):
+        when = now + wait
+        if self._wakeup_at is not None and self._wakeup_at <= when:
+            return
+        self._wakeup_at = when
+        loop = self._active[0].waiters[0][1].get_loop()
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        if loop is current:
+            loop.call_later(wait, self._wakeup)
+        else:
+            loop.call_soon_threadsafe(loop.call_later, wait, self._wakeup)
+
+    def _wakeup(self):
+        with self._lock:
+            self._wakeup_at = None
+        self._dispatch()
+
+    def _evict_idle(self, now: float):
+        # An idle flow whose bucket has refilled is indistinguishable from a
+        # new one; flows are kept in last-send order, so the scan stops at the
+        # first one still in use.
+        idle_seconds = self._flow_burst / self.flow_rate if self.flow_rate else 0.0
+        while self._flows:
+            flow = next(iter(self._flows.values()))
+            if flow.active or (
+                flow.bucket and now - flow.bucket.updated < idle_seconds
+            ):
+                break
+            self._flows.popitem(last=False)
+
+    def __len__(self):
+        return len(self._flows)
+
+
+DOWNLOAD_SCHEDULER = FairShareScheduler()
+
+
+async def shape(
+    content: Union[bytes, AsyncIterable[bytes]],
+    key: str,
+    kind: str,
+    scheduler: FairShareScheduler = DOWNLOAD_SCHEDULER,
+) -> AsyncIterator[bytes]:
+    """
+    Yield ``content`` in quantum-sized pieces as the scheduler releases them.
+
+    Args:
+        content (bytes | AsyncIterable[bytes]): Response body
+        key (str): Flow the bytes are charged to
+        kind (str): Flow kind, "user" or "share"
+    """
+
+    async def pieces():
+        if isinstance(content, (bytes, bytearray)):
+            yield content
+        else:
+            async for chunk in content:
+                yield chunk
+
+    async for chunk in pieces():
+        view = memoryview(chunk)
+        for offset in range(0, len(view), scheduler.quantum):
+            piece = view[offset : offset + scheduler.quantum]
+            await scheduler.acquire(key, len(piece), kind)
+            yield bytes(piece)
@@ -0,0 +1,317 @@
+"""
+Change feed for file listings.
+
+Every upload, share, revoke, expiry and delete appends one row per affected
+listing entry to ``file_changes`` in the global database. The row's
+AUTOINCREMENT id is its version, so versions increase monotonically across
+all shards. A client loads ``/files/list`` once, notes the version sent
+with it, and from then on applies only the changes after that version, from
+``/files/changes`` or the server-sent event stream at
+``/files/changes/stream``.
+
+A change either upserts an entry of the "owned" or "shared" list, or
+removes it (``file`` is null). Admins list every file as owned, so they
+receive the "owned" changes of all users; owned entries carry
+``owner_username`` for them. Only the newest
+``CHANGE_FEED_RETENTION`` changes are kept; a client further behind is told
+to reset, i.e. to reload the full list.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+from app.services.database import (
+    execute_many,
+    execute_many_async,
+    execute_query,
+    fetch_all,
+    fetch_one,
+)
+from app.services.metrics import REGISTRY
+from app.utils.streaming import encode_json
+
+CHANGE_FEED_RETENTION = int(os.environ.get("CHANGE_FEED_RETENTION", "100000"))
+CHANGE_FEED_PAGE_SIZE = int(os.environ.get("CHANGE_FEED_PAGE_SIZE", "1000"))
+CHANGE_FEED_HEARTBEAT_SECONDS = float(
+    os.environ.get("CHANGE_FEED_HEARTBEAT_SECONDS", "15")
+)
+
+CHANGE_EVENTS = REGISTRY.counter(
+    "file_change_events_total", "File listing changes published, by list.", ("list",)
+)
+CHANGE_SUBSCRIBERS = REGISTRY.gauge(
+    "file_change_subscribers", "Open change feed streams."
+)
+
+FILE_ENTRY_KEYS = ("id", "filename", "file_path", "user_id")
+PUBLISH_QUERY = (
+    "INSERT INTO file_changes (user_id, list, file_id, entry) VALUES (?, ?, ?, ?)"
+)
+
+
+class _Subscriber:
+    __slots__ = ("loop", "event")
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # The subscriber's event loop has already closed.
+            pass
+
+
+class ChangeFeed:
+    """
+    Versioned log of listing changes with in-process wakeups for streams.
+
+    ``publish`` is for request threads and ``publish_async`` for the event
+    loop.
+    Open streams are woken as soon as a change for their user is committed;
+    streams served by other workers notice it on their next heartbeat, when
+    they poll the log as well.
+    """
+
+    def __init__(
+        self,
+        retention: int = CHANGE_FEED_RETENTION,
+        page_size: int = CHANGE_FEED_PAGE_SIZE,
+        heartbeat_seconds: float = CHANGE_FEED_HEARTBEAT_SECONDS,
+    ):
+        self.retention = retention
+        self.page_size = page_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self._subscribers: Dict[Optional[int], Set[_Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._published = 0
+
+    def publish(self, changes: Iterable[tuple]):
+        """
+        Append listing changes and wake the streams that should see them.
+
+        Args:
+            changes (Iterable[tuple]): (user_id, list, file_id, entry) tuples,
+                where list is "owned" or "shared" and entry is the listing
+                entry, or None when the file leaves the user's list
+        """
+        rows = self._rows(changes)
+        if not rows:
+            return
+        execute_many(PUBLISH_QUERY, rows)
+        if self._notify(rows):
+            self.trim()
+
+    async def publish_async(self, changes: Iterable[tuple]):
+        """``publish`` for the event loop: waits for the commit without blocking."""
+        rows = self._rows(changes)
+        if not rows:
+            return
+        await execute_many_async(PUBLISH_QUERY, rows)
+        if self._notify(rows):
+            await run_in_threadpool(self.trim)
+
+    @staticmethod
+    def _rows(changes: Iterable[tuple]) -> list:
+        return [
+            (
+                user_id,
+                list_name,
+                file_id,
+                None if entry is None else encode_json(entry).decode(),
+            )
+            for user_id, list_name, file_id, entry in changes
+        ]
+
+    def _notify(self, rows: list) -> bool:
+        # Wakes the streams the committed rows concern; True when it is time
+        # to trim the log.
+        for row in rows:
+            CHANGE_EVENTS.inc(list=row[1])
+
+        with self._lock:
+            self._published += len(rows)
+            trim = self._published >= max(1, self.retention // 10)
+            if trim:
+                self._published = 0
+            woken = set()
+            for user_id, list_name, _, _ in rows:
+                woken.update(self._subscribers.get(user_id, ()))
+                if list_name == "owned":
+                    woken.update(self._subscribers.get(None, ()))
+        for subscriber in woken:
+            subscriber.wake()
+        return trim
+
+    def trim(self):
+        """Drop all but the newest ``retention`` changes."""
+        execute_query(
+            "DELETE FROM file_changes WHERE version <= ?",
+            (self.current_version() - self.retention,),
+        )
+
+    def current_version(self) -> int:
+        """Version of the newest change, or 0 if nothing was published yet."""
+        row = fetch_one("SELECT seq FROM sqlite_sequence WHERE name = 'file_changes'")
+        return row[0] if row else 0
+
+    def changes_since(self, user_id: int, admin: bool, since: int) -> dict:
+        """
+        Changes to a user's listings after version ``since``.
+
+        Several changes to the same entry are collapsed into the last one, so
+        the reply is proportional to the number of entries that changed.
+
+        Args:
+            user_id (int): User whose listings are followed
+            admin (bool): Whether the user is an admin, who lists every file
+            since (int): Last version the client has applied
+
+        Returns:
+            dict: ``version`` to resume from, ``changes`` in version order,
+            ``more`` if another page is waiting, and ``reset`` if the client
+            must reload the full list because the changes were trimmed
+        """
+        latest = self.current_version()
+        oldest = fetch_one("SELECT MIN(version) FROM file_changes")[0]
+        if since > latest or (
+            since < latest and (oldest is None or oldest > since + 1)
+        ):
+            return {"version": latest, "changes": [], "more": False, "reset": True}
+
+        if admin:
+            condition, params = "list = 'owned'", ()
+        else:
+            condition, params = "user_id = ?", (user_id,)
+        rows = fetch_all(
+            f"""
+            SELECT version, list, file_id, entry FROM file_changes
+            WHERE version > ? AND {condition}
+            ORDER BY version LIMIT ?
+            """,
+            (since, *params, self.page_size),
+        )
+        more = len(rows) == self.page_size
+        collapsed: "OrderedDict[tuple, dict]" = OrderedDict()
+        for _, list_name, file_id, entry in rows:
+            key = (list_name, file_id)
+            collapsed.pop(key, None)
+            collapsed[key] = {
+                "list": list_name,
+                "file_id": file_id,
+                "file": None if entry is None else json.loads(entry),
+            }
+        version = rows[-1][0] if more else max(latest, rows[-1][0] if rows else 0)
+        return {
+            "version": version,
+            "changes": list(collapsed.values()),
+            "more": more,
+            "reset": False,
+        }
+
+    @contextmanager
+    def subscribe(self, user_id: int, admin: bool):
+        """Register a stream; yields the asyncio.Event set when changes arrive."""
+        subscriber = _Subscriber()
+        key = None if admin else user_id
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscriber)
+        CHANGE_SUBSCRIBERS.inc()
+        try:
+            yield subscriber.event
+        finally:
+            with self._lock:
+                subscribers = self._subscribers[key]
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[key]
+            CHANGE_SUBSCRIBERS.dec()
+
+    async def stream(
+        self, user_id: int, admin: bool, since: Optional[int]
+    ) -> AsyncIterator[bytes]:
+        """
+        Server-sent events carrying the user's changes as they happen.
+
+        The first event is sent straight away and carries the changes since
+        ``since`` (none if it is None), so the client learns the current
+        version. Each event's id is its version, which browsers send back as
+        Last-Event-ID when they reconnect. A comment line is sent every
+        ``heartbeat_seconds`` while nothing changes, to keep proxies from
+        closing the connection.
+        """
+        with self.subscribe(user_id, admin) as event:
+            if since is None:
+                since = await run_in_threadpool(self.current_version)
+            first = True
+            while True:
+                event.clear()
+                delta = await run_in_threadpool(
+                    self.changes_since, user_id, admin, since
+                )
+                if first or delta["changes"] or delta["reset"]:
+                    first = False
+                    since = delta["version"]
+                    yield (
+                        f"id: {since}\nevent: changes\ndata: ".encode()
+                        + encode_json(delta)
+                        + b"\n\n"
+                    )
+                    if delta["more"]:
+                        continue
+                try:
+                    await asyncio.wait_for(event.wait(), self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+
+
+CHANGE_FEED = ChangeFeed()
+
+
+def file_entry(file_id: int, filename: str, file_path: str, user_id: int, **extra):
+    """Listing entry of a file, as returned by /files/list."""
+    return dict(zip(FILE_ENTRY_KEYS, (file_id, filename, file_path, user_id)), **extra)
+
+
+def shared_listing_changes(shard: int, pairs: Iterable[tuple]) -> list:
+    """
+    Current "shared" entries for (file_id, user_id) pairs, for publishing.
+
+    A user keeps a file in their shared list while any of their shares of it
+    is unexpired, so after a share ends this yields an upsert with the
+    newest remaining share's permission, or a removal.
+
+    Args:
+        shard (int): Shard holding the files
+        pairs (Iterable[tuple]): (file_id, recipient user_id) pairs
+
+    Returns:
+        list: (user_id, "shared", file_id, entry or None) changes
+    """
+    changes = []
+    now = datetime.utcnow()
+    for file_id, user_id in dict.fromkeys(pairs):
+        row = fetch_one(
+            """
+            SELECT f.id, f.filename, f.file_path, f.user_id, fs.permissions
+            FROM files f
+            JOIN file_shares fs ON f.id = fs.file_id
+            WHERE f.id = ? AND fs.shared_with = ? AND fs.expires_at > ?
+            ORDER BY fs.id DESC LIMIT 1
+            """,
+            (file_id, user_id, now),
+            shard=shard,
+        )
+        entry = row and file_entry(*row[:4], permission=row[4])
+        changes.append((user_id, "shared", file_id, entry or None))
+    return changes
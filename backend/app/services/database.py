@@ -1,8 +1,49 @@
+import asyncio
 import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future
 from contextlib import contextmanager
+from functools import wraps
+from typing import List, Optional
 
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), "secure_file_sharing.db")
+from starlette.concurrency import run_in_threadpool
+
+from app.services.metrics import (
+    DB_CONNECTIONS_IN_USE,
+    DB_CONNECTIONS_OPENED,
+    DB_ERRORS,
+    DB_QUERY_DURATION,
+    DB_WRITE_BATCH_SIZE,
+    DB_WRITE_WAIT,
+)
+
+DATABASE_PATH = os.environ.get(
+    "DATABASE_PATH",
+    os.path.join(os.path.dirname(__file__), "secure_file_sharing.db"),
+)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_GROUP_COMMIT = os.environ.get("DB_GROUP_COMMIT", "1") == "1"
+DB_WRITE_BATCH_WINDOW = float(os.environ.get("DB_WRITE_BATCH_WINDOW_MS", "2")) / 1000
+DB_WRITE_MAX_BATCH = int(os.environ.get("DB_WRITE_MAX_BATCH", "256"))
+DB_SHARDS = max(1, int(os.environ.get("DB_SHARDS", "1")))
+
+
+def shard_path(index: int) -> str:
+    """Path of one shard database, next to ``DATABASE_PATH``."""
+    root, extension = os.path.splitext(DATABASE_PATH)
+    return f"{root}.shard{index}{extension or '.db'}"
+
+
+# With a single shard, the per-user tables live in DATABASE_PATH itself.
+SHARD_PATHS = (
+    [DATABASE_PATH] if DB_SHARDS == 1 else [shard_path(i) for i in range(DB_SHARDS)]
+)
+
+# Bump whenever init_db changes so that running deployments migrate on restart.
+SCHEMA_VERSION = 10
 
 
 def init_db():
@@ -11,106 +52,725 @@ def init_db():
 
     Creates the following tables:
     - users: Stores user account information
+    - share_tokens: Maps link-share tokens to their share and file
+    - file_changes: Versioned log of file listing changes, for the change feed
+    - packs, packed_blobs: Pack files holding small blobs and their contents
     - files: Stores uploaded file metadata
     - file_shares: Stores file sharing information
     - mfa_codes: Stores MFA codes for users
-    """
-    with sqlite3.connect(DATABASE_PATH) as conn:
-        cursor = conn.cursor()
+    - files_fts: FTS5 index over file names, kept in sync with files by triggers
+    - user_storage: Per-user stored bytes and file counts, maintained by triggers
+    - file_versions, version_chunks, chunks: File versions as manifests of
+      deduplicated content-defined chunks
+    - blob_journal: Storage keys of blobs added, for incremental backups
 
-        cursor.execute(
+    Databases are switched to WAL mode so that backups and other long reads
+    do not block writers.
+
+    With ``DB_SHARDS`` above 1, the first four live in ``DATABASE_PATH`` and
+    the rest in every shard database.
+    """
+    if DB_SHARDS == 1:
+        with sqlite3.connect(DATABASE_PATH) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            cursor = conn.cursor()
+            _create_global_schema(cursor)
+            _create_shard_schema(cursor)
+            cursor.executescript(
+                """
+            CREATE TRIGGER IF NOT EXISTS user_storage_user_delete AFTER DELETE ON users BEGIN
+                DELETE FROM user_storage WHERE user_id = old.id;
+            END;
+            INSERT OR IGNORE INTO share_tokens (token, share_id, file_id)
+            SELECT token, id, file_id FROM file_shares WHERE token IS NOT NULL;
             """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL DEFAULT 'user',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            mfa_enabled BOOLEAN DEFAULT 0
-        )
+            )
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        return
+
+    for path, create in [(DATABASE_PATH, _create_global_schema)] + [
+        (path, _create_shard_schema) for path in SHARD_PATHS
+    ]:
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            cursor = conn.cursor()
+            create(cursor)
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+
+
+def _create_global_schema(cursor):
+    """Create the tables every shard shares: accounts, share tokens, the change feed and packs."""
+    cursor.execute(
         """
-        )
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'user',
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        mfa_enabled BOOLEAN DEFAULT 0,
+        quota_bytes INTEGER
+    )
+    """
+    )
 
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            user_id INTEGER NOT NULL,
-            file_path TEXT NOT NULL,
-            iv BLOB NOT NULL,
-            salt BLOB NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
+    add_column_if_missing(cursor, "users", "quota_bytes", "INTEGER")
+
+    cursor.execute(
         """
-        )
+    CREATE TABLE IF NOT EXISTS share_tokens (
+        token TEXT PRIMARY KEY,
+        share_id INTEGER NOT NULL,
+        file_id INTEGER NOT NULL
+    )
+    """
+    )
+    # One log for all shards, so that versions are ordered globally.
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS file_changes (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        list TEXT NOT NULL,
+        file_id INTEGER NOT NULL,
+        entry TEXT
+    )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_file_changes_user ON file_changes (user_id, version)"
+    )
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS packs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'active',
+        total_bytes INTEGER NOT NULL DEFAULT 0,
+        live_bytes INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        retired_at TIMESTAMP
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS packed_blobs (
+        storage_key TEXT PRIMARY KEY,
+        pack_id INTEGER NOT NULL,
+        pack_offset INTEGER NOT NULL,
+        length INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """
+    )
 
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS file_shares (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_id INTEGER NOT NULL,
-            shared_by INTEGER NOT NULL,
-            shared_with INTEGER,
-            permissions TEXT NOT NULL,
-            token TEXT UNIQUE,
-            expires_at DATETIME,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (file_id) REFERENCES files (id),
-            FOREIGN KEY (shared_by) REFERENCES users (id),
-            FOREIGN KEY (shared_with) REFERENCES users (id)
-        )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_packed_blobs_pack ON packed_blobs (pack_id, pack_offset)"
+    )
+
+
+def _create_shard_schema(cursor):
+    """Create the per-user tables that are partitioned across shards."""
+    cursor.execute(
         """
-        )
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        file_path TEXT NOT NULL,
+        iv BLOB NOT NULL,
+        salt BLOB NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        size_bytes INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """
+    )
+
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS file_shares (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_id INTEGER NOT NULL,
+        shared_by INTEGER NOT NULL,
+        shared_with INTEGER,
+        permissions TEXT NOT NULL,
+        token TEXT UNIQUE,
+        expires_at DATETIME,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (file_id) REFERENCES files (id),
+        FOREIGN KEY (shared_by) REFERENCES users (id),
+        FOREIGN KEY (shared_with) REFERENCES users (id)
+    )
+    """
+    )
+
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS mfa_codes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        code TEXT NOT NULL,
+        expires_at DATETIME NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """
+    )
+
+    add_column_if_missing(cursor, "files", "size_bytes", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(cursor, "files", "last_verified_at", "DATETIME")
+    add_column_if_missing(cursor, "files", "integrity_status", "TEXT")
+    add_column_if_missing(cursor, "files", "current_version", "INTEGER")
+    add_column_if_missing(cursor, "files", "last_accessed_at", "DATETIME")
+    add_column_if_missing(cursor, "files", "access_count", "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(cursor, "mfa_codes", "attempts", "INTEGER NOT NULL DEFAULT 0")
+
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS file_versions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_id INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        file_path TEXT,
+        iv BLOB NOT NULL,
+        salt BLOB NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (file_id, version),
+        FOREIGN KEY (file_id) REFERENCES files (id)
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS version_chunks (
+        version_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        chunk_id TEXT NOT NULL,
+        PRIMARY KEY (version_id, seq)
+    ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS chunks (
+        chunk_id TEXT PRIMARY KEY,
+        storage_key TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        ref_count INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """
+    )
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_user_id ON files (user_id)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_file_shares_file_id ON file_shares (file_id, shared_with)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_files_last_verified ON files (last_verified_at, id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_files_file_path ON files (file_path)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chunks_storage_key ON chunks (storage_key)"
+    )
+
+    search_index_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'"
+    ).fetchone()
+    cursor.execute(
+        """
+    CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+        filename,
+        content = 'files',
+        content_rowid = 'id',
+        prefix = '2 3'
+    )
+    """
+    )
+    cursor.executescript(
+        """
+    CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts (rowid, filename) VALUES (new.id, new.filename);
+    END;
+    CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts (files_fts, rowid, filename)
+        VALUES ('delete', old.id, old.filename);
+    END;
+    CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF filename ON files BEGIN
+        INSERT INTO files_fts (files_fts, rowid, filename)
+        VALUES ('delete', old.id, old.filename);
+        INSERT INTO files_fts (rowid, filename) VALUES (new.id, new.filename);
+    END;
+    """
+    )
+    if not search_index_exists:
+        cursor.execute("INSERT INTO files_fts (files_fts) VALUES ('rebuild')")
 
+    storage_table_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_storage'"
+    ).fetchone()
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS user_storage (
+        user_id INTEGER PRIMARY KEY,
+        bytes_used INTEGER NOT NULL DEFAULT 0,
+        file_count INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """
+    )
+    cursor.executescript(
+        """
+    CREATE TRIGGER IF NOT EXISTS user_storage_insert AFTER INSERT ON files BEGIN
+        INSERT INTO user_storage (user_id, bytes_used, file_count)
+        VALUES (new.user_id, new.size_bytes, 1)
+        ON CONFLICT (user_id) DO UPDATE SET
+            bytes_used = bytes_used + excluded.bytes_used,
+            file_count = file_count + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS user_storage_delete AFTER DELETE ON files BEGIN
+        UPDATE user_storage
+        SET bytes_used = bytes_used - old.size_bytes, file_count = file_count - 1
+        WHERE user_id = old.user_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS user_storage_update
+    AFTER UPDATE OF size_bytes, user_id ON files BEGIN
+        UPDATE user_storage
+        SET bytes_used = bytes_used - old.size_bytes, file_count = file_count - 1
+        WHERE user_id = old.user_id;
+        INSERT INTO user_storage (user_id, bytes_used, file_count)
+        VALUES (new.user_id, new.size_bytes, 1)
+        ON CONFLICT (user_id) DO UPDATE SET
+            bytes_used = bytes_used + excluded.bytes_used,
+            file_count = file_count + 1;
+    END;
+    """
+    )
+    if not storage_table_exists:
         cursor.execute(
             """
-        CREATE TABLE IF NOT EXISTS mfa_codes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            code TEXT NOT NULL,
-            expires_at DATETIME NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
+        INSERT INTO user_storage (user_id, bytes_used, file_count)
+        SELECT user_id, SUM(size_bytes), COUNT(*) FROM files GROUP BY user_id
         """
         )
 
-        conn.commit()
+    # Only additions are journaled: backups never drop blobs, so that older
+    # snapshots stay restorable.
+    cursor.executescript(
+        """
+    CREATE TABLE IF NOT EXISTS blob_journal (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        storage_key TEXT NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS blob_journal_files_insert AFTER INSERT ON files BEGIN
+        INSERT INTO blob_journal (storage_key) VALUES (new.file_path);
+    END;
+    CREATE TRIGGER IF NOT EXISTS blob_journal_files_update
+    AFTER UPDATE OF file_path ON files BEGIN
+        INSERT INTO blob_journal (storage_key) VALUES (new.file_path);
+    END;
+    CREATE TRIGGER IF NOT EXISTS blob_journal_versions_insert
+    AFTER INSERT ON file_versions WHEN new.file_path IS NOT NULL BEGIN
+        INSERT INTO blob_journal (storage_key) VALUES (new.file_path);
+    END;
+    CREATE TRIGGER IF NOT EXISTS blob_journal_chunks_insert AFTER INSERT ON chunks BEGIN
+        INSERT INTO blob_journal (storage_key) VALUES (new.storage_key);
+    END;
+    """
+    )
+
+
+def schema_version() -> int:
+    with sqlite3.connect(DATABASE_PATH) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate():
+    """
+    Bring the schema up to date once, however many workers start at the same time.
+
+    Workers serialize on an exclusive lock file next to the database; the first
+    one runs init_db and the rest see the current schema version and skip it.
+    """
+    if schema_version() >= SCHEMA_VERSION:
+        return
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover - Windows has no flock
+        init_db()
+        return
+    with open(f"{DATABASE_PATH}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if schema_version() < SCHEMA_VERSION:
+                init_db()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def add_column_if_missing(cursor, table, column, definition):
+    """
+    Add a column to an existing table, for databases created by older versions.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor inside the migration transaction
+        table (str): Table to alter
+        column (str): Column name
+        definition (str): Column type and constraints
+    """
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+class ConnectionPool:
+    """
+    Pool of idle SQLite connections reused across requests.
+
+    Opening a connection and parsing the schema on its first statement costs
+    more than most of the queries the API runs. Connections are handed to one
+    thread at a time, and any transaction left open is rolled back before a
+    connection goes back to the pool. At most ``size`` idle connections are
+    kept; extra ones are closed on release.
+
+    Shard pools attach the global database as ``meta``, so shard queries can
+    still join ``users`` and the other global tables by their plain names.
+    """
+
+    def __init__(self, path: str, size: int, attach: Optional[str] = None):
+        self.path = path
+        self.size = size
+        self.attach = attach
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        DB_CONNECTIONS_OPENED.inc()
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        if self.attach:
+            conn.execute("ATTACH DATABASE ? AS meta", (self.attach,))
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def prewarm(self, count: int = None):
+        """Open connections up front and load the schema into each of them."""
+        conns = [self.acquire() for _ in range(count or self.size)]
+        for conn in conns:
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+POOL = ConnectionPool(DATABASE_PATH, DB_POOL_SIZE)
+SHARD_POOLS = (
+    [POOL]
+    if DB_SHARDS == 1
+    else [ConnectionPool(path, DB_POOL_SIZE, DATABASE_PATH) for path in SHARD_PATHS]
+)
+POOLS = list(dict.fromkeys([POOL, *SHARD_POOLS]))
+
+
+def shard_for_user(user_id: int) -> int:
+    """Shard holding a user's files, shares, MFA codes and storage totals."""
+    return user_id % DB_SHARDS
+
+
+def shard_for_row(row_id: int) -> int:
+    """
+    Shard holding a ``files``, ``file_shares`` or ``mfa_codes`` row.
+
+    Rows inserted with ``next_row_id`` get ids congruent to their shard, so
+    the id alone routes a request.
+    """
+    return (row_id - 1) % DB_SHARDS
+
+
+def next_row_id(table: str, shard: int) -> str:
+    """
+    SQL expression for the next id of ``table`` on ``shard``.
+
+    Ids advance by the number of shards from the table's AUTOINCREMENT
+    sequence, so they stay unique across shards. With a single shard this is
+    the id SQLite would have assigned.
+    """
+    return (
+        f"COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), "
+        f"{shard + 1 - DB_SHARDS}) + {DB_SHARDS}"
+    )
+
+
+def all_shards() -> range:
+    return range(DB_SHARDS)
 
 
 @contextmanager
-def get_db_connection():
+def get_db_connection(shard: Optional[int] = None):
     """
-    Create a database connection with context management.
+    Borrow a pooled database connection with context management.
+
+    Args:
+        shard (int, optional): Shard to connect to; the global database if None
 
     Yields:
         sqlite3.Connection: Database connection object
 
     Note:
-        Connection is automatically closed when context exits
+        Connection is returned to the pool when context exits
     """
-    conn = sqlite3.connect(DATABASE_PATH)
+    pool = POOL if shard is None else SHARD_POOLS[shard]
+    conn = pool.acquire()
+    DB_CONNECTIONS_IN_USE.inc()
     try:
         yield conn
     finally:
-        conn.close()
+        pool.release(conn)
+        DB_CONNECTIONS_IN_USE.dec()
+
+
+class WriteResult:
+    """
+    Outcome of a queued write, shaped like the parts of a cursor callers use.
 
+    Rows produced by the statement (``RETURNING`` clauses or queries sent
+    through ``execute_query``) are captured before the batch commits.
+    """
+
+    __slots__ = ("lastrowid", "rowcount", "_rows")
+
+    def __init__(self, lastrowid: Optional[int], rowcount: int, rows: List[tuple]):
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+        self._rows = rows
+
+    def fetchone(self) -> Optional[tuple]:
+        return self._rows.pop(0) if self._rows else None
 
-def execute_query(query, params=None):
+    def fetchall(self) -> List[tuple]:
+        rows, self._rows = self._rows, []
+        return rows
+
+
+class WriteQueue:
+    """
+    Single writer thread that group-commits statements from every caller.
+
+    Each submitted statement runs inside its own savepoint, so a failing
+    statement is rolled back and raised to its caller alone, and the batch
+    commits once. While one batch commits, new writes queue up and form the
+    next batch. When the previous batch held more than one write, the writer
+    also waits up to ``window`` seconds for stragglers; an idle database
+    commits a lone write immediately. Callers block, or await with the
+    ``*_async`` helpers, until their commit lands, so a write is visible to
+    every connection once the helper returns.
+
+    Multi-statement transactions that read before they write (``BEGIN
+    IMMEDIATE`` blocks on pooled connections) bypass the queue.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        window: float = DB_WRITE_BATCH_WINDOW,
+        max_batch: int = DB_WRITE_MAX_BATCH,
+        attach: Optional[str] = None,
+    ):
+        self.path = path
+        self.attach = attach
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def submit(self, query: str, params=None, many: bool = False) -> Future:
+        """
+        Queue one statement (or one ``executemany``) for the next group commit.
+
+        Returns:
+            Future: Resolves to a WriteResult once the batch has committed
+        """
+        future = Future()
+        self._queue.put((query, params, many, future, time.perf_counter()))
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name="db-writer", daemon=True
+                    )
+                    self._thread.start()
+        return future
+
+    def execute(self, query: str, params=None, many: bool = False) -> WriteResult:
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("The writer thread cannot wait on its own queue")
+        return self.submit(query, params, many).result()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            DB_CONNECTIONS_OPENED.inc()
+            self._conn = sqlite3.connect(self.path, isolation_level=None)
+            if self.attach:
+                self._conn.execute("ATTACH DATABASE ? AS meta", (self.attach,))
+        return self._conn
+
+    def _collect(self, first, previous_size: int) -> list:
+        batch = [first]
+        deadline = time.perf_counter() + (self.window if previous_size > 1 else 0)
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        previous_size = 0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = self._collect(item, previous_size)
+            stop = None in batch
+            batch = [entry for entry in batch if entry is not None]
+            previous_size = len(batch)
+            self._commit(batch)
+            if stop:
+                break
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _commit(self, batch: list):
+        DB_WRITE_BATCH_SIZE.observe(len(batch))
+        results = []
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            for query, params, many, future, queued_at in batch:
+                DB_WRITE_WAIT.observe(time.perf_counter() - queued_at)
+                conn.execute("SAVEPOINT queued_write")
+                try:
+                    if many:
+                        cursor = conn.executemany(query, params)
+                    else:
+                        cursor = conn.execute(query, params or ())
+                    rows = cursor.fetchall() if cursor.description else []
+                    results.append(
+                        (future, WriteResult(cursor.lastrowid, cursor.rowcount, rows))
+                    )
+                    conn.execute("RELEASE queued_write")
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO queued_write")
+                    conn.execute("RELEASE queued_write")
+                    results.append((future, exc))
+            conn.execute("COMMIT")
+        except Exception as exc:
+            if self._conn is not None and self._conn.in_transaction:
+                self._conn.rollback()
+            for entry in batch:
+                entry[3].set_exception(exc)
+            return
+        for future, outcome in results:
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+    def stop(self):
+        """Commit queued writes and stop the writer thread."""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout=5)
+        self._thread = None
+
+
+WRITER = WriteQueue(DATABASE_PATH)
+SHARD_WRITERS = (
+    [WRITER]
+    if DB_SHARDS == 1
+    else [WriteQueue(path, attach=DATABASE_PATH) for path in SHARD_PATHS]
+)
+WRITERS = list(dict.fromkeys([WRITER, *SHARD_WRITERS]))
+
+
+def _instrumented(func):
+    """Record the duration and failures of a query helper under its own name."""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with DB_QUERY_DURATION.time(helper=func.__name__):
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                DB_ERRORS.inc(helper=func.__name__)
+                raise
+
+    @wraps(func)
+    async def async_wrapper(*args, **kwargs):
+        with DB_QUERY_DURATION.time(helper=func.__name__):
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                DB_ERRORS.inc(helper=func.__name__)
+                raise
+
+    return async_wrapper if asyncio.iscoroutinefunction(func) else wrapper
+
+
+def _writer(shard: Optional[int]) -> WriteQueue:
+    return WRITER if shard is None else SHARD_WRITERS[shard]
+
+
+@_instrumented
+def execute_query(query, params=None, shard=None):
     """
     Execute a database query with optional parameters.
 
     Args:
         query (str): SQL query to execute
         params (tuple, optional): Query parameters
+        shard (int, optional): Shard to run on; the global database if None
 
     Returns:
-        sqlite3.Cursor: Query cursor
+        sqlite3.Cursor | WriteResult: Query cursor, or the queued write's result
+        when ``DB_GROUP_COMMIT`` is enabled
     """
-    with get_db_connection() as conn:
+    if DB_GROUP_COMMIT:
+        return _writer(shard).execute(query, params)
+    with get_db_connection(shard) as conn:
         cursor = conn.cursor()
         if params:
             cursor.execute(query, params)
@@ -120,18 +780,116 @@ def execute_query(query, params=None):
         return cursor
 
 
-def fetch_one(query, params=None):
+@_instrumented
+def execute_many(query, params_seq, shard=None):
+    """
+    Execute a statement once per parameter tuple in a single transaction.
+
+    Args:
+        query (str): SQL statement to execute
+        params_seq (Iterable[tuple]): Parameters for each execution
+        shard (int, optional): Shard to run on; the global database if None
+
+    Returns:
+        sqlite3.Cursor | WriteResult: Query cursor; rowcount is the total across
+        executions
+    """
+    if DB_GROUP_COMMIT:
+        return _writer(shard).execute(query, list(params_seq), many=True)
+    with get_db_connection(shard) as conn:
+        try:
+            cursor = conn.executemany(query, params_seq)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return cursor
+
+
+@_instrumented
+async def execute_query_async(query, params=None, shard=None):
+    """
+    ``execute_query`` for async callers, which must not block the event loop.
+
+    With ``DB_GROUP_COMMIT`` the coroutine awaits the writer's future, so
+    concurrent requests on one event loop still share a group commit.
+
+    Args:
+        query (str): SQL query to execute
+        params (tuple, optional): Query parameters
+        shard (int, optional): Shard to run on; the global database if None
+
+    Returns:
+        sqlite3.Cursor | WriteResult: As for ``execute_query``
+    """
+    if DB_GROUP_COMMIT:
+        return await asyncio.wrap_future(_writer(shard).submit(query, params))
+    return await run_in_threadpool(execute_query.__wrapped__, query, params, shard)
+
+
+@_instrumented
+async def execute_many_async(query, params_seq, shard=None):
+    """
+    ``execute_many`` for async callers, which must not block the event loop.
+
+    Args:
+        query (str): SQL statement to execute
+        params_seq (Iterable[tuple]): Parameters for each execution
+        shard (int, optional): Shard to run on; the global database if None
+
+    Returns:
+        sqlite3.Cursor | WriteResult: As for ``execute_many``
+    """
+    if DB_GROUP_COMMIT:
+        return await asyncio.wrap_future(
+            _writer(shard).submit(query, list(params_seq), many=True)
+        )
+    return await run_in_threadpool(execute_many.__wrapped__, query, params_seq, shard)
+
+
+def iter_rows(query, params=None, batch_size=1000, shard=None):
+    """
+    Execute a query and yield its rows lazily, in batches from the cursor.
+
+    The connection is opened on first iteration and held until the generator
+    is exhausted or closed, so large results never sit in memory at once.
+
+    Args:
+        query (str): SQL query to execute
+        params (tuple, optional): Query parameters
+        shard (int, optional): Shard to run on; the global database if None
+        batch_size (int): Rows fetched from the cursor at a time
+
+    Yields:
+        tuple: Result rows
+    """
+    with get_db_connection(shard) as conn:
+        cursor = conn.cursor()
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+
+@_instrumented
+def fetch_one(query, params=None, shard=None):
     """
     Execute a query and fetch a single row.
 
     Args:
         query (str): SQL query to execute
         params (tuple, optional): Query parameters
+        shard (int, optional): Shard to run on; the global database if None
 
     Returns:
         tuple: Single row result or None if no results
     """
-    with get_db_connection() as conn:
+    with get_db_connection(shard) as conn:
         cursor = conn.cursor()
         if params:
             cursor.execute(query, params)
@@ -140,18 +898,20 @@ def fetch_one(query, params=None):
         return cursor.fetchone()
 
 
-def fetch_all(query, params=None):
+@_instrumented
+def fetch_all(query, params=None, shard=None):
     """
     Execute a query and fetch all rows.
 
     Args:
         query (str): SQL query to execute
         params (tuple, optional): Query parameters
+        shard (int, optional): Shard to run on; the global database if None
 
     Returns:
         List[tuple]: List of result rows
     """
-    with get_db_connection() as conn:
+    with get_db_connection(shard) as conn:
         cursor = conn.cursor()
         if params:
             cursor.execute(query, params)
@@ -160,4 +920,33 @@ def fetch_all(query, params=None):
         return cursor.fetchall()
 
 
-init_db()
+def fetch_all_shards(query, params=None, shards=None):
+    """
+    Run a query on several shards and concatenate the rows.
+
+    Args:
+        query (str): SQL query to execute
+        params (tuple, optional): Query parameters
+        shards (Iterable[int], optional): Shards to query; all shards if None
+
+    Returns:
+        List[tuple]: Rows of every shard, shard by shard
+    """
+    rows = []
+    for shard in all_shards() if shards is None else shards:
+        rows.extend(fetch_all(query, params, shard=shard))
+    return rows
+
+
+def iter_rows_shards(query, params=None, shards=None):
+    """Like ``iter_rows``, reading the shards one after another."""
+    for shard in all_shards() if shards is None else shards:
+        yield from iter_rows(query, params, shard=shard)
+
+
+def group_by_shard(row_ids) -> dict:
+    """Split row ids into ``{shard: [id, ...]}``, keeping their order."""
+    groups = {}
+    for row_id in row_ids:
+        groups.setdefault(shard_for_row(row_id), []).append(row_id)
+    return groups
@@ -0,0 +1,278 @@
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from app.services.database import (
+    all_shards,
+    execute_many,
+    execute_query,
+    fetch_all,
+    group_by_shard,
+    iter_rows_shards,
+    shard_for_user,
+)
+from app.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_TICK_SECONDS = 1.0
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 5
+
+EXPIRY_PENDING = REGISTRY.gauge(
+    "expiry_pending", "Expirations waiting in the timing wheel, by kind.", ("kind",)
+)
+EXPIRY_FIRED = REGISTRY.counter(
+    "expiry_fired_total", "Expirations fired by the timing wheel, by kind.", ("kind",)
+)
+
+ExpiryHandler = Callable[[List[Tuple[Hashable, object]]], None]
+
+
+class _Timer:
+    __slots__ = ("tick", "kind", "key", "payload", "cancelled")
+
+    def __init__(self, tick: int, kind: str, key: Hashable, payload):
+        self.tick = tick
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.cancelled = False
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel firing expiry callbacks in O(1) per event.
+
+    Five levels of 64 slots cover 64**5 ticks (34 years at one-second ticks).
+    A timer goes into the coarsest level whose span covers its delay. Each
+    time a level completes a revolution, the next slot of the level above is
+    cascaded down. Scheduling, cancelling and firing are constant time, and
+    advancing costs one slot per tick no matter how many timers are pending.
+
+    Timers are identified by ``(kind, key)``. Scheduling an existing key
+    replaces the old timer, and cancelled timers are skipped when their slot
+    comes up. Expired timers are handed to the handlers registered for their
+    kind, one list per kind and tick, from the wheel's own thread.
+    """
+
+    def __init__(
+        self,
+        tick_seconds: float = EXPIRY_TICK_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.tick_seconds = tick_seconds
+        self.clock = clock
+        self.current = math.floor(clock() / tick_seconds)
+        self._wheels = [[[] for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)]
+        self._timers: Dict[Tuple[str, Hashable], _Timer] = {}
+        self._handlers: Dict[str, List[ExpiryHandler]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _tick_at(self, timestamp: float) -> int:
+        return math.ceil(timestamp / self.tick_seconds)
+
+    def on_expire(self, kind: str, handler: ExpiryHandler):
+        """Register a handler called with ``[(key, payload), ...]`` for a kind."""
+        self._handlers[kind].append(handler)
+
+    def schedule(self, kind: str, key: Hashable, expires_at: float, payload=None):
+        """
+        Fire an expiry for ``(kind, key)`` at a Unix timestamp.
+
+        Args:
+            kind (str): Event kind, e.g. "share" or "mfa_code"
+            key (Hashable): Identifier within the kind, e.g. a row id
+            expires_at (float): Unix timestamp of the expiry
+            payload (object, optional): Passed to the handlers with the key
+        """
+        timer = _Timer(self._tick_at(expires_at), kind, key, payload)
+        with self._lock:
+            previous = self._timers.pop((kind, key), None)
+            if previous is not None:
+                previous.cancelled = True
+            else:
+                EXPIRY_PENDING.inc(1, kind=kind)
+            self._timers[(kind, key)] = timer
+            self._place(timer)
+
+    def cancel(self, kind: str, key: Hashable) -> bool:
+        """Cancel a pending expiry; returns False if there was none."""
+        with self._lock:
+            timer = self._timers.pop((kind, key), None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        EXPIRY_PENDING.dec(1, kind=kind)
+        return True
+
+    def _place(self, timer: _Timer):
+        delay = timer.tick - self.current
+        if delay < 0:
+            self._wheels[0][self.current & WHEEL_MASK].append(timer)
+            return
+        tick = timer.tick
+        for level in range(WHEEL_LEVELS):
+            if delay < 1 << (WHEEL_BITS * (level + 1)):
+                break
+        else:
+            # Beyond the wheel's range: park in the top level; the timer is
+            # re-placed with its real deadline each time that slot cascades.
+            level = WHEEL_LEVELS - 1
+            tick = self.current + (1 << (WHEEL_BITS * WHEEL_LEVELS)) - 1
+        self._wheels[level][(tick >> (WHEEL_BITS * level)) & WHEEL_MASK].append(timer)
+
+    def _cascade(self, level: int) -> int:
+        index = (self.current >> (WHEEL_BITS * level)) & WHEEL_MASK
+        slot, self._wheels[level][index] = self._wheels[level][index], []
+        for timer in slot:
+            if not timer.cancelled:
+                self._place(timer)
+        return index
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """
+        Fire every timer due at or before ``now``.
+
+        Returns:
+            int: Number of timers fired
+        """
+        target = math.floor((self.clock() if now is None else now) / self.tick_seconds)
+        fired = 0
+        while True:
+            with self._lock:
+                if self.current > target:
+                    return fired
+                index = self.current & WHEEL_MASK
+                if index == 0:
+                    level = 1
+                    while level < WHEEL_LEVELS and self._cascade(level) == 0:
+                        level += 1
+                slot, self._wheels[0][index] = self._wheels[0][index], []
+                self.current += 1
+                due = defaultdict(list)
+                for timer in slot:
+                    if timer.cancelled:
+                        continue
+                    del self._timers[(timer.kind, timer.key)]
+                    due[timer.kind].append((timer.key, timer.payload))
+            for kind, events in due.items():
+                EXPIRY_PENDING.dec(len(events), kind=kind)
+                EXPIRY_FIRED.inc(len(events), kind=kind)
+                fired += len(events)
+                for handler in self._handlers[kind]:
+                    handler(events)
+
+    def _run(self):
+        while not self._stopped.wait(self.tick_seconds):
+            try:
+                self.advance()
+            except Exception:
+                # A failing handler must not stop expiry processing.
+                logger.exception("Expiry handler failed")
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="expiry-wheel", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def __len__(self):
+        return len(self._timers)
+
+
+EXPIRY_WHEEL = TimingWheel()
+
+
+def utc_timestamp(value: datetime) -> float:
+    """Unix timestamp of a naive UTC datetime, as stored in ``expires_at`` columns."""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def load_pending_expirations(wheel: TimingWheel = EXPIRY_WHEEL) -> int:
+    """
+    Schedule every unexpired share and MFA code, and purge expired MFA codes.
+
+    Rows are streamed, so start-up memory is that of the wheel itself.
+
+    Returns:
+        int: Number of expirations scheduled
+    """
+    now = datetime.utcnow()
+    for shard in all_shards():
+        execute_query(
+            "DELETE FROM mfa_codes WHERE expires_at <= ?", (now,), shard=shard
+        )
+    loaded = 0
+    for kind, query in (
+        (
+            "share",
+            """
+            SELECT id, file_id, (julianday(expires_at) - 2440587.5) * 86400.0
+            FROM file_shares WHERE expires_at > CURRENT_TIMESTAMP
+            """,
+        ),
+        (
+            "mfa_code",
+            """
+            SELECT id, user_id, (julianday(expires_at) - 2440587.5) * 86400.0
+            FROM mfa_codes
+            """,
+        ),
+    ):
+        for key, payload, expires_at in iter_rows_shards(query):
+            wheel.schedule(kind, key, expires_at, payload)
+            loaded += 1
+    return loaded
+
+
+def _expire_shares(events):
+    from app.services.audit import AUDIT_LOG
+    from app.services.changes import CHANGE_FEED, shared_listing_changes
+
+    # Shares revoked or deleted with their file are gone and need no event.
+    live = set()
+    for shard, share_ids in group_by_shard(share_id for share_id, _ in events).items():
+        recipients = []
+        for offset in range(0, len(share_ids), 500):
+            batch = share_ids[offset : offset + 500]
+            for share_id, file_id, shared_with in fetch_all(
+                f"SELECT id, file_id, shared_with FROM file_shares WHERE id IN ({','.join('?' * len(batch))})",
+                batch,
+                shard=shard,
+            ):
+                live.add(share_id)
+                if shared_with is not None:
+                    recipients.append((file_id, shared_with))
+        CHANGE_FEED.publish(shared_listing_changes(shard, recipients))
+    for share_id, file_id in events:
+        if share_id in live:
+            AUDIT_LOG.record("share_expire", file_id=file_id, share_id=share_id)
+
+
+def _expire_mfa_codes(events):
+    by_shard = {}
+    for code_id, user_id in events:
+        by_shard.setdefault(shard_for_user(user_id), []).append((code_id,))
+    for shard, code_ids in by_shard.items():
+        execute_many("DELETE FROM mfa_codes WHERE id = ?", code_ids, shard=shard)
+
+
+EXPIRY_WHEEL.on_expire("share", _expire_shares)
+EXPIRY_WHEEL.on_expire("mfa_code", _expire_mfa_codes)
@@ -0,0 +1,407 @@
+"""
+Bulk ingest of an existing directory tree into one user's files.
+
+Onboarding through ``/files/upload`` costs a request, a multipart parse and a
+commit per file. The ingester walks the tree instead, encrypts files in a
+pool of worker processes straight into blobs under the upload directory,
+and inserts the ``files`` rows ``--batch-size`` at a time, one transaction
+per batch::
+
+    SERVER_KEY=... python -m app.services.ingest /srv/team-share --owner alice
+
+A blob holds what a browser upload would have stored: the file encrypted
+with AES-GCM under a key derived from the owner's download password
+(PBKDF2-SHA256, as the frontend does), then encrypted again like
+``encrypt_file`` with the server key and the same IV. Files therefore
+download and decrypt in the web app like any other upload. One salt, and so
+one password-derived key, is used per run.
+
+Runs are resumable. Blob keys are derived from the run id in the checkpoint
+file and each file's path in the tree, and a row is only inserted if no
+row has its key yet. Re-running with the same checkpoint after an
+interruption skips committed files without re-encrypting them and picks up
+files added to the tree since.
+"""
+
+import argparse
+import getpass
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Iterator, List, Optional
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from app.services.changes import CHANGE_FEED, file_entry
+from app.services.database import (
+    execute_many,
+    fetch_all,
+    fetch_one,
+    next_row_id,
+    shard_for_user,
+)
+from app.services.storage import CHUNK_SIZE, UPLOAD_DIRECTORY
+from app.utils.sanitization import sanitize_filename
+
+INGEST_BATCH_SIZE = 1000
+INGEST_CHECKPOINT = "ingest-checkpoint.json"
+# Must match FileEncryption.generateKey in the frontend.
+PBKDF2_ITERATIONS = 100000
+MAX_REPORTED_FAILURES = 1000
+
+_worker_keys: Optional[tuple] = None
+
+
+def _init_worker(server_key: bytes, user_key: bytes):
+    global _worker_keys
+    _worker_keys = (server_key, user_key)
+
+
+def derive_user_key(password: str, salt: bytes) -> bytes:
+    """AES key the frontend derives from a download password and salt."""
+    return PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=PBKDF2_ITERATIONS,
+    ).derive(password.encode())
+
+
+def encrypt_into(
+    source: str,
+    destination: str,
+    iv: bytes,
+    server_key: Optional[bytes] = None,
+    user_key: Optional[bytes] = None,
+) -> tuple:
+    """
+    Encrypt one file into a blob, streaming it through both AES-GCM layers.
+
+    The blob is written to a temporary file and renamed into place, so an
+    interrupted run never leaves a partial blob under ``destination``.
+
+    Args:
+        source (str): File to ingest
+        destination (str): Blob path
+        iv (bytes): 12-byte IV, shared by both layers as in a browser upload
+        server_key (bytes, optional): Server key; defaults to the worker's
+        user_key (bytes, optional): Password-derived key; defaults to the worker's
+
+    Returns:
+        tuple: (plaintext bytes, blob bytes)
+    """
+    inner = Cipher(
+        algorithms.AES(user_key or _worker_keys[1]), modes.GCM(iv)
+    ).encryptor()
+    outer = Cipher(
+        algorithms.AES(server_key or _worker_keys[0]), modes.GCM(iv)
+    ).encryptor()
+    temp_path = f"{destination}.{uuid.uuid4().hex}.part"
+    read = written = 0
+    try:
+        with open(source, "rb") as handle, open(temp_path, "wb") as blob:
+            while chunk := handle.read(CHUNK_SIZE):
+                read += len(chunk)
+                written += blob.write(outer.update(inner.update(chunk)))
+            tail = inner.finalize() + inner.tag
+            written += blob.write(outer.update(tail) + outer.finalize() + outer.tag)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return read, written
+
+
+def _ingest_task(relative: str, source: str, destination: str, iv: bytes):
+    return (relative, destination, iv, *encrypt_into(source, destination, iv))
+
+
+def load_checkpoint(path: str, root: str, owner: str) -> dict:
+    """
+    Read the checkpoint of an earlier run, or start a new one.
+
+    Raises:
+        ValueError: If the checkpoint belongs to another tree or owner
+    """
+    if not os.path.exists(path):
+        return {
+            "run_id": str(uuid.uuid4()),
+            "root": root,
+            "owner": owner,
+            "files": 0,
+            "bytes": 0,
+        }
+    with open(path) as handle:
+        checkpoint = json.load(handle)
+    if (checkpoint["root"], checkpoint["owner"]) != (root, owner):
+        raise ValueError(
+            f"{path} is the checkpoint of {checkpoint['root']} for {checkpoint['owner']}"
+        )
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    temp_path = f"{path}.part"
+    with open(temp_path, "w") as handle:
+        json.dump(checkpoint, handle, indent=2)
+    os.replace(temp_path, path)
+
+
+def _listing_name(relative: str) -> str:
+    # Listings are flat, so the directories become part of the name.
+    return sanitize_filename(relative.replace("/", "_")) or "file"
+
+
+class BulkIngester:
+    """
+    Parallel, resumable import of a directory tree for one owner.
+
+    The parent process walks the tree in sorted order, drops files already
+    ingested (one indexed lookup per batch), and keeps at most two files per
+    worker in flight. Finished files are inserted ``batch_size`` rows per
+    transaction, then the checkpoint is updated and the rows are published
+    to the change feed.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        owner: str,
+        password: str,
+        server_key: bytes,
+        storage_root: str = UPLOAD_DIRECTORY,
+        workers: int = os.cpu_count() or 1,
+        batch_size: int = INGEST_BATCH_SIZE,
+        checkpoint_path: str = INGEST_CHECKPOINT,
+    ):
+        self.root = os.path.abspath(root)
+        self.owner = owner
+        self.server_key = server_key
+        self.storage_root = storage_root
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = load_checkpoint(checkpoint_path, self.root, owner)
+        self._namespace = uuid.UUID(self.checkpoint["run_id"])
+        self.salt = os.urandom(16)
+        self.user_key = derive_user_key(password, self.salt)
+
+        user = fetch_one("SELECT id FROM users WHERE username = ?", (owner,))
+        if not user:
+            raise ValueError(f"Unknown user: {owner}")
+        self.user_id = user[0]
+        self.shard = shard_for_user(self.user_id)
+
+    def _walk(self) -> Iterator[str]:
+        for directory, subdirectories, filenames in os.walk(self.root):
+            subdirectories.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                if os.path.isfile(path) and not os.path.islink(path):
+                    yield os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def _key(self, relative: str) -> str:
+        return os.path.join(
+            self.storage_root,
+            f"{uuid.uuid5(self._namespace, relative)}_{_listing_name(relative)}",
+        )
+
+    def _pending(self, report: dict) -> Iterator[tuple]:
+        """(relative path, blob key) of files not ingested yet."""
+        walk = self._walk()
+        while True:
+            batch = [
+                (relative, self._key(relative))
+                for relative in islice(walk, self.batch_size)
+            ]
+            if not batch:
+                return
+            present = {
+                row[0]
+                for row in fetch_all(
+                    f"SELECT file_path FROM files WHERE file_path IN ({','.join('?' * len(batch))})",
+                    [key for _, key in batch],
+                    shard=self.shard,
+                )
+            }
+            report["skipped"] += len(present)
+            yield from (item for item in batch if item[1] not in present)
+
+    def _commit(self, rows: List[tuple], report: dict, started: float):
+        execute_many(
+            f"""
+            INSERT INTO files (id, filename, user_id, file_path, iv, salt, size_bytes)
+            SELECT {next_row_id("files", self.shard)}, ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM files WHERE file_path = ?)
+            """,
+            [
+                (
+                    _listing_name(relative),
+                    self.user_id,
+                    key,
+                    iv,
+                    self.salt,
+                    stored,
+                    key,
+                )
+                for relative, key, iv, _, stored in rows
+            ],
+            shard=self.shard,
+        )
+        inserted = fetch_all(
+            f"""
+            SELECT id, filename, file_path FROM files
+            WHERE user_id = ? AND file_path IN ({','.join('?' * len(rows))})
+            """,
+            (self.user_id, *(row[1] for row in rows)),
+            shard=self.shard,
+        )
+        CHANGE_FEED.publish(
+            (
+                self.user_id,
+                "owned",
+                file_id,
+                file_entry(
+                    file_id, filename, key, self.user_id, owner_username=self.owner
+                ),
+            )
+            for file_id, filename, key in inserted
+        )
+
+        plaintext = sum(row[3] for row in rows)
+        report["files"] += len(rows)
+        report["bytes"] += plaintext
+        report["stored_bytes"] += sum(row[4] for row in rows)
+        report["batches"] += 1
+        self.checkpoint["files"] += len(rows)
+        self.checkpoint["bytes"] += plaintext
+        save_checkpoint(self.checkpoint_path, self.checkpoint)
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(
+            f"ingested {report['files']} files, "
+            f"{report['bytes'] / 1024 ** 2:.1f} MiB "
+            f"({report['files'] / elapsed:.1f} files/s, "
+            f"{report['bytes'] / 1024 ** 2 / elapsed:.1f} MiB/s)",
+            file=sys.stderr,
+        )
+
+    def run(self) -> dict:
+        """
+        Ingest every file of the tree that is not ingested yet.
+
+        Returns:
+            dict: Files and bytes ingested, files skipped as already present,
+            unreadable files, and the throughput of this run
+        """
+        started = time.monotonic()
+        report = {
+            "files": 0,
+            "bytes": 0,
+            "stored_bytes": 0,
+            "skipped": 0,
+            "failed": 0,
+            "failed_sample": [],
+            "batches": 0,
+        }
+        os.makedirs(self.storage_root, exist_ok=True)
+        rows: List[tuple] = []
+
+        def collect(done):
+            for future in done:
+                try:
+                    rows.append(future.result())
+                except OSError as error:
+                    report["failed"] += 1
+                    if len(report["failed_sample"]) < MAX_REPORTED_FAILURES:
+                        report["failed_sample"].append(str(error))
+            if len(rows) >= self.batch_size:
+                self._commit(rows[: self.batch_size], report, started)
+                del rows[: self.batch_size]
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.server_key, self.user_key),
+        ) as pool:
+            pending = set()
+            for relative, key in self._pending(report):
+                if len(pending) >= self.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(
+                    pool.submit(
+                        _ingest_task,
+                        relative,
+                        os.path.join(self.root, relative),
+                        key,
+                        os.urandom(12),
+                    )
+                )
+            collect(wait(pending).done)
+        if rows:
+            self._commit(rows, report, started)
+
+        seconds = time.monotonic() - started
+        report["seconds"] = round(seconds, 3)
+        report["files_per_second"] = round(report["files"] / max(seconds, 1e-9), 1)
+        report["bytes_per_second"] = round(report["bytes"] / max(seconds, 1e-9))
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Import a directory tree as one user's encrypted files."
+    )
+    parser.add_argument("root", help="Directory to ingest")
+    parser.add_argument("--owner", required=True, help="Username the files belong to")
+    parser.add_argument(
+        "--password-env",
+        help="Environment variable holding the download password; prompted if unset",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--checkpoint", default=INGEST_CHECKPOINT)
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a directory")
+    if os.environ.get("STORAGE_BACKEND", "local") != "local":
+        parser.error("the ingester writes blobs to local storage only")
+    if not os.environ.get("SERVER_KEY"):
+        parser.error("SERVER_KEY must be set to encrypt blobs the service can read")
+    if args.password_env:
+        password = os.environ.get(args.password_env)
+        if not password:
+            parser.error(f"{args.password_env} is not set")
+    else:
+        password = getpass.getpass(f"Download password for {args.owner}'s files: ")
+
+    from app.services.database import migrate
+    from app.services.security import get_server_key
+
+    migrate()
+    try:
+        ingester = BulkIngester(
+            args.root,
+            args.owner,
+            password,
+            get_server_key(),
+            workers=args.workers,
+            batch_size=args.batch_size,
+            checkpoint_path=args.checkpoint,
+        )
+    except ValueError as error:
+        parser.error(str(error))
+    print(json.dumps(ingester.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...]) -> str:
+    if not label_names:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        escaped = (
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class for labelled metrics kept in process memory."""
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(
+                f"{self.name} expects labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for sample_name, names, values, value in self.samples():
+            lines.append(
+                f"{sample_name}{_format_labels(names, values)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Increment the counter.
+
+        Args:
+            amount (float): Amount to add, must not be negative
+            **labels: Label values for the series to increment
+        """
+        if amount < 0:
+            raise ValueError("Counters can only be incremented")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self.label_names, key, value) for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, such as connections in use."""
+
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self.label_names, key, value) for key, value in items]
+
+
+class Histogram(_Metric):
+    """Cumulative histogram with fixed bucket boundaries."""
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        """
+        Record a single observation.
+
+        Args:
+            value (float): Observed value, usually a duration in seconds
+            **labels: Label values for the series to update
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Context manager observing the wall-clock duration of its body.
+
+        Args:
+            **labels: Label values for the series to update
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [
+                (key, list(series[0]), series[1], series[2])
+                for key, series in self._values.items()
+            ]
+        label_names = self.label_names + ("le",)
+        samples = []
+        for key, bucket_counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(
+                self.buckets + (float("inf"),), bucket_counts
+            ):
+                cumulative += bucket_count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        label_names,
+                        key + (_format_value(bound),),
+                        cumulative,
+                    )
+                )
+            samples.append((f"{self.name}_sum", self.label_names, key, total))
+            samples.append((f"{self.name}_count", self.label_names, key, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Collection of metrics exposed together on the /metrics endpoint."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """
+        Render every registered metric in the Prometheus text exposition format.
+
+        Returns:
+            str: Exposition text ending with a newline
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total",
+    "HTTP requests by method, route template and status code.",
+    ("method", "route", "status"),
+)
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by method and route template.",
+    ("method", "route"),
+)
+HTTP_REQUESTS_IN_PROGRESS = REGISTRY.gauge(
+    "http_requests_in_progress", "HTTP requests currently being served."
+)
+HTTP_EXCEPTIONS = REGISTRY.counter(
+    "http_exceptions_total",
+    "Unhandled exceptions raised while serving a route.",
+    ("route", "exception"),
+)
+STAGE_DURATION = REGISTRY.histogram(
+    "stage_duration_seconds",
+    "Time spent in individual stages of a request handler.",
+    ("operation", "stage"),
+)
+DB_QUERY_DURATION = REGISTRY.histogram(
+    "db_query_duration_seconds",
+    "Time spent in database helper calls, including connection setup.",
+    ("helper",),
+)
+DB_ERRORS = REGISTRY.counter(
+    "db_errors_total", "Database helper calls that raised.", ("helper",)
+)
+DB_CONNECTIONS_IN_USE = REGISTRY.gauge(
+    "db_connections_in_use", "SQLite connections currently checked out."
+)
+DB_CONNECTIONS_OPENED = REGISTRY.counter(
+    "db_connections_opened_total", "SQLite connections opened since start."
+)
+DB_WRITE_BATCH_SIZE = REGISTRY.histogram(
+    "db_write_batch_size",
+    "Writes committed together by the group-commit writer.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+DB_WRITE_WAIT = REGISTRY.histogram(
+    "db_write_wait_seconds",
+    "Time a write spent queued before the writer executed it.",
+)
+CRYPTO_BYTES = REGISTRY.counter(
+    "crypto_bytes_total",
+    "Plaintext bytes passed through AES-GCM, by direction.",
+    ("direction",),
+)
+
+
+def stage_timer(operation: str, stage: str):
+    """
+    Time one stage of a request handler.
+
+    Args:
+        operation (str): Handler name, e.g. "download_file"
+        stage (str): Stage within the handler, e.g. "db" or "decrypt"
+
+    Returns:
+        ContextManager: Context manager recording the stage duration
+    """
+    return STAGE_DURATION.time(operation=operation, stage=stage)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route request counts and latencies.
+
+    Routes are labelled by their path template (e.g. "/files/download/{file_id}")
+    so that label cardinality stays bounded by the number of routes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            HTTP_EXCEPTIONS.inc(route=_route_label(scope), exception=type(exc).__name__)
+            raise
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            route = _route_label(scope)
+            method = scope.get("method", "")
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start, method=method, route=route
+            )
+            HTTP_REQUESTS.inc(method=method, route=route, status=status_code)
+
+
+def _route_label(scope) -> str:
+    route: Optional[object] = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
@@ -0,0 +1,203 @@
+import hashlib
+import hmac
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from app.services.database import (
+    execute_query,
+    fetch_one,
+    next_row_id,
+    shard_for_user,
+)
+from app.services.expiry import EXPIRY_WHEEL, utc_timestamp
+from app.services.security import get_server_key
+
+MFA_CODE_TTL_SECONDS = int(os.environ.get("MFA_CODE_TTL_SECONDS", "600"))
+MFA_MAX_ATTEMPTS = int(os.environ.get("MFA_MAX_ATTEMPTS", "5"))
+MFA_MAX_PENDING = int(os.environ.get("MFA_MAX_PENDING", "100000"))
+
+
+@lru_cache(maxsize=None)
+def _code_key() -> bytes:
+    return hashlib.sha256(b"mfa-code:" + get_server_key()).digest()
+
+
+def hash_code(user_id: int, code: str) -> str:
+    """
+    Keyed hash of an MFA code, bound to the user it was issued to.
+
+    A plain hash of a 6-digit code is reversed by trying all million codes,
+    so the hash is an HMAC under a key derived from the server key.
+    """
+    return hmac.new(
+        _code_key(), f"{user_id}:{code}".encode(), hashlib.sha256
+    ).hexdigest()
+
+
+class MFAStore(ABC):
+    """
+    Pending MFA challenges, at most one per user.
+
+    A new challenge replaces the user's previous one. A challenge is removed
+    when it is answered, when it expires, and after ``max_attempts`` wrong
+    answers, after which the user has to log in again.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = MFA_CODE_TTL_SECONDS,
+        max_attempts: int = MFA_MAX_ATTEMPTS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def issue(self, user_id: int, code: str):
+        """Store a challenge for ``user_id`` that ``code`` answers."""
+
+    @abstractmethod
+    def verify(self, user_id: int, code: str) -> bool:
+        """
+        Check an answer and consume the challenge if it is right.
+
+        Returns:
+            bool: True if ``code`` answers the user's pending, unexpired challenge
+        """
+
+
+class MemoryMFAStore(MFAStore):
+    """
+    In-process challenge store; issuing and verifying touch no disk.
+
+    Challenges expire through the shared timing wheel, so expiry costs O(1)
+    per challenge. At most ``max_pending`` challenges are held; beyond that
+    the oldest is dropped. Challenges are lost on restart and are not shared
+    between workers, so multi-worker deployments need sticky sessions or
+    ``MFA_STORE=database``.
+    """
+
+    def __init__(
+        self, max_pending: int = MFA_MAX_PENDING, wheel=EXPIRY_WHEEL, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.max_pending = max_pending
+        self.wheel = wheel
+        # user_id -> [code hash, expiry timestamp, failed attempts]
+        self._challenges: "OrderedDict[int, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        wheel.on_expire("mfa_challenge", self._expire)
+
+    def issue(self, user_id: int, code: str):
+        expires_at = self.wheel.clock() + self.ttl_seconds
+        evicted = []
+        with self._lock:
+            self._challenges.pop(user_id, None)
+            while len(self._challenges) >= self.max_pending:
+                evicted.append(self._challenges.popitem(last=False)[0])
+            self._challenges[user_id] = [hash_code(user_id, code), expires_at, 0]
+        for evicted_id in evicted:
+            self.wheel.cancel("mfa_challenge", evicted_id)
+        self.wheel.schedule("mfa_challenge", user_id, expires_at)
+
+    def verify(self, user_id: int, code: str) -> bool:
+        candidate = hash_code(user_id, code)
+        with self._lock:
+            challenge = self._challenges.get(user_id)
+            if challenge is None:
+                return False
+            accepted = challenge[1] > self.wheel.clock() and hmac.compare_digest(
+                challenge[0], candidate
+            )
+            if not accepted:
+                challenge[2] += 1
+            consumed = accepted or challenge[2] >= self.max_attempts
+            if consumed:
+                del self._challenges[user_id]
+        if consumed:
+            self.wheel.cancel("mfa_challenge", user_id)
+        return accepted
+
+    def _expire(self, events):
+        now = self.wheel.clock()
+        with self._lock:
+            for user_id, _ in events:
+                challenge = self._challenges.get(user_id)
+                if challenge is not None and challenge[1] <= now:
+                    del self._challenges[user_id]
+
+    def __len__(self):
+        return len(self._challenges)
+
+
+class DatabaseMFAStore(MFAStore):
+    """
+    Challenge store in the ``mfa_codes`` table, for deployments where login
+    and verification may reach different nodes.
+    """
+
+    def issue(self, user_id: int, code: str):
+        expiry = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        shard = shard_for_user(user_id)
+        execute_query(
+            "DELETE FROM mfa_codes WHERE user_id = ?", (user_id,), shard=shard
+        )
+        cursor = execute_query(
+            f"""INSERT INTO mfa_codes (id, user_id, code, expires_at)
+               VALUES ({next_row_id("mfa_codes", shard)}, ?, ?, ?)""",
+            (user_id, hash_code(user_id, code), expiry),
+            shard=shard,
+        )
+        EXPIRY_WHEEL.schedule(
+            "mfa_code", cursor.lastrowid, utc_timestamp(expiry), user_id
+        )
+
+    def verify(self, user_id: int, code: str) -> bool:
+        shard = shard_for_user(user_id)
+        challenge = fetch_one(
+            """
+            SELECT id, code, attempts FROM mfa_codes
+            WHERE user_id = ? AND expires_at > ?
+            ORDER BY id DESC LIMIT 1
+            """,
+            (user_id, datetime.utcnow()),
+            shard=shard,
+        )
+        if not challenge:
+            return False
+        code_id, code_hash, attempts = challenge
+        if hmac.compare_digest(code_hash, hash_code(user_id, code)):
+            execute_query(
+                "DELETE FROM mfa_codes WHERE user_id = ?", (user_id,), shard=shard
+            )
+            EXPIRY_WHEEL.cancel("mfa_code", code_id)
+            return True
+        if attempts + 1 >= self.max_attempts:
+            execute_query("DELETE FROM mfa_codes WHERE id = ?", (code_id,), shard=shard)
+            EXPIRY_WHEEL.cancel("mfa_code", code_id)
+        else:
+            execute_query(
+                "UPDATE mfa_codes SET attempts = attempts + 1 WHERE id = ?",
+                (code_id,),
+                shard=shard,
+            )
+        return False
+
+
+@lru_cache(maxsize=None)
+def get_mfa_store() -> MFAStore:
+    """
+    Build the challenge store selected by the MFA_STORE environment variable.
+
+    Returns:
+        MFAStore: MemoryMFAStore (default, "memory") or DatabaseMFAStore ("database")
+    """
+    backend = os.environ.get("MFA_STORE", "memory")
+    if backend == "database":
+        return DatabaseMFAStore()
+    if backend != "memory":
+        raise ValueError(f"Unknown MFA_STORE: {backend}")
+    return MemoryMFAStore()
@@ -0,0 +1,445 @@
+"""
+Pack-file storage for small blobs.
+
+With ``STORAGE_PACKING=1`` the local storage backend appends blobs smaller than
+``PACK_SMALL_BLOB_BYTES`` to large segment files under ``PACK_DIRECTORY``
+instead of creating one file per blob. ``packed_blobs`` maps each storage key
+to its (pack, offset, length), so rows in ``files`` and the version tables keep
+their opaque keys and compaction only rewrites the address map.
+
+Each process appends to its own active pack and seals it once it reaches
+``PACK_SEGMENT_BYTES``. Deleting a packed blob only drops its address; the
+compactor later copies the live blobs out of sparse packs, retires them, and
+removes retired pack files after a grace period so in-flight reads finish::
+
+    python -m app.services.packs compact
+    python -m app.services.packs stats
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from app.services.database import fetch_all, fetch_one, get_db_connection
+from app.services.metrics import REGISTRY
+from app.services.storage import (
+    CHUNK_SIZE,
+    UPLOAD_DIRECTORY,
+    BlobData,
+    LocalStorage,
+    StorageBackend,
+    _iterate,
+)
+
+PACK_DIRECTORY_NAME = ".packs"
+PACK_DIRECTORY = os.environ.get(
+    "PACK_DIRECTORY", os.path.join(UPLOAD_DIRECTORY, PACK_DIRECTORY_NAME)
+)
+PACK_SMALL_BLOB_BYTES = int(os.environ.get("PACK_SMALL_BLOB_BYTES", str(128 * 1024)))
+PACK_SEGMENT_BYTES = int(os.environ.get("PACK_SEGMENT_BYTES", str(256 * 1024**2)))
+PACK_MIN_DEAD_RATIO = float(os.environ.get("PACK_MIN_DEAD_RATIO", "0.5"))
+PACK_RETIRE_GRACE_SECONDS = float(os.environ.get("PACK_RETIRE_GRACE_SECONDS", "3600"))
+PACK_STALE_ACTIVE_SECONDS = 86400
+PACK_MAX_OPEN_FILES = 64
+
+PACKED_BLOBS_WRITTEN = REGISTRY.counter(
+    "packed_blobs_written_total", "Small blobs appended to pack files."
+)
+PACK_BYTES_RECLAIMED = REGISTRY.counter(
+    "pack_bytes_reclaimed_total", "Dead pack bytes released by compaction."
+)
+
+
+class _OpenPack:
+    __slots__ = ("fd", "readers", "evicted")
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.readers = 0
+        self.evicted = False
+
+
+class PackedStorage(StorageBackend):
+    """
+    Local storage that appends small blobs to shared pack files.
+
+    Blobs at or above ``small_blob_bytes`` and every key that is not in
+    ``packed_blobs`` are handled by the wrapped LocalStorage, so existing blobs
+    keep working unchanged. Packed blobs are read with ``os.pread`` on cached
+    file descriptors.
+    """
+
+    def __init__(
+        self,
+        inner: LocalStorage,
+        pack_directory: str = PACK_DIRECTORY,
+        small_blob_bytes: int = PACK_SMALL_BLOB_BYTES,
+        segment_bytes: int = PACK_SEGMENT_BYTES,
+    ):
+        self.inner = inner
+        self.pack_directory = pack_directory
+        self.small_blob_bytes = small_blob_bytes
+        self.segment_bytes = segment_bytes
+        os.makedirs(pack_directory, exist_ok=True)
+        self._append_lock = threading.Lock()
+        self._active: Optional[tuple] = None
+        self._fds: Dict[int, _OpenPack] = {}
+        self._fds_lock = threading.Lock()
+
+    def new_key(self, filename: str) -> str:
+        return self.inner.new_key(filename)
+
+    async def write(self, key: str, data: BlobData) -> int:
+        # A packed address shadows the loose file, so drop it on overwrite.
+        # Fresh keys, the common case, only cost a read.
+        if await self.inner._run(self.address, key) is not None:
+            await self.inner._run(self.delete_address, key)
+        buffered = bytearray()
+        chunks = _iterate(data)
+        async for chunk in chunks:
+            buffered += chunk
+            if len(buffered) >= self.small_blob_bytes:
+                return await self.inner.write(key, _prepend(bytes(buffered), chunks))
+        return await self.inner._run(self.append, key, bytes(buffered))
+
+    def append(self, key: str, data: bytes) -> int:
+        """Append one blob to this process's active pack and record its address."""
+        with self._append_lock:
+            pack_id, path, handle, offset = self._active_pack()
+            handle.write(data)
+            handle.flush()
+            with get_db_connection() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO packed_blobs (storage_key, pack_id, pack_offset, length)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (key, pack_id, offset, len(data)),
+                )
+                self._record_append(conn, pack_id, offset + len(data), len(data))
+                conn.commit()
+            self._advance(offset + len(data))
+        PACKED_BLOBS_WRITTEN.inc()
+        return len(data)
+
+    def relocate(self, key: str, old_pack_id: int, old_offset: int, data: bytes):
+        """
+        Copy a live blob out of a pack being compacted.
+
+        The address is only moved if it still points at the old location, so a
+        blob deleted meanwhile stays deleted and its copy counts as dead.
+        """
+        with self._append_lock:
+            pack_id, path, handle, offset = self._active_pack()
+            handle.write(data)
+            handle.flush()
+            with get_db_connection() as conn:
+                moved = conn.execute(
+                    """
+                    UPDATE packed_blobs SET pack_id = ?, pack_offset = ?
+                    WHERE storage_key = ? AND pack_id = ? AND pack_offset = ?
+                    """,
+                    (pack_id, offset, key, old_pack_id, old_offset),
+                ).rowcount
+                self._record_append(
+                    conn, pack_id, offset + len(data), len(data) if moved else 0
+                )
+                if moved:
+                    conn.execute(
+                        "UPDATE packs SET live_bytes = live_bytes - ? WHERE id = ?",
+                        (len(data), old_pack_id),
+                    )
+                conn.commit()
+            self._advance(offset + len(data))
+
+    @staticmethod
+    def _record_append(conn, pack_id: int, total_bytes: int, live_bytes: int):
+        conn.execute(
+            """
+            UPDATE packs SET total_bytes = ?, live_bytes = live_bytes + ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (total_bytes, live_bytes, pack_id),
+        )
+
+    def _active_pack(self):
+        if self._active is None:
+            with get_db_connection() as conn:
+                cursor = conn.execute("INSERT INTO packs (path) VALUES ('')")
+                pack_id = cursor.lastrowid
+                path = os.path.join(self.pack_directory, f"{pack_id}.pack")
+                conn.execute("UPDATE packs SET path = ? WHERE id = ?", (path, pack_id))
+                conn.commit()
+            self._active = (pack_id, path, open(path, "ab"), 0)
+        return self._active
+
+    def _advance(self, size: int):
+        pack_id, path, handle, _ = self._active
+        if size < self.segment_bytes:
+            self._active = (pack_id, path, handle, size)
+            return
+        handle.close()
+        self._active = None
+        self._seal(pack_id)
+
+    @staticmethod
+    def _seal(pack_id: int):
+        with get_db_connection() as conn:
+            conn.execute(
+                "UPDATE packs SET state = 'sealed' WHERE id = ? AND state = 'active'",
+                (pack_id,),
+            )
+            conn.commit()
+
+    @contextmanager
+    def _fd(self, pack_id: int, path: str):
+        """
+        Borrow the cached descriptor of a pack for the duration of a read.
+
+        A descriptor evicted from the cache while borrowed is closed when its
+        last reader returns it, never under a pread in another thread.
+        """
+        with self._fds_lock:
+            pack = self._fds.get(pack_id)
+            if pack is None:
+                if len(self._fds) >= PACK_MAX_OPEN_FILES:
+                    self._evict(self._fds.pop(next(iter(self._fds))))
+                pack = self._fds[pack_id] = _OpenPack(os.open(path, os.O_RDONLY))
+            pack.readers += 1
+        try:
+            yield pack.fd
+        finally:
+            with self._fds_lock:
+                pack.readers -= 1
+                if pack.evicted and not pack.readers:
+                    os.close(pack.fd)
+
+    @staticmethod
+    def _evict(pack: _OpenPack):
+        # Called with _fds_lock held.
+        pack.evicted = True
+        if not pack.readers:
+            os.close(pack.fd)
+
+    @staticmethod
+    def address(key: str) -> Optional[tuple]:
+        """Return ``(pack_id, pack_path, offset, length)`` for a packed key."""
+        return fetch_one(
+            """
+            SELECT b.pack_id, p.path, b.pack_offset, b.length
+            FROM packed_blobs b JOIN packs p ON p.id = b.pack_id
+            WHERE b.storage_key = ?
+            """,
+            (key,),
+        )
+
+    def read_range(self, pack_id: int, path: str, offset: int, length: int) -> bytes:
+        with self._fd(pack_id, path) as fd:
+            data = os.pread(fd, length, offset)
+        if len(data) != length:
+            raise FileNotFoundError(f"Pack {path} is truncated")
+        return data
+
+    async def read(self, key: str) -> AsyncIterator[bytes]:
+        address = await self.inner._run(self.address, key)
+        if address is None:
+            async for chunk in self.inner.read(key):
+                yield chunk
+            return
+        pack_id, path, offset, length = address
+        for start in range(offset, offset + length, CHUNK_SIZE):
+            yield await self.inner._run(
+                self.read_range,
+                pack_id,
+                path,
+                start,
+                min(CHUNK_SIZE, offset + length - start),
+            )
+
+    def delete_address(self, key: str) -> bool:
+        with get_db_connection() as conn:
+            row = conn.execute(
+                "DELETE FROM packed_blobs WHERE storage_key = ? RETURNING pack_id, length",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE packs SET live_bytes = live_bytes - ? WHERE id = ?",
+                    (row[1], row[0]),
+                )
+            conn.commit()
+        return row is not None
+
+    async def delete(self, key: str) -> bool:
+        if await self.inner._run(self.delete_address, key):
+            return True
+        return await self.inner.delete(key)
+
+    async def exists(self, key: str) -> bool:
+        address = await self.inner._run(self.address, key)
+        if address is not None:
+            return await self.inner._run(self._holds, address)
+        return await self.inner.exists(key)
+
+    @staticmethod
+    def _holds(address: tuple) -> bool:
+        # An address restored from a backup may point into a pack file that
+        # was lost or is shorter than the blob.
+        _, path, offset, length = address
+        try:
+            return os.path.getsize(path) >= offset + length
+        except OSError:
+            return False
+
+    def seal_active(self):
+        with self._append_lock:
+            if self._active is not None:
+                pack_id, _, handle, _ = self._active
+                handle.close()
+                self._active = None
+                self._seal(pack_id)
+
+    async def close(self):
+        self.seal_active()
+        with self._fds_lock:
+            for pack in self._fds.values():
+                self._evict(pack)
+            self._fds.clear()
+        await self.inner.close()
+
+
+async def _prepend(head: bytes, rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield head
+    async for chunk in rest:
+        yield chunk
+
+
+def compact(
+    storage: PackedStorage,
+    min_dead_ratio: float = PACK_MIN_DEAD_RATIO,
+    grace_seconds: float = PACK_RETIRE_GRACE_SECONDS,
+) -> dict:
+    """
+    Rewrite sparse packs and remove retired ones.
+
+    Sealed packs whose dead bytes make up at least ``min_dead_ratio`` of the
+    file have their live blobs copied, in offset order, into the compacting
+    process's active pack and are then retired. Retired packs are deleted
+    once ``grace_seconds`` have passed. Active packs that have not been written
+    to for a day belong to processes that exited without sealing them and are
+    sealed first.
+
+    Returns:
+        dict: Packs compacted and deleted, blobs moved and bytes reclaimed
+    """
+    report = {"compacted": 0, "deleted": 0, "moved_blobs": 0, "reclaimed_bytes": 0}
+    with get_db_connection() as conn:
+        conn.execute(
+            """
+            UPDATE packs SET state = 'sealed'
+            WHERE state = 'active' AND updated_at < datetime('now', ?)
+            """,
+            (f"-{PACK_STALE_ACTIVE_SECONDS} seconds",),
+        )
+        conn.commit()
+
+    for pack_id, path, total_bytes in fetch_all(
+        """
+        SELECT id, path, total_bytes FROM packs
+        WHERE state = 'retired' AND retired_at < datetime('now', ?)
+        """,
+        (f"-{grace_seconds} seconds",),
+    ):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        with get_db_connection() as conn:
+            conn.execute("DELETE FROM packs WHERE id = ?", (pack_id,))
+            conn.commit()
+        report["deleted"] += 1
+
+    for pack_id, path, total_bytes, live_bytes in fetch_all(
+        """
+        SELECT id, path, total_bytes, live_bytes FROM packs
+        WHERE state = 'sealed' AND total_bytes > 0
+          AND total_bytes - live_bytes >= total_bytes * ?
+        """,
+        (min_dead_ratio,),
+    ):
+        for key, offset, length in fetch_all(
+            """
+            SELECT storage_key, pack_offset, length FROM packed_blobs
+            WHERE pack_id = ? ORDER BY pack_offset
+            """,
+            (pack_id,),
+        ):
+            data = storage.read_range(pack_id, path, offset, length)
+            storage.relocate(key, pack_id, offset, data)
+            report["moved_blobs"] += 1
+        with get_db_connection() as conn:
+            conn.execute(
+                """
+                UPDATE packs SET state = 'retired', retired_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                (pack_id,),
+            )
+            conn.commit()
+        report["compacted"] += 1
+        report["reclaimed_bytes"] += total_bytes - live_bytes
+        PACK_BYTES_RECLAIMED.inc(total_bytes - live_bytes)
+    return report
+
+
+def pack_stats() -> dict:
+    rows = fetch_all(
+        """
+        SELECT state, COUNT(*), COALESCE(SUM(total_bytes), 0),
+               COALESCE(SUM(live_bytes), 0)
+        FROM packs GROUP BY state
+        """
+    )
+    blobs = fetch_one("SELECT COUNT(*) FROM packed_blobs")[0]
+    return {
+        "packed_blobs": blobs,
+        "packs": {
+            state: {"count": count, "total_bytes": total, "live_bytes": live}
+            for state, count, total, live in rows
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and compact pack files.")
+    parser.add_argument("command", choices=("compact", "stats"))
+    parser.add_argument("--min-dead-ratio", type=float, default=PACK_MIN_DEAD_RATIO)
+    parser.add_argument(
+        "--grace-seconds", type=float, default=PACK_RETIRE_GRACE_SECONDS
+    )
+    args = parser.parse_args(argv)
+
+    from app.services.database import migrate
+
+    migrate()
+    if args.command == "stats":
+        print(json.dumps(pack_stats(), indent=2))
+        return
+
+    storage = PackedStorage(LocalStorage(UPLOAD_DIRECTORY, io_threads=1))
+    try:
+        started = time.monotonic()
+        report = compact(storage, args.min_dead_ratio, args.grace_seconds)
+        report["seconds"] = round(time.monotonic() - started, 3)
+    finally:
+        storage.seal_active()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
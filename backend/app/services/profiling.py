@@ -0,0 +1,241 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from app.services.security import SecurityService
+
+PROFILE_HEADER = b"x-profile"
+MAX_STACKS_PER_ROUTE = int(os.environ.get("PROFILE_MAX_STACKS_PER_ROUTE", "5000"))
+MAX_STACK_DEPTH = 128
+
+# Threads whose innermost frame lives in one of these modules are parked (event
+# loop selector, idle worker threads) and are not doing work for any request.
+_IDLE_MODULES = ("selectors.py", "threading.py", "queue.py")
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_APP_ROOT):
+        filename = "app" + filename[len(_APP_ROOT) :]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class _Session:
+    """Samples collected for one profiled request."""
+
+    __slots__ = ("samples",)
+
+    def __init__(self):
+        self.samples: Counter = Counter()
+
+
+class RouteProfile:
+    """Aggregated samples for one route template."""
+
+    def __init__(self):
+        self.stacks: Counter = Counter()
+        self.requests = 0
+        self.total_seconds = 0.0
+        self.dropped_samples = 0
+
+    def merge(self, samples: Counter, duration: float):
+        self.requests += 1
+        self.total_seconds += duration
+        for stack, count in samples.items():
+            if stack in self.stacks or len(self.stacks) < MAX_STACKS_PER_ROUTE:
+                self.stacks[stack] += count
+            else:
+                self.dropped_samples += count
+
+    def copy(self) -> "RouteProfile":
+        profile = RouteProfile()
+        profile.stacks = self.stacks.copy()
+        profile.requests = self.requests
+        profile.total_seconds = self.total_seconds
+        profile.dropped_samples = self.dropped_samples
+        return profile
+
+    def collapsed(self) -> str:
+        """Render in the collapsed-stack format read by flamegraph.pl and speedscope."""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def top_functions(self, limit: int = 25) -> List[dict]:
+        """Functions ranked by inclusive and self sample counts."""
+        inclusive: Counter = Counter()
+        exclusive: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            for frame in set(frames):
+                inclusive[frame] += count
+            exclusive[frames[-1]] += count
+        return [
+            {"function": frame, "inclusive": count, "self": exclusive[frame]}
+            for frame, count in inclusive.most_common(limit)
+        ]
+
+
+class SamplingProfiler:
+    """
+    Wall-clock stack sampler for a sampled fraction of HTTP requests.
+
+    While at least one profiled request is in flight, a background thread reads
+    every thread's stack with ``sys._current_frames()`` at a fixed interval and
+    charges non-idle stacks to the in-flight requests. Nothing runs when no
+    request is being profiled, so leaving the profiler enabled at a low sample
+    rate is cheap. When profiled requests overlap, their samples may include
+    each other's work.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.interval = 0.005
+        self.profiles: Dict[str, RouteProfile] = {}
+        self._sessions: List[_Session] = []
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    def configure(self, enabled: bool, sample_rate: float, interval_ms: float):
+        with self._lock:
+            self.enabled = enabled
+            self.sample_rate = sample_rate
+            self.interval = interval_ms / 1000
+
+    def reset(self):
+        with self._lock:
+            self.profiles = {}
+
+    def snapshot(self, route: str) -> Optional[RouteProfile]:
+        """
+        Copy of a route's profile, safe to render while requests keep merging.
+
+        Returns:
+            RouteProfile: The copy, or None if the route has no samples
+        """
+        with self._lock:
+            profile = self.profiles.get(route)
+            return profile.copy() if profile else None
+
+    def should_profile(self, forced: bool) -> bool:
+        if forced:
+            return True
+        return self.enabled and random.random() < self.sample_rate
+
+    def start(self) -> _Session:
+        session = _Session()
+        with self._lock:
+            self._sessions.append(session)
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._run, name="request-profiler", daemon=True
+                )
+                self._sampler.start()
+        return session
+
+    def finish(self, session: _Session, route: str, duration: float):
+        with self._lock:
+            self._sessions.remove(session)
+            profile = self.profiles.setdefault(route, RouteProfile())
+            profile.merge(session.samples, duration)
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            stacks = self._sample(own_ident)
+            with self._lock:
+                if not self._sessions:
+                    self._sampler = None
+                    return
+                for session in self._sessions:
+                    session.samples.update(stacks)
+
+    @staticmethod
+    def _sample(own_ident: int) -> List[str]:
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident or frame.f_code.co_filename.endswith(_IDLE_MODULES):
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks.append(";".join(reversed(labels)))
+        return stacks
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval * 1000,
+                "routes": {
+                    route: {
+                        "requests": profile.requests,
+                        "samples": sum(profile.stacks.values()),
+                        "dropped_samples": profile.dropped_samples,
+                        "mean_ms": profile.total_seconds / profile.requests * 1000,
+                    }
+                    for route, profile in self.profiles.items()
+                },
+            }
+
+
+PROFILER = SamplingProfiler()
+
+
+def _is_admin_request(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return False
+            try:
+                payload = SecurityService.decode_token(token)
+            except Exception:
+                return False
+            return payload.get("role") == "admin"
+    return False
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling a sampled fraction of requests.
+
+    Admins can force profiling of a single request by sending ``X-Profile: 1``,
+    even while sampling is disabled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        forced = any(
+            name == PROFILE_HEADER and value == b"1"
+            for name, value in scope.get("headers", ())
+        ) and _is_admin_request(scope)
+        if not PROFILER.should_profile(forced):
+            await self.app(scope, receive, send)
+            return
+
+        session = PROFILER.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            PROFILER.finish(session, route, time.perf_counter() - start)
@@ -0,0 +1,280 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException, Request
+from starlette.responses import JSONResponse
+
+from app.services.metrics import REGISTRY
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+
+RATE_LIMITED = REGISTRY.counter(
+    "rate_limited_total", "Requests rejected by a rate limiter.", ("limiter",)
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "admission_rejected_total",
+    "Requests rejected by admission control.",
+    ("budget",),
+)
+ADMISSION_IN_USE = REGISTRY.gauge(
+    "admission_in_use", "Units currently held from an admission budget.", ("budget",)
+)
+
+
+class TokenBucketLimiter:
+    """
+    Keyed token-bucket rate limiter.
+
+    Each key costs two floats (tokens, last refill time). Keys are kept in
+    least-recently-used order; a key idle long enough to have refilled to a
+    full bucket is indistinguishable from a new one and is evicted, and the
+    oldest keys are evicted when ``max_keys`` is reached.
+    """
+
+    def __init__(
+        self, name: str, rate: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.idle_seconds = burst / rate
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """
+        Take ``cost`` tokens from the bucket for ``key``.
+
+        Args:
+            key (str): Client key, e.g. "ip:10.0.0.1" or "user:alice"
+            cost (float): Tokens the request costs
+
+        Returns:
+            float: 0 if the request is allowed, otherwise seconds until it would be
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (cost - bucket[0]) / self.rate
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key, (_, last_seen) = next(iter(buckets.items()))
+            if len(buckets) < self.max_keys and now - last_seen < self.idle_seconds:
+                break
+            buckets.popitem(last=False)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+async def throttle_stream(
+    chunks: AsyncIterator[bytes], limiter: Optional[TokenBucketLimiter]
+) -> AsyncIterator[bytes]:
+    """
+    Pass a stream of chunks through at a byte-rate limiter's pace.
+
+    Background copy jobs use a single-key limiter whose tokens are bytes;
+    ``None`` passes the stream through unthrottled.
+    """
+    async for chunk in chunks:
+        remaining = len(chunk)
+        while limiter and remaining > 0:
+            cost = min(remaining, limiter.burst)
+            wait_seconds = limiter.acquire(limiter.name, cost)
+            if wait_seconds:
+                await asyncio.sleep(wait_seconds)
+                continue
+            remaining -= cost
+        yield chunk
+
+
+class ConcurrencyBudget:
+    """
+    Non-blocking budget of concurrent slots and units (e.g. bytes in flight).
+
+    Requests that do not fit are rejected immediately rather than queued.
+    """
+
+    def __init__(self, name: str, slots: int, units: Optional[int] = None):
+        self.name = name
+        self.slots = slots
+        self.units = units
+        self._slots_used = 0
+        self._units_used = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, units: int = 0) -> bool:
+        with self._lock:
+            if self._slots_used >= self.slots:
+                return False
+            if self.units is not None and self._units_used + units > self.units:
+                return False
+            self._slots_used += 1
+            self._units_used += units
+        ADMISSION_IN_USE.inc(1, budget=self.name)
+        return True
+
+    def release(self, units: int = 0):
+        with self._lock:
+            self._slots_used -= 1
+            self._units_used -= units
+        ADMISSION_IN_USE.dec(1, budget=self.name)
+
+    def fits(self, units: int) -> bool:
+        return self.units is None or units <= self.units
+
+
+CPU_COUNT = os.cpu_count() or 1
+
+AUTH_IP_LIMITER = TokenBucketLimiter(
+    "auth_ip",
+    rate=float(os.environ.get("AUTH_RATE_PER_SECOND", "1")),
+    burst=float(os.environ.get("AUTH_BURST", "20")),
+)
+LOGIN_USER_LIMITER = TokenBucketLimiter(
+    "login_user",
+    rate=float(os.environ.get("LOGIN_USER_RATE_PER_SECOND", "0.2")),
+    burst=float(os.environ.get("LOGIN_USER_BURST", "5")),
+)
+UPLOAD_USER_LIMITER = TokenBucketLimiter(
+    "upload_user",
+    rate=float(os.environ.get("UPLOAD_RATE_PER_SECOND", "2")),
+    burst=float(os.environ.get("UPLOAD_BURST", "10")),
+)
+LIMITERS = (AUTH_IP_LIMITER, LOGIN_USER_LIMITER, UPLOAD_USER_LIMITER)
+
+# Uploads are bounded by disk budget (bytes being received at once) and by
+# slots; decrypt streams are bounded by the CPU budget for AES-GCM work.
+UPLOAD_BUDGET = ConcurrencyBudget(
+    "uploads",
+    slots=int(os.environ.get("MAX_CONCURRENT_UPLOADS", str(CPU_COUNT * 4))),
+    units=int(os.environ.get("UPLOAD_BYTES_IN_FLIGHT", str(2 * 1024**3))),
+)
+DECRYPT_BUDGET = ConcurrencyBudget(
+    "decrypt_streams",
+    slots=int(os.environ.get("MAX_CONCURRENT_DECRYPTS", str(CPU_COUNT * 2))),
+)
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+
+def enforce(limiter: TokenBucketLimiter, key: str):
+    """
+    Charge one request to ``key`` and reject it if the bucket is empty.
+
+    Raises:
+        HTTPException: 429 with a Retry-After header when rate limited
+    """
+    if not RATE_LIMIT_ENABLED:
+        return
+    retry_after = limiter.acquire(key)
+    if retry_after:
+        RATE_LIMITED.inc(limiter=limiter.name)
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+def limit_by_ip(limiter: TokenBucketLimiter):
+    """
+    Build a route dependency that rate limits by client IP.
+
+    Args:
+        limiter (TokenBucketLimiter): Limiter to charge
+
+    Returns:
+        Callable: Dependency for ``Depends``
+    """
+
+    def dependency(request: Request):
+        enforce(limiter, f"ip:{client_ip(request)}")
+
+    return dependency
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying global admission control before the body is read.
+
+    Uploads and decrypting downloads hold a slot from their budget for the
+    whole request. When a budget is exhausted the request is answered with 503
+    and Retry-After straight away, before any multipart spooling or disk I/O.
+    """
+
+    ROUTES = (
+        ("POST", "/files/upload", UPLOAD_BUDGET),
+        ("GET", "/files/download/", DECRYPT_BUDGET),
+        ("GET", "/files/shared/", DECRYPT_BUDGET),
+    )
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        budget = self._budget_for(scope) if scope["type"] == "http" else None
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+
+        units = 0
+        if budget.units is not None:
+            for name, value in scope.get("headers", ()):
+                if name == b"content-length" and value.isdigit():
+                    units = int(value)
+            if not budget.fits(units):
+                response = JSONResponse(
+                    {"detail": "Request exceeds server capacity"}, status_code=413
+                )
+                await response(scope, receive, send)
+                return
+
+        if not budget.try_acquire(units):
+            ADMISSION_REJECTED.inc(budget=budget.name)
+            response = JSONResponse(
+                {"detail": "Server busy, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            budget.release(units)
+
+    def _budget_for(self, scope) -> Optional[ConcurrencyBudget]:
+        method, path = scope.get("method"), scope.get("path", "")
+        for route_method, prefix, budget in self.ROUTES:
+            if method == route_method and path.startswith(prefix):
+                return budget
+        return None
@@ -0,0 +1,277 @@
+"""
+Reconcile blobs on disk with rows in ``files``.
+
+Uploads write the blob before inserting the row, and deletes remove the blob
+before the row, so a crash can leave orphaned blobs without a row or dangling
+rows whose blob is gone. This job walks ``UPLOAD_DIRECTORY`` in sorted order and
+merge-joins it with ``files.file_path`` read through its index, so it runs in
+constant memory however many entries there are. The directory listing is
+sorted externally: names are sorted in bounded runs spilled to temporary files
+and merged.
+
+By default it only reports. ``--quarantine`` moves orphans into a quarantine
+directory and ``--mark-missing`` sets ``integrity_status = 'missing'`` on
+dangling rows::
+
+    python -m app.services.reconcile --quarantine --mark-missing
+"""
+
+import argparse
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import time
+from array import array
+from contextlib import ExitStack
+from typing import Iterator, List, Tuple
+
+from app.services.database import all_shards, execute_many, group_by_shard, iter_rows
+from app.services.packs import PACK_DIRECTORY, PACK_DIRECTORY_NAME
+from app.services.storage import UPLOAD_DIRECTORY
+
+RECONCILE_RUN_SIZE = 100_000
+RECONCILE_MIN_AGE_SECONDS = 3600
+QUARANTINE_DIRECTORY_NAME = ".quarantine"
+MAX_REPORTED_ENTRIES = 1000
+
+
+def _walk(root: str, min_age: float, skip: Tuple[str, ...]) -> Iterator[str]:
+    cutoff = time.time() - min_age
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path not in skip:
+                        stack.append(entry.path)
+                elif entry.name.endswith(".part"):
+                    continue
+                elif entry.stat(follow_symlinks=False).st_mtime <= cutoff:
+                    yield entry.path
+
+
+def sorted_blob_paths(
+    root: str,
+    min_age: float = RECONCILE_MIN_AGE_SECONDS,
+    run_size: int = RECONCILE_RUN_SIZE,
+    skip: Tuple[str, ...] = (),
+) -> Iterator[str]:
+    """
+    Yield the paths of blobs under ``root`` in sorted order.
+
+    Blobs modified within the last ``min_age`` seconds and temporary ``.part``
+    files are skipped, since their upload may still be in progress.
+
+    Args:
+        root (str): Directory to walk
+        min_age (float): Minimum age in seconds of a reported blob
+        run_size (int): Paths sorted in memory at a time
+        skip (tuple): Subdirectories to leave out, e.g. the quarantine
+
+    Yields:
+        str: Blob paths, in the same order as SQLite's BINARY collation
+    """
+    with ExitStack() as stack:
+        runs = []
+        chunk: List[str] = []
+
+        def spill():
+            chunk.sort()
+            run = stack.enter_context(tempfile.TemporaryFile("w+", encoding="utf-8"))
+            run.writelines(f"{path}\n" for path in chunk)
+            run.seek(0)
+            runs.append(path.rstrip("\n") for path in run)
+            chunk.clear()
+
+        for path in _walk(root, min_age, skip):
+            chunk.append(path)
+            if len(chunk) >= run_size:
+                spill()
+        if not runs:
+            chunk.sort()
+            yield from chunk
+            return
+        if chunk:
+            spill()
+        yield from heapq.merge(*runs)
+
+
+def _key_bounds(root: str) -> tuple:
+    prefix = os.path.join(root, "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def packed_blob_keys(root: str) -> Iterator[str]:
+    """Yield the keys of blobs stored in pack files under ``root``, sorted."""
+    for (key,) in iter_rows(
+        """
+        SELECT storage_key FROM packed_blobs
+        WHERE storage_key >= ? AND storage_key < ?
+        ORDER BY storage_key
+        """,
+        _key_bounds(root),
+    ):
+        yield key
+
+
+def indexed_file_paths(root: str) -> Iterator[tuple]:
+    """
+    Yield ``(path, file_id)`` for blobs referenced under ``root``, sorted by path.
+
+    Covers file rows and the chunks of versioned files in every shard; chunks
+    have no file id. The range conditions let SQLite walk
+    ``idx_files_file_path`` and ``idx_chunks_storage_key`` instead of sorting
+    either table.
+    """
+    bounds = _key_bounds(root)
+    streams = []
+    for shard in all_shards():
+        streams.append(
+            iter_rows(
+                """
+                SELECT file_path, id FROM files
+                WHERE file_path >= ? AND file_path < ?
+                ORDER BY file_path
+                """,
+                bounds,
+                shard=shard,
+            )
+        )
+        streams.append(
+            iter_rows(
+                """
+                SELECT storage_key, NULL FROM chunks
+                WHERE storage_key >= ? AND storage_key < ?
+                ORDER BY storage_key
+                """,
+                bounds,
+                shard=shard,
+            )
+        )
+    yield from heapq.merge(*streams, key=lambda row: row[0])
+
+
+def reconcile(
+    root: str = UPLOAD_DIRECTORY,
+    quarantine: bool = False,
+    mark_missing: bool = False,
+    min_age: float = RECONCILE_MIN_AGE_SECONDS,
+    run_size: int = RECONCILE_RUN_SIZE,
+) -> dict:
+    """
+    Merge-join blobs on disk with file rows and report or fix mismatches.
+
+    Args:
+        root (str): Upload directory
+        quarantine (bool): Move orphaned blobs to ``root/.quarantine``
+        mark_missing (bool): Set integrity_status to 'missing' on dangling rows
+        min_age (float): Ignore blobs younger than this many seconds
+        run_size (int): Paths sorted in memory at a time
+
+    Returns:
+        dict: Counts of blobs, rows, orphans and dangling rows, with samples
+    """
+    quarantine_dir = os.path.join(root, QUARANTINE_DIRECTORY_NAME)
+    report = {
+        "blobs": 0,
+        "rows": 0,
+        "orphaned_blobs": 0,
+        "dangling_rows": 0,
+        "quarantined": 0,
+        "orphaned_sample": [],
+        "dangling_sample": [],
+    }
+    # Rows are marked after the join: the read cursor holds a shared lock for
+    # its whole duration. Eight bytes per dangling row is all this keeps.
+    missing_ids = array("q")
+
+    def orphan(path):
+        report["orphaned_blobs"] += 1
+        if len(report["orphaned_sample"]) < MAX_REPORTED_ENTRIES:
+            report["orphaned_sample"].append(path)
+        # Packed orphans have no file of their own; compaction reclaims them
+        # once their address is gone.
+        if quarantine and os.path.lexists(path):
+            target = os.path.join(quarantine_dir, os.path.relpath(path, root))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+            report["quarantined"] += 1
+
+    def dangling(path, file_id):
+        report["dangling_rows"] += 1
+        if len(report["dangling_sample"]) < MAX_REPORTED_ENTRIES:
+            report["dangling_sample"].append({"file_id": file_id, "file_path": path})
+        if mark_missing and file_id is not None:
+            missing_ids.append(file_id)
+
+    # Packed blobs count as present; the pack files themselves are not blobs.
+    skip = (quarantine_dir, os.path.join(root, PACK_DIRECTORY_NAME), PACK_DIRECTORY)
+    blobs = heapq.merge(
+        sorted_blob_paths(root, min_age, run_size, skip=skip), packed_blob_keys(root)
+    )
+    rows = indexed_file_paths(root)
+    blob = next(blobs, None)
+    row = next(rows, None)
+    while blob is not None or row is not None:
+        if row is None or (blob is not None and blob < row[0]):
+            report["blobs"] += 1
+            orphan(blob)
+            blob = next(blobs, None)
+        elif blob is None or row[0] < blob:
+            report["rows"] += 1
+            if not os.path.exists(row[0]):
+                dangling(row[0], row[1])
+            row = next(rows, None)
+        else:
+            report["blobs"] += 1
+            report["rows"] += 1
+            current = blob
+            blob = next(blobs, None)
+            row = next(rows, None)
+            # Several rows may share a blob path; consume them all.
+            while row is not None and row[0] == current:
+                report["rows"] += 1
+                row = next(rows, None)
+
+    for shard, file_ids in group_by_shard(missing_ids).items():
+        for start in range(0, len(file_ids), 1000):
+            execute_many(
+                "UPDATE files SET integrity_status = 'missing' WHERE id = ?",
+                [(file_id,) for file_id in file_ids[start : start + 1000]],
+                shard=shard,
+            )
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Find orphaned blobs and file rows whose blob is missing."
+    )
+    parser.add_argument("--root", default=UPLOAD_DIRECTORY)
+    parser.add_argument("--quarantine", action="store_true")
+    parser.add_argument("--mark-missing", action="store_true")
+    parser.add_argument(
+        "--min-age",
+        type=float,
+        default=RECONCILE_MIN_AGE_SECONDS,
+        help="seconds; younger blobs may belong to uploads still in progress",
+    )
+    parser.add_argument("--run-size", type=int, default=RECONCILE_RUN_SIZE)
+    args = parser.parse_args(argv)
+
+    if os.environ.get("STORAGE_BACKEND", "local") != "local":
+        parser.error("reconciliation supports local storage only")
+
+    from app.services.database import migrate
+
+    migrate()
+    report = reconcile(
+        args.root, args.quarantine, args.mark_missing, args.min_age, args.run_size
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
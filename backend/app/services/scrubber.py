@@ -0,0 +1,271 @@
+"""
+Background integrity scrubber for stored ciphertext.
+
+Every blob is AES-GCM ciphertext followed by its 16-byte tag. The scrubber
+recomputes the tag of each blob in a pool of worker processes and records the
+outcome in ``files.last_verified_at`` and ``files.integrity_status``. Files are
+visited oldest-verified first, so repeated bounded runs (``--max-files`` or
+``--time-limit``) cover the whole store incrementally and then start over once
+``--reverify-after-days`` have passed.
+
+Run it from cron or by hand::
+
+    python -m app.services.scrubber --max-files 100000 --bytes-per-second 52428800
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import List, Optional
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from app.services.database import execute_many, fetch_all_shards, group_by_shard
+from app.services.metrics import REGISTRY
+from app.services.ratelimit import TokenBucketLimiter
+from app.services.storage import CHUNK_SIZE
+
+GCM_TAG_BYTES = 16
+SCRUB_BATCH_SIZE = 500
+SCRUB_BYTES_PER_SECOND = int(
+    os.environ.get("SCRUB_BYTES_PER_SECOND", str(50 * 1024 * 1024))
+)
+SCRUB_REVERIFY_AFTER_DAYS = float(os.environ.get("SCRUB_REVERIFY_AFTER_DAYS", "30"))
+
+SCRUB_FILES = REGISTRY.counter(
+    "scrub_files_total", "Blobs checked by the integrity scrubber.", ("result",)
+)
+SCRUB_BYTES = REGISTRY.counter(
+    "scrub_bytes_total", "Ciphertext bytes read by the integrity scrubber."
+)
+
+_worker_key: Optional[bytes] = None
+
+
+def _init_worker(server_key: bytes):
+    global _worker_key
+    _worker_key = server_key
+
+
+def verify_blob(
+    path: str,
+    iv: bytes,
+    server_key: Optional[bytes] = None,
+    offset: int = 0,
+    length: Optional[int] = None,
+) -> str:
+    """
+    Check the GCM tag of one blob without holding it in memory.
+
+    Args:
+        path (str): Blob path on the local filesystem, or the pack holding it
+        iv (bytes): IV stored with the file row
+        server_key (bytes, optional): AES key; defaults to the worker's key
+        offset (int): Start of the blob within a pack file
+        length (int, optional): Blob length within a pack file
+
+    Returns:
+        str: "ok", "corrupt" or "missing"
+    """
+    try:
+        handle = open(path, "rb")
+    except FileNotFoundError:
+        return "missing"
+    with handle:
+        size = os.fstat(handle.fileno()).st_size - offset
+        if length is not None:
+            if length > size:
+                return "corrupt"
+            size = length
+        if size < GCM_TAG_BYTES:
+            return "corrupt"
+        handle.seek(offset + size - GCM_TAG_BYTES)
+        tag = handle.read(GCM_TAG_BYTES)
+        handle.seek(offset)
+        try:
+            decryptor = Cipher(
+                algorithms.AES(server_key or _worker_key), modes.GCM(iv, tag)
+            ).decryptor()
+        except ValueError:
+            return "corrupt"
+        remaining = size - GCM_TAG_BYTES
+        while remaining:
+            chunk = handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return "corrupt"
+            decryptor.update(chunk)
+            remaining -= len(chunk)
+    try:
+        decryptor.finalize()
+    except InvalidTag:
+        return "corrupt"
+    return "ok"
+
+
+def _verify_task(file_id: int, path: str, iv: bytes, offset, length):
+    return file_id, verify_blob(path, iv, offset=offset or 0, length=length)
+
+
+class Scrubber:
+    """
+    Incremental, bandwidth-limited verification of every stored blob.
+
+    The parent process reads batches of due files, charges each blob's size to a
+    token bucket before handing it to the pool, and writes results back one
+    batch per transaction. At most two tasks per worker are in flight, so memory
+    use does not depend on the number of files.
+    """
+
+    def __init__(
+        self,
+        server_key: bytes,
+        workers: int = os.cpu_count() or 1,
+        bytes_per_second: int = SCRUB_BYTES_PER_SECOND,
+        reverify_after_days: float = SCRUB_REVERIFY_AFTER_DAYS,
+    ):
+        self.server_key = server_key
+        self.workers = workers
+        self.reverify_after_days = reverify_after_days
+        self.limiter = TokenBucketLimiter(
+            "scrub",
+            rate=bytes_per_second,
+            burst=max(bytes_per_second, CHUNK_SIZE),
+            max_keys=1,
+        )
+
+    def due_files(self, limit: int) -> List[tuple]:
+        # Every shard offers its own oldest files; the oldest of those go first.
+        rows = fetch_all_shards(
+            """
+            SELECT f.id, COALESCE(p.path, f.file_path), f.iv, f.size_bytes,
+                   b.pack_offset, b.length, f.last_verified_at
+            FROM files f
+            LEFT JOIN packed_blobs b ON b.storage_key = f.file_path
+            LEFT JOIN packs p ON p.id = b.pack_id
+            WHERE f.last_verified_at IS NULL
+               OR f.last_verified_at < datetime('now', ?)
+            ORDER BY f.last_verified_at, f.id
+            LIMIT ?
+            """,
+            (f"-{self.reverify_after_days} days", limit),
+        )
+        rows.sort(key=lambda row: (row[6] is not None, row[6] or "", row[0]))
+        return [row[:6] for row in rows[:limit]]
+
+    def _throttle(self, nbytes: int):
+        while nbytes > 0:
+            cost = min(nbytes, self.limiter.burst)
+            wait_seconds = self.limiter.acquire("scrub", cost)
+            if wait_seconds:
+                time.sleep(wait_seconds)
+                continue
+            nbytes -= cost
+
+    def run(
+        self, max_files: Optional[int] = None, time_limit: Optional[float] = None
+    ) -> dict:
+        """
+        Verify due files until none are left or a limit is reached.
+
+        Args:
+            max_files (int, optional): Stop after this many files
+            time_limit (float, optional): Stop starting new files after this many seconds
+
+        Returns:
+            dict: Counts per result, ids of corrupt and missing files, bytes read
+        """
+        started = time.monotonic()
+        report = {"checked": 0, "ok": 0, "corrupt": [], "missing": [], "bytes": 0}
+
+        def out_of_budget():
+            if max_files is not None and report["checked"] >= max_files:
+                return True
+            return time_limit is not None and time.monotonic() - started >= time_limit
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.server_key,),
+        ) as pool:
+            while not out_of_budget():
+                batch_size = SCRUB_BATCH_SIZE
+                if max_files is not None:
+                    batch_size = min(batch_size, max_files - report["checked"])
+                batch = self.due_files(batch_size)
+                if not batch:
+                    break
+
+                results, pending = [], set()
+                for file_id, path, iv, size_bytes, offset, length in batch:
+                    if out_of_budget():
+                        break
+                    if len(pending) >= self.workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        results.extend(future.result() for future in done)
+                    self._throttle(size_bytes)
+                    pending.add(
+                        pool.submit(_verify_task, file_id, path, iv, offset, length)
+                    )
+                    SCRUB_BYTES.inc(size_bytes)
+                    report["checked"] += 1
+                    report["bytes"] += size_bytes
+                results.extend(future.result() for future in wait(pending).done)
+
+                for file_id, status in results:
+                    SCRUB_FILES.inc(result=status)
+                    if status == "ok":
+                        report["ok"] += 1
+                    else:
+                        report[status].append(file_id)
+                statuses = dict(results)
+                for shard, file_ids in group_by_shard(statuses).items():
+                    execute_many(
+                        """
+                        UPDATE files
+                        SET last_verified_at = CURRENT_TIMESTAMP, integrity_status = ?
+                        WHERE id = ?
+                        """,
+                        [(statuses[file_id], file_id) for file_id in file_ids],
+                        shard=shard,
+                    )
+
+        report["seconds"] = round(time.monotonic() - started, 3)
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Verify the GCM tags of stored blobs and record the results."
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--bytes-per-second", type=int, default=SCRUB_BYTES_PER_SECOND)
+    parser.add_argument(
+        "--reverify-after-days", type=float, default=SCRUB_REVERIFY_AFTER_DAYS
+    )
+    parser.add_argument("--max-files", type=int)
+    parser.add_argument("--time-limit", type=float, help="seconds")
+    args = parser.parse_args(argv)
+
+    if os.environ.get("STORAGE_BACKEND", "local") != "local":
+        parser.error("the scrubber reads blobs from local storage only")
+    if not os.environ.get("SERVER_KEY"):
+        parser.error("SERVER_KEY must be set to verify stored blobs")
+
+    from app.services.database import migrate
+    from app.services.security import get_server_key
+
+    migrate()
+    scrubber = Scrubber(
+        get_server_key(),
+        workers=args.workers,
+        bytes_per_second=args.bytes_per_second,
+        reverify_after_days=args.reverify_after_days,
+    )
+    print(json.dumps(scrubber.run(args.max_files, args.time_limit), indent=2))
+
+
+if __name__ == "__main__":
+    main()
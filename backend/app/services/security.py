@@ -1,26 +1,27 @@
+import base64
 import os
 import uuid
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import jwt, JWTError
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from functools import wraps
+from functools import lru_cache, wraps
 from typing import List
 import random
 import string
-from email.message import EmailMessage
-import smtplib
 import asyncio
+import logging
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "fallback_very_secret_key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+logger = logging.getLogger(__name__)
+
+# Roles each role acts as: an admin can do anything a user or guest can.
 ROLES = {
-    "admin": ["admin"],
-    "user": ["user", "admin"],
-    "guest": ["guest", "user", "admin"],
+    "admin": ["admin", "user", "guest"],
+    "user": ["user", "guest"],
+    "guest": ["guest"],
 }
 
 
@@ -73,10 +74,40 @@ def check_roles(required_roles: List[str]):
     return decorator
 
 
+@lru_cache(maxsize=None)
+def get_server_key() -> bytes:
+    """
+    Resolve the blob encryption key on first use.
+
+    SERVER_KEY is a base64-encoded 32-byte AES key; without it a random
+    per-process key is used and blobs cannot be read back after a restart.
+
+    Returns:
+        bytes: 32-byte AES key
+    """
+    server_key = os.getenv("SERVER_KEY")
+    return base64.b64decode(server_key) if server_key else os.urandom(32)
+
+
+@lru_cache(maxsize=None)
+def get_password_context():
+    """
+    Build the passlib context on first use.
+
+    passlib and python-jose are imported lazily so that importing the app stays
+    cheap; the lifespan hook in main.py loads them before serving traffic.
+
+    Returns:
+        CryptContext: bcrypt password context
+    """
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
 class SecurityService:
     """Service class for handling security-related operations like password hashing and JWT tokens."""
 
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     security = HTTPBearer()
 
     @classmethod
@@ -90,7 +121,7 @@ class SecurityService:
         Returns:
             str: Hashed password
         """
-        return cls.pwd_context.hash(password)
+        return get_password_context().hash(password)
 
     @classmethod
     def verify_password(cls, plain_password: str, hashed_password: str) -> bool:
@@ -104,7 +135,7 @@ class SecurityService:
         Returns:
             bool: True if password matches, False otherwise
         """
-        return cls.pwd_context.verify(plain_password, hashed_password)
+        return get_password_context().verify(plain_password, hashed_password)
 
     @classmethod
     def create_access_token(cls, data: dict) -> str:
@@ -117,6 +148,8 @@ class SecurityService:
         Returns:
             str: Encoded JWT token
         """
+        from jose import jwt
+
         to_encode = data.copy()
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         to_encode.update({"exp": expire})
@@ -136,6 +169,8 @@ class SecurityService:
         Raises:
             HTTPException: If token is invalid
         """
+        from jose import JWTError, jwt
+
         try:
             return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         except JWTError:
@@ -190,8 +225,17 @@ class SecurityService:
             code (str): 6-digit MFA code
 
         Note:
-            Uses SMTP settings from environment variables
+            Uses SMTP settings from environment variables. Setting
+            MFA_DELIVERY=log writes the code to the application log instead,
+            for local development and benchmarking.
         """
+        if os.environ.get("MFA_DELIVERY") == "log":
+            logger.info("MFA code for %s: %s", email, code)
+            return
+
+        import smtplib
+        from email.message import EmailMessage
+
         smtp_server = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
         smtp_port = int(os.environ.get("SMTP_PORT", "587"))
         smtp_user = os.environ.get("SMTP_USER")
@@ -0,0 +1,405 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import AsyncIterable, AsyncIterator, Optional, Union
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+
+UPLOAD_DIRECTORY = os.environ.get("UPLOAD_DIRECTORY", "uploads")
+CHUNK_SIZE = 1024 * 1024
+
+BlobData = Union[bytes, AsyncIterable[bytes]]
+
+
+async def _iterate(data: BlobData) -> AsyncIterator[bytes]:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        for offset in range(0, len(data), CHUNK_SIZE):
+            yield bytes(data[offset : offset + CHUNK_SIZE])
+        return
+    async for chunk in data:
+        if chunk:
+            yield chunk
+
+
+class StorageBackend(ABC):
+    """
+    Interface for encrypted blob storage.
+
+    Blobs are addressed by the key stored in ``files.file_path``. All methods
+    are coroutines so that request handlers never block the event loop on
+    blob I/O.
+    """
+
+    @abstractmethod
+    def new_key(self, filename: str) -> str:
+        """Return a fresh, unique key for a blob uploaded as ``filename``."""
+
+    @abstractmethod
+    async def write(self, key: str, data: BlobData) -> int:
+        """
+        Store a blob, replacing any existing blob under the same key.
+
+        Args:
+            key (str): Blob key
+            data (bytes | AsyncIterable[bytes]): Blob content or a stream of chunks
+
+        Returns:
+            int: Number of bytes written
+        """
+
+    @abstractmethod
+    def read(self, key: str) -> AsyncIterator[bytes]:
+        """
+        Stream a blob in chunks.
+
+        Raises:
+            FileNotFoundError: If no blob exists under ``key``
+        """
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """Delete a blob; returns False if it did not exist."""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Return whether a blob exists under ``key``."""
+
+    async def read_all(self, key: str) -> bytes:
+        """Read a whole blob into memory."""
+        return b"".join([chunk async for chunk in self.read(key)])
+
+    async def close(self):
+        """Release pooled resources such as threads or connections."""
+
+
+class LocalStorage(StorageBackend):
+    """
+    Blob storage on the local filesystem.
+
+    Keys are file paths (``UPLOAD_DIRECTORY/<uuid>_<filename>``), matching the
+    ``file_path`` values written before storage backends existed. Blocking
+    file operations run on a dedicated thread pool. Writes go to a temporary
+    file that is renamed into place, so readers never see a partial blob.
+    """
+
+    def __init__(self, root: str, io_threads: int = 8):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._executor = ThreadPoolExecutor(
+            max_workers=io_threads, thread_name_prefix="storage-io"
+        )
+
+    def new_key(self, filename: str) -> str:
+        return os.path.join(self.root, f"{uuid.uuid4()}_{filename}")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    async def write(self, key: str, data: BlobData) -> int:
+        temp_path = f"{key}.{uuid.uuid4().hex}.part"
+        handle = await self._run(open, temp_path, "wb")
+        written = 0
+        try:
+            async for chunk in _iterate(data):
+                written += await self._run(handle.write, chunk)
+            await self._run(handle.close)
+            await self._run(os.replace, temp_path, key)
+        except BaseException:
+            handle.close()
+            await self._run(_remove_if_exists, temp_path)
+            raise
+        return written
+
+    async def read(self, key: str) -> AsyncIterator[bytes]:
+        handle = await self._run(open, key, "rb")
+        try:
+            while True:
+                chunk = await self._run(handle.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            handle.close()
+
+    async def delete(self, key: str) -> bool:
+        return await self._run(_remove_if_exists, key)
+
+    async def exists(self, key: str) -> bool:
+        return await self._run(os.path.exists, key)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def _remove_if_exists(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class S3Storage(StorageBackend):
+    """
+    Blob storage in an S3-compatible object store (AWS S3, MinIO, Ceph RGW).
+
+    Requests are signed with AWS Signature Version 4 and sent over a pooled
+    ``httpx.AsyncClient`` using path-style addressing. Blobs larger than
+    ``multipart_threshold`` are uploaded as multipart uploads with up to
+    ``max_concurrency`` parts in flight.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+        prefix: str = "",
+        multipart_threshold: int = 16 * 1024 * 1024,
+        part_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 4,
+        max_connections: int = 32,
+        transport=None,
+    ):
+        import httpx
+
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self._host = urlsplit(self.endpoint_url).netloc
+        self._client = httpx.AsyncClient(
+            base_url=self.endpoint_url,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            transport=transport,
+        )
+
+    def new_key(self, filename: str) -> str:
+        return f"{self.prefix}{uuid.uuid4()}_{filename}"
+
+    def _path(self, key: str) -> str:
+        return f"/{self.bucket}/{key}"
+
+    def _sign(self, method: str, path: str, params: dict) -> dict:
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = now.strftime("%Y%m%d")
+        payload_hash = "UNSIGNED-PAYLOAD"
+
+        canonical_query = "&".join(
+            f"{quote(str(name), safe='-_.~')}={quote(str(value), safe='-_.~')}"
+            for name, value in sorted(params.items())
+        )
+        headers = {
+            "host": self._host,
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": amz_date,
+        }
+        signed_headers = ";".join(sorted(headers))
+        canonical_request = "\n".join(
+            [
+                method,
+                quote(path, safe="/-_.~"),
+                canonical_query,
+                "".join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+                signed_headers,
+                payload_hash,
+            ]
+        )
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                scope,
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            ]
+        )
+
+        signing_key = f"AWS4{self.secret_key}".encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            signing_key = hmac.new(signing_key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(
+            signing_key, string_to_sign.encode(), hashlib.sha256
+        ).hexdigest()
+
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        del headers["host"]
+        return headers
+
+    async def _request(self, method: str, key: str, params=None, content=None):
+        params = params or {}
+        path = self._path(key)
+        response = await self._client.request(
+            method,
+            path,
+            params=params,
+            content=content,
+            headers=self._sign(method, path, params),
+        )
+        if response.status_code == 404:
+            raise FileNotFoundError(key)
+        response.raise_for_status()
+        return response
+
+    async def write(self, key: str, data: BlobData) -> int:
+        buffer = bytearray()
+        chunks = _iterate(data)
+        async for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= self.multipart_threshold:
+                return await self._write_multipart(key, buffer, chunks)
+        await self._request("PUT", key, content=bytes(buffer))
+        return len(buffer)
+
+    async def _write_multipart(
+        self, key: str, buffer: bytearray, chunks: AsyncIterator[bytes]
+    ) -> int:
+        response = await self._request("POST", key, params={"uploads": ""})
+        upload_id = _xml_text(response.content, "UploadId")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        etags = {}
+        tasks = []
+        written = 0
+
+        async def upload_part(number: int, body: bytes):
+            try:
+                part = await self._request(
+                    "PUT",
+                    key,
+                    params={"partNumber": number, "uploadId": upload_id},
+                    content=body,
+                )
+                etags[number] = part.headers["etag"]
+            finally:
+                semaphore.release()
+
+        async def submit(body: bytes):
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, body)))
+
+        try:
+            exhausted = False
+            while not exhausted or buffer:
+                while not exhausted and len(buffer) < self.part_size:
+                    chunk = await anext(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                    else:
+                        buffer += chunk
+                body = bytes(buffer[: self.part_size])
+                del buffer[: self.part_size]
+                written += len(body)
+                await submit(body)
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await self._request("DELETE", key, params={"uploadId": upload_id})
+            raise
+
+        manifest = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+            for number, etag in sorted(etags.items())
+        )
+        await self._request(
+            "POST",
+            key,
+            params={"uploadId": upload_id},
+            content=(
+                f"<CompleteMultipartUpload>{manifest}</CompleteMultipartUpload>"
+            ).encode(),
+        )
+        return written
+
+    async def read(self, key: str) -> AsyncIterator[bytes]:
+        path = self._path(key)
+        async with self._client.stream(
+            "GET", path, headers=self._sign("GET", path, {})
+        ) as response:
+            if response.status_code == 404:
+                raise FileNotFoundError(key)
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                yield chunk
+
+    async def delete(self, key: str) -> bool:
+        if not await self.exists(key):
+            return False
+        await self._request("DELETE", key)
+        return True
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await self._request("HEAD", key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def _xml_text(document: bytes, tag: str) -> Optional[str]:
+    for element in ElementTree.fromstring(document).iter():
+        if element.tag.rsplit("}", 1)[-1] == tag:
+            return element.text
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_storage() -> StorageBackend:
+    """
+    Build the storage backend selected by the STORAGE_BACKEND environment variable.
+
+    With ``STORAGE_PACKING=1``, local storage appends small blobs to pack
+    files (see ``app.services.packs``).
+
+    Returns:
+        StorageBackend: LocalStorage (default), PackedStorage or S3Storage
+    """
+    backend = os.environ.get("STORAGE_BACKEND", "local")
+    if backend == "s3":
+        return S3Storage(
+            endpoint_url=os.environ["S3_ENDPOINT_URL"],
+            bucket=os.environ["S3_BUCKET"],
+            access_key=os.environ["S3_ACCESS_KEY_ID"],
+            secret_key=os.environ["S3_SECRET_ACCESS_KEY"],
+            region=os.environ.get("S3_REGION", "us-east-1"),
+            prefix=os.environ.get("S3_PREFIX", ""),
+            max_concurrency=int(os.environ.get("S3_MAX_CONCURRENCY", "4")),
+            max_connections=int(os.environ.get("S3_MAX_CONNECTIONS", "32")),
+        )
+    if backend != "local":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    storage = LocalStorage(
+        UPLOAD_DIRECTORY,
+        io_threads=int(os.environ.get("STORAGE_IO_THREADS", "8")),
+    )
+    if os.environ.get("STORAGE_PACKING", "0") == "1":
+        from app.services.packs import PackedStorage
+
+        return PackedStorage(storage)
+    return storage
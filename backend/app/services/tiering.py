@@ -0,0 +1,350 @@
+"""
+Hot/cold tiering of file blobs.
+
+Downloads are counted in memory by ``ACCESS_TRACKER`` and written to
+``files.access_count`` and ``files.last_accessed_at`` in one batch per shard
+every ``TIER_ACCESS_FLUSH_SECONDS``. The demotion job moves blobs that have not
+been downloaded for ``TIER_COLD_AFTER_DAYS`` into ``TIER_COLD_DIRECTORY``,
+which is meant to live on a cheaper volume, with copies capped at
+``TIER_BYTES_PER_SECOND``::
+
+    python -m app.services.tiering demote
+    python -m app.services.tiering stats
+
+A blob is copied first and ``file_path`` is then swapped with a
+compare-and-set update, so a concurrent delete or re-upload wins and the copy
+is discarded. A download of a cold blob moves it back to the hot tier after
+the response has been sent. Versioned files are left alone, since their
+chunks are shared between versions.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import AsyncIterator, Dict, Optional
+
+from app.services.database import (
+    all_shards,
+    execute_many,
+    execute_query_async,
+    fetch_all,
+    fetch_all_shards,
+    fetch_one,
+    group_by_shard,
+    shard_for_row,
+)
+from app.services.metrics import REGISTRY
+from app.services.packs import PackedStorage
+from app.services.ratelimit import TokenBucketLimiter, throttle_stream
+from app.services.storage import (
+    CHUNK_SIZE,
+    UPLOAD_DIRECTORY,
+    LocalStorage,
+    StorageBackend,
+)
+
+TIER_COLD_DIRECTORY = os.environ.get(
+    "TIER_COLD_DIRECTORY", os.path.join(UPLOAD_DIRECTORY, ".cold")
+)
+TIER_COLD_AFTER_DAYS = float(os.environ.get("TIER_COLD_AFTER_DAYS", "7"))
+TIER_BYTES_PER_SECOND = int(
+    os.environ.get("TIER_BYTES_PER_SECOND", str(20 * 1024 * 1024))
+)
+TIER_ACCESS_FLUSH_SECONDS = float(os.environ.get("TIER_ACCESS_FLUSH_SECONDS", "5"))
+TIER_BATCH_SIZE = 500
+
+TIER_MIGRATED_BYTES = REGISTRY.counter(
+    "tier_migrated_bytes_total",
+    "Blob bytes moved between storage tiers, by direction.",
+    ("direction",),
+)
+
+
+def _timestamp(value: float) -> str:
+    # Same format as CURRENT_TIMESTAMP, so it compares with created_at.
+    return datetime.utcfromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class AccessTracker:
+    """
+    Buffered download counters.
+
+    ``record`` only updates an in-memory map of file id to (count, last
+    access). A background thread applies the map every ``flush_interval``
+    seconds with one ``executemany`` per shard, so a burst of downloads of
+    the same file costs one row update.
+    """
+
+    def __init__(self, flush_interval: float = TIER_ACCESS_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, list] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, file_id: int):
+        now = time.time()
+        with self._lock:
+            entry = self._pending.get(file_id)
+            if entry is None:
+                self._pending[file_id] = [1, now]
+            else:
+                entry[0] += 1
+                entry[1] = now
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name="access-tracker", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write the buffered counters.
+
+        Returns:
+            int: Number of files updated
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for shard, file_ids in group_by_shard(pending).items():
+                execute_many(
+                    """
+                    UPDATE files SET access_count = access_count + ?,
+                        last_accessed_at = MAX(COALESCE(last_accessed_at, ''), ?)
+                    WHERE id = ?
+                    """,
+                    [
+                        (pending[file_id][0], _timestamp(pending[file_id][1]), file_id)
+                        for file_id in file_ids
+                    ],
+                    shard=shard,
+                )
+            return len(pending)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+        self.flush()
+
+
+ACCESS_TRACKER = AccessTracker()
+
+
+def _bounds(directory: str) -> tuple:
+    prefix = os.path.join(directory, "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def is_cold(key: str, cold_directory: str = TIER_COLD_DIRECTORY) -> bool:
+    return key.startswith(os.path.join(cold_directory, ""))
+
+
+async def _swap_path(
+    file_id: int,
+    old_key: str,
+    new_key: str,
+    old_storage: StorageBackend,
+    new_storage: StorageBackend,
+) -> bool:
+    cursor = await execute_query_async(
+        "UPDATE files SET file_path = ? WHERE id = ? AND file_path = ?",
+        (new_key, file_id, old_key),
+        shard=shard_for_row(file_id),
+    )
+    if cursor.rowcount:
+        await old_storage.delete(old_key)
+        return True
+    # The file was deleted or replaced while it was being copied.
+    await new_storage.delete(new_key)
+    return False
+
+
+async def demote(
+    storage: StorageBackend,
+    hot_directory: str = UPLOAD_DIRECTORY,
+    cold_directory: str = TIER_COLD_DIRECTORY,
+    cold_after_days: float = TIER_COLD_AFTER_DAYS,
+    bytes_per_second: int = TIER_BYTES_PER_SECOND,
+    limit: Optional[int] = None,
+) -> dict:
+    """
+    Move blobs not downloaded for ``cold_after_days`` to the cold tier.
+
+    Args:
+        storage (StorageBackend): Hot-tier storage the blobs are read from
+        hot_directory (str): Only blobs under this directory are considered
+        cold_directory (str): Directory of the cold tier
+        cold_after_days (float): Idle time after which a blob is cold
+        bytes_per_second (int): Copy rate cap; 0 for no cap
+        limit (int, optional): Maximum number of blobs to move
+
+    Returns:
+        dict: Counts of moved, skipped and failed blobs, and bytes moved
+    """
+    cold = LocalStorage(cold_directory, io_threads=1)
+    limiter = (
+        TokenBucketLimiter(
+            "tier",
+            rate=bytes_per_second,
+            burst=max(bytes_per_second, CHUNK_SIZE),
+            max_keys=1,
+        )
+        if bytes_per_second
+        else None
+    )
+    report = {"moved": 0, "moved_bytes": 0, "skipped": 0, "failed": 0}
+    try:
+        hot_start, hot_end = _bounds(hot_directory)
+        for shard in all_shards():
+            # Walk idx_files_file_path in key order; moved rows leave the range.
+            last_key = hot_start
+            while limit is None or report["moved"] < limit:
+                rows = fetch_all(
+                    """
+                    SELECT id, file_path FROM files
+                    WHERE file_path > ? AND file_path < ?
+                      AND NOT (file_path >= ? AND file_path < ?)
+                      AND current_version IS NULL
+                      AND COALESCE(last_accessed_at, created_at) < datetime('now', ?)
+                    ORDER BY file_path LIMIT ?
+                    """,
+                    (
+                        last_key,
+                        hot_end,
+                        *_bounds(cold_directory),
+                        f"-{cold_after_days} days",
+                        TIER_BATCH_SIZE,
+                    ),
+                    shard=shard,
+                )
+                if not rows:
+                    break
+                for file_id, key in rows:
+                    last_key = key
+                    if limit is not None and report["moved"] >= limit:
+                        break
+                    cold_key = os.path.join(cold_directory, os.path.basename(key))
+                    try:
+                        size = await cold.write(
+                            cold_key, throttle_stream(storage.read(key), limiter)
+                        )
+                    except FileNotFoundError:
+                        report["failed"] += 1
+                        continue
+                    if await _swap_path(file_id, key, cold_key, storage, cold):
+                        report["moved"] += 1
+                        report["moved_bytes"] += size
+                        TIER_MIGRATED_BYTES.inc(size, direction="demote")
+                    else:
+                        report["skipped"] += 1
+    finally:
+        await cold.close()
+    return report
+
+
+async def promote(storage: StorageBackend, file_id: int, cold_key: str, content: bytes):
+    """
+    Move a cold blob back to the hot tier.
+
+    Called after a download of the blob, with its content already in memory,
+    so promotion costs one write.
+    """
+    hot_key = storage.new_key(os.path.basename(cold_key).split("_", 1)[-1])
+    await storage.write(hot_key, content)
+    if await _swap_path(file_id, cold_key, hot_key, storage, storage):
+        TIER_MIGRATED_BYTES.inc(len(content), direction="promote")
+
+
+async def read_blob(storage: StorageBackend, file_id: int, key: str) -> tuple:
+    """
+    Read a file's blob, following it if a migration moved it meanwhile.
+
+    Returns:
+        tuple: (content, key it was read from)
+
+    Raises:
+        FileNotFoundError: If the blob is missing
+    """
+    try:
+        return await storage.read_all(key), key
+    except FileNotFoundError:
+        row = fetch_one(
+            "SELECT file_path FROM files WHERE id = ?",
+            (file_id,),
+            shard=shard_for_row(file_id),
+        )
+        if not row or row[0] == key:
+            raise
+        return await storage.read_all(row[0]), row[0]
+
+
+def tier_stats(cold_directory: str = TIER_COLD_DIRECTORY) -> dict:
+    rows = fetch_all_shards(
+        """
+        SELECT file_path >= ? AND file_path < ?, COUNT(*),
+               COALESCE(SUM(size_bytes), 0)
+        FROM files WHERE current_version IS NULL
+        GROUP BY 1
+        """,
+        _bounds(cold_directory),
+    )
+    stats = {tier: {"files": 0, "bytes": 0} for tier in ("hot", "cold")}
+    for cold, count, size in rows:
+        tier = stats["cold" if cold else "hot"]
+        tier["files"] += count
+        tier["bytes"] += size
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move idle blobs to the cold tier.")
+    parser.add_argument("command", choices=("demote", "stats"))
+    parser.add_argument("--cold-after-days", type=float, default=TIER_COLD_AFTER_DAYS)
+    parser.add_argument("--bytes-per-second", type=int, default=TIER_BYTES_PER_SECOND)
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args(argv)
+
+    from app.services.database import migrate
+    from app.services.storage import get_storage
+
+    migrate()
+    if args.command == "stats":
+        print(json.dumps(tier_stats(), indent=2))
+        return
+
+    storage = get_storage()
+    if not isinstance(storage, (LocalStorage, PackedStorage)):
+        parser.error("tiering needs local storage")
+
+    async def run():
+        try:
+            return await demote(
+                storage,
+                cold_after_days=args.cold_after_days,
+                bytes_per_second=args.bytes_per_second,
+                limit=args.limit,
+            )
+        finally:
+            await storage.close()
+
+    started = time.monotonic()
+    report = asyncio.run(run())
+    report["seconds"] = round(time.monotonic() - started, 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from collections import Counter
+from functools import lru_cache
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from starlette.concurrency import run_in_threadpool
+
+from app.services.database import (
+    fetch_all,
+    fetch_one,
+    get_db_connection,
+    group_by_shard,
+    shard_for_row,
+)
+from app.services.metrics import REGISTRY
+from app.services.security import get_server_key
+from app.services.storage import StorageBackend, get_storage
+
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_AVG_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+CHUNK_NONCE_BYTES = 12
+CHUNK_WRITE_CONCURRENCY = 8
+# Uploaded content is chunked, deduplicated and written in batches of about
+# this many bytes, so a version is never held in memory as a whole.
+CHUNK_BATCH_BYTES = 4 * CHUNK_MAX_SIZE
+SQL_VARIABLE_BATCH = 500
+
+CHUNKS_WRITTEN = REGISTRY.counter(
+    "version_chunks_written_total", "Chunks encrypted and stored for file versions."
+)
+CHUNKS_DEDUPLICATED = REGISTRY.counter(
+    "version_chunks_deduplicated_total",
+    "Chunks of new versions that were already in the chunk store.",
+)
+
+_MASK64 = (1 << 64) - 1
+# Gear table for the rolling hash: one pseudo-random 64-bit value per byte.
+_GEAR = tuple(
+    int.from_bytes(hashlib.sha256(bytes([value])).digest()[:8], "big")
+    for value in range(256)
+)
+
+
+def _high_bits_mask(bits: int) -> int:
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def chunk_boundaries(
+    data: bytes,
+    min_size: int = CHUNK_MIN_SIZE,
+    avg_size: int = CHUNK_AVG_SIZE,
+    max_size: int = CHUNK_MAX_SIZE,
+) -> List[int]:
+    """
+    Split data into content-defined chunks (FastCDC-style gear hashing).
+
+    A boundary is placed where the rolling hash of the preceding bytes matches a
+    mask, so inserting or deleting bytes only moves the boundaries near the
+    edit. A stricter mask before ``avg_size`` and a looser one after it keep
+    chunk sizes close to the average.
+
+    Args:
+        data (bytes): Content to split
+        min_size (int): Smallest chunk, except for the last one
+        avg_size (int): Target chunk size, a power of two
+        max_size (int): Largest chunk
+
+    Returns:
+        List[int]: End offset of each chunk
+    """
+    bits = avg_size.bit_length() - 1
+    strict_mask = _high_bits_mask(bits + 1)
+    loose_mask = _high_bits_mask(bits - 1)
+    gear = _GEAR
+    length = len(data)
+    boundaries = []
+    start = 0
+    while start < length:
+        end = min(start + max_size, length)
+        cut = end
+        if end - start > min_size:
+            position = start + min_size
+            normal_end = min(start + avg_size, end)
+            rolling = 0
+            for mask, stop in ((strict_mask, normal_end), (loose_mask, end)):
+                found = False
+                while position < stop:
+                    rolling = ((rolling << 1) + gear[data[position]]) & _MASK64
+                    position += 1
+                    if not rolling & mask:
+                        found = True
+                        break
+                if found:
+                    cut = position
+                    break
+        boundaries.append(cut)
+        start = cut
+    return boundaries
+
+
+class ChunkStore:
+    """
+    Versioned file content stored as manifests of deduplicated chunks.
+
+    Each version of a file is an ordered list of content-defined chunks. A
+    chunk is identified by a keyed hash of its content, encrypted under the
+    server key with its own random nonce, and stored once however many
+    versions and files reference it. Uploading an edited version therefore
+    only encrypts and writes the chunks that changed.
+
+    A file's content from before it was first versioned stays in its original
+    blob and becomes version 1.
+    """
+
+    def __init__(self, server_key: bytes, storage: StorageBackend):
+        self.storage = storage
+        self._cipher = AESGCM(server_key)
+        self._id_key = hmac.new(server_key, b"chunk-id", hashlib.sha256).digest()
+
+    def chunk_id(self, data: bytes) -> str:
+        return hmac.new(self._id_key, data, hashlib.sha256).hexdigest()
+
+    def _split(self, data: bytes, final: bool = True):
+        # A boundary only depends on the CHUNK_MAX_SIZE bytes after the start
+        # of its chunk, so unless this is the end of the content, chunks
+        # starting closer than that to the end of ``data`` are left for the
+        # next call. Returns the chunks and the number of bytes they cover.
+        chunks, start = [], 0
+        for end in chunk_boundaries(data):
+            if not final and start + CHUNK_MAX_SIZE > len(data):
+                break
+            chunk = data[start:end]
+            chunks.append((self.chunk_id(chunk), chunk))
+            start = end
+        return chunks, start
+
+    async def _split_stream(
+        self, content: AsyncIterable[bytes]
+    ) -> AsyncIterator[List[tuple]]:
+        """
+        Chunk content as it arrives, yielding ``(chunk_id, chunk)`` batches.
+
+        The chunks are exactly those ``chunk_boundaries`` gives for the whole
+        content.
+        """
+        buffered = bytearray()
+        async for piece in content:
+            buffered += piece
+            if len(buffered) >= CHUNK_BATCH_BYTES:
+                chunks, consumed = await run_in_threadpool(
+                    self._split, bytes(buffered), False
+                )
+                del buffered[:consumed]
+                yield chunks
+        if buffered:
+            chunks, _ = await run_in_threadpool(self._split, bytes(buffered))
+            yield chunks
+
+    def _encrypt_chunk(self, data: bytes) -> bytes:
+        nonce = os.urandom(CHUNK_NONCE_BYTES)
+        return nonce + self._cipher.encrypt(nonce, data, None)
+
+    def _decrypt_chunk(self, blob: bytes) -> bytes:
+        nonce = blob[:CHUNK_NONCE_BYTES]
+        return self._cipher.decrypt(nonce, blob[CHUNK_NONCE_BYTES:], None)
+
+    async def add_version(
+        self, file_id: int, content: AsyncIterable[bytes], iv: bytes, salt: bytes
+    ):
+        """
+        Store ``content`` as the new current version of a file.
+
+        The content is chunked and its new chunks written as it is read.
+
+        Args:
+            file_id (int): File being versioned
+            content (AsyncIterable[bytes]): Uploaded content
+            iv (bytes): Client IV for this version
+            salt (bytes): Client salt for this version
+
+        Returns:
+            dict: New version number, chunk counts and bytes newly stored
+        """
+        chunks, seen, written, size_bytes = [], set(), {}, 0
+        semaphore = asyncio.Semaphore(CHUNK_WRITE_CONCURRENCY)
+
+        async def write_chunk(chunk_id: str, chunk: bytes):
+            async with semaphore:
+                blob = await run_in_threadpool(self._encrypt_chunk, chunk)
+                key = self.storage.new_key(f"chunk_{chunk_id}")
+                await self.storage.write(key, blob)
+                written[chunk_id] = (key, len(blob))
+
+        try:
+            async for batch in self._split_stream(content):
+                chunks.extend((chunk_id, len(chunk)) for chunk_id, chunk in batch)
+                size_bytes += sum(len(chunk) for _, chunk in batch)
+                unique = {
+                    chunk_id: chunk for chunk_id, chunk in batch if chunk_id not in seen
+                }
+                seen.update(unique)
+                known = set()
+                ids = list(unique)
+                for offset in range(0, len(ids), SQL_VARIABLE_BATCH):
+                    ids_batch = ids[offset : offset + SQL_VARIABLE_BATCH]
+                    known.update(
+                        row[0]
+                        for row in await run_in_threadpool(
+                            fetch_all,
+                            f"SELECT chunk_id FROM chunks WHERE chunk_id IN ({','.join('?' * len(ids_batch))})",
+                            tuple(ids_batch),
+                            shard=shard_for_row(file_id),
+                        )
+                    )
+                await asyncio.gather(
+                    *(
+                        write_chunk(chunk_id, chunk)
+                        for chunk_id, chunk in unique.items()
+                        if chunk_id not in known
+                    )
+                )
+            version, redundant = await run_in_threadpool(
+                self._commit_version, file_id, chunks, written, size_bytes, iv, salt
+            )
+        except BaseException:
+            for key, _ in written.values():
+                await self.storage.delete(key)
+            raise
+        for key in redundant:
+            await self.storage.delete(key)
+
+        CHUNKS_WRITTEN.inc(len(written) - len(redundant))
+        CHUNKS_DEDUPLICATED.inc(len(chunks) - len(written))
+        return {
+            "version": version,
+            "chunks": len(chunks),
+            "new_chunks": len(written) - len(redundant),
+            "new_bytes": sum(
+                size for key, size in written.values() if key not in redundant
+            ),
+        }
+
+    def _commit_version(self, file_id, chunks, written, size_bytes, iv, salt):
+        references = Counter(chunk_id for chunk_id, _ in chunks)
+        with get_db_connection(shard_for_row(file_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            version = self._next_version(cursor, file_id)
+            cursor.execute(
+                """
+                INSERT INTO file_versions (file_id, version, iv, salt, size_bytes)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (file_id, version, iv, salt, size_bytes),
+            )
+            version_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO version_chunks (version_id, seq, chunk_id) VALUES (?, ?, ?)",
+                [
+                    (version_id, seq, chunk_id)
+                    for seq, (chunk_id, _) in enumerate(chunks)
+                ],
+            )
+
+            # Another upload may have stored the same new chunk concurrently; the
+            # first row wins and our copy of the blob is deleted afterwards.
+            redundant, new_bytes = [], 0
+            for chunk_id, count in references.items():
+                key, size = written.get(chunk_id, (None, 0))
+                cursor.execute(
+                    "UPDATE chunks SET ref_count = ref_count + ? WHERE chunk_id = ?",
+                    (count, chunk_id),
+                )
+                if cursor.rowcount:
+                    if key is not None:
+                        redundant.append(key)
+                    continue
+                cursor.execute(
+                    """
+                    INSERT INTO chunks (chunk_id, storage_key, size_bytes, ref_count)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (chunk_id, key, size, count),
+                )
+                new_bytes += size
+
+            cursor.execute(
+                """
+                UPDATE files SET current_version = ?, size_bytes = size_bytes + ?
+                WHERE id = ?
+                """,
+                (version, new_bytes, file_id),
+            )
+            conn.commit()
+        return version, redundant
+
+    @staticmethod
+    def _next_version(cursor, file_id: int) -> int:
+        current = cursor.execute(
+            "SELECT current_version FROM files WHERE id = ?", (file_id,)
+        ).fetchone()
+        if current is None:
+            raise LookupError(f"File {file_id} does not exist")
+        if current[0] is None:
+            cursor.execute(
+                """
+                INSERT INTO file_versions
+                    (file_id, version, file_path, iv, salt, size_bytes, created_at)
+                SELECT id, 1, file_path, iv, salt, MAX(size_bytes - 16, 0), created_at
+                FROM files WHERE id = ?
+                """,
+                (file_id,),
+            )
+        return (
+            cursor.execute(
+                "SELECT MAX(version) FROM file_versions WHERE file_id = ?", (file_id,)
+            ).fetchone()[0]
+            + 1
+        )
+
+    def versions(self, file_id: int) -> List[dict]:
+        """List a file's versions, oldest first."""
+        rows = fetch_all(
+            """
+            SELECT v.version, v.size_bytes, v.created_at, COUNT(c.seq)
+            FROM file_versions v
+            LEFT JOIN version_chunks c ON c.version_id = v.id
+            WHERE v.file_id = ?
+            GROUP BY v.id
+            ORDER BY v.version
+            """,
+            (file_id,),
+            shard=shard_for_row(file_id),
+        )
+        return [
+            {
+                "version": row[0],
+                "size_bytes": row[1],
+                "created_at": row[2],
+                "chunks": row[3],
+            }
+            for row in rows
+        ]
+
+    def get_version(self, file_id: int, version: int) -> Optional[tuple]:
+        """Return ``(id, file_path, iv, salt, size_bytes)`` for one version."""
+        return fetch_one(
+            """
+            SELECT id, file_path, iv, salt, size_bytes FROM file_versions
+            WHERE file_id = ? AND version = ?
+            """,
+            (file_id, version),
+            shard=shard_for_row(file_id),
+        )
+
+    async def read_version(self, file_id: int, version: tuple) -> AsyncIterator[bytes]:
+        """
+        Stream the content of a version returned by ``get_version``.
+
+        Chunks are read and decrypted one at a time in manifest order.
+        """
+        version_id, file_path, iv = version[0], version[1], version[2]
+        if file_path is not None:
+            blob = await self.storage.read_all(file_path)
+            yield await run_in_threadpool(self._cipher.decrypt, iv, blob, None)
+            return
+
+        keys = [
+            row[0]
+            for row in await run_in_threadpool(
+                fetch_all,
+                """
+                SELECT c.storage_key FROM version_chunks v
+                JOIN chunks c ON c.chunk_id = v.chunk_id
+                WHERE v.version_id = ?
+                ORDER BY v.seq
+                """,
+                (version_id,),
+                shard=shard_for_row(file_id),
+            )
+        ]
+        for key in keys:
+            blob = await self.storage.read_all(key)
+            yield await run_in_threadpool(self._decrypt_chunk, blob)
+
+    def restore(self, file_id: int, version: int) -> int:
+        """
+        Make a copy of an earlier version the new current version.
+
+        Only the manifest is copied; no chunk is read or written.
+
+        Returns:
+            int: Number of the new version
+        """
+        with get_db_connection(shard_for_row(file_id)) as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            source = cursor.execute(
+                "SELECT id FROM file_versions WHERE file_id = ? AND version = ?",
+                (file_id, version),
+            ).fetchone()
+            if source is None:
+                raise LookupError(f"Version {version} of file {file_id} not found")
+            new_version = self._next_version(cursor, file_id)
+            cursor.execute(
+                """
+                INSERT INTO file_versions (file_id, version, file_path, iv, salt, size_bytes)
+                SELECT file_id, ?, file_path, iv, salt, size_bytes
+                FROM file_versions WHERE id = ?
+                """,
+                (new_version, source[0]),
+            )
+            new_id = cursor.lastrowid
+            cursor.execute(
+                """
+                INSERT INTO version_chunks (version_id, seq, chunk_id)
+                SELECT ?, seq, chunk_id FROM version_chunks WHERE version_id = ?
+                """,
+                (new_id, source[0]),
+            )
+            cursor.execute(
+                """
+                UPDATE chunks SET ref_count = ref_count + (
+                    SELECT COUNT(*) FROM version_chunks
+                    WHERE version_id = ? AND chunk_id = chunks.chunk_id
+                )
+                WHERE chunk_id IN (SELECT chunk_id FROM version_chunks WHERE version_id = ?)
+                """,
+                (source[0], source[0]),
+            )
+            cursor.execute(
+                "UPDATE files SET current_version = ? WHERE id = ?",
+                (new_version, file_id),
+            )
+            conn.commit()
+        return new_version
+
+    async def release_files(self, file_ids: Iterable[int]):
+        """
+        Drop the versions of files about to be deleted and free unused chunks.
+
+        Call before deleting the ``files`` rows. Version 1 shares the file's
+        original blob, which the caller deletes as before.
+        """
+        freed = []
+        for shard, shard_ids in group_by_shard(file_ids).items():
+            freed.extend(await run_in_threadpool(self._release_shard, shard, shard_ids))
+        for key in freed:
+            await self.storage.delete(key)
+
+    @staticmethod
+    def _release_shard(shard: int, file_ids: List[int]) -> List[str]:
+        freed = []
+        for offset in range(0, len(file_ids), SQL_VARIABLE_BATCH):
+            batch = tuple(file_ids[offset : offset + SQL_VARIABLE_BATCH])
+            placeholders = ",".join("?" * len(batch))
+            with get_db_connection(shard) as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                versions = (
+                    f"SELECT id FROM file_versions WHERE file_id IN ({placeholders})"
+                )
+                references = cursor.execute(
+                    f"""
+                    SELECT chunk_id, COUNT(*) FROM version_chunks
+                    WHERE version_id IN ({versions})
+                    GROUP BY chunk_id
+                    """,
+                    batch,
+                ).fetchall()
+                for chunk_id, count in references:
+                    cursor.execute(
+                        """
+                        UPDATE chunks SET ref_count = ref_count - ? WHERE chunk_id = ?
+                        RETURNING ref_count, storage_key
+                        """,
+                        (count, chunk_id),
+                    )
+                    ref_count, storage_key = cursor.fetchone()
+                    if ref_count <= 0:
+                        freed.append(storage_key)
+                        cursor.execute(
+                            "DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,)
+                        )
+                cursor.execute(
+                    f"DELETE FROM version_chunks WHERE version_id IN ({versions})",
+                    batch,
+                )
+                cursor.execute(
+                    f"DELETE FROM file_versions WHERE file_id IN ({placeholders})",
+                    batch,
+                )
+                conn.commit()
+        return freed
+
+
+@lru_cache(maxsize=None)
+def get_chunk_store() -> ChunkStore:
+    return ChunkStore(get_server_key(), get_storage())
@@ -0,0 +1,152 @@
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class MultipartError(ValueError):
+    """Raised for a malformed or truncated multipart/form-data body."""
+
+
+class Part:
+    """
+    One part of a multipart body, read as it arrives.
+
+    A part must be consumed before the next one is requested; whatever is
+    left unread is skipped when the stream moves on.
+    """
+
+    def __init__(self, stream: "MultipartStream", name: str, filename: Optional[str]):
+        self._stream = stream
+        self.name = name
+        self.filename = filename
+        self._done = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while not self._done:
+            event = await self._stream._next_event()
+            if event is None:
+                raise MultipartError("Multipart body ended inside a part")
+            if event[0] == "data":
+                yield event[1]
+            elif event[0] == "end":
+                self._done = True
+
+    async def read(self, limit: int) -> bytes:
+        """
+        Read a small field whole.
+
+        Raises:
+            MultipartError: If the field is longer than ``limit`` bytes
+        """
+        data = bytearray()
+        async for chunk in self:
+            data += chunk
+            if len(data) > limit:
+                raise MultipartError(f"Field '{self.name}' is too large")
+        return bytes(data)
+
+
+class MultipartStream:
+    """
+    Incremental multipart/form-data parser over an ASGI request body.
+
+    Unlike Starlette's form parser, nothing is spooled: each body chunk is fed
+    to python-multipart and the resulting part data is handed straight to the
+    caller, so memory use is bounded by the size of one body chunk.
+
+    Args:
+        content_type (str): Request Content-Type header, with its boundary
+        body (AsyncIterator[bytes]): Request body, e.g. ``request.stream()``
+    """
+
+    def __init__(self, content_type: str, body: AsyncIterator[bytes]):
+        media_type, options = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or b"boundary" not in options:
+            raise MultipartError("Expected a multipart/form-data body")
+        self._body = body.__aiter__()
+        self._events: deque = deque()
+        self._finished = False
+        self._headers = {}
+        self._field = b""
+        self._value = b""
+        self._parser = MultipartParser(
+            options[b"boundary"],
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+                "on_end": self._on_end,
+            },
+        )
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(
+            self._headers.get(b"content-disposition", b"")
+        )
+        if b"name" not in options:
+            raise MultipartError("Part without a field name")
+        filename = options.get(b"filename")
+        self._events.append(
+            (
+                "part",
+                options[b"name"].decode("latin-1"),
+                None if filename is None else filename.decode("utf-8", "replace"),
+            )
+        )
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        self._events.append(("data", data[start:end]))
+
+    def _on_part_end(self):
+        self._events.append(("end",))
+
+    def _on_end(self):
+        self._finished = True
+        self._events.append(("done",))
+
+    async def _next_event(self) -> Optional[tuple]:
+        while not self._events:
+            if self._finished:
+                return None
+            chunk = await anext(self._body, None)
+            if chunk is None:
+                raise MultipartError("Multipart body is truncated")
+            if chunk:
+                try:
+                    self._parser.write(chunk)
+                except MultipartError:
+                    raise
+                except Exception as exc:
+                    raise MultipartError(str(exc)) from exc
+        return self._events.popleft()
+
+    async def parts(self) -> AsyncIterator[Part]:
+        """Yield each part in body order; iterate a part to read its content."""
+        while True:
+            event = await self._next_event()
+            if event is None or event[0] == "done":
+                return
+            if event[0] != "part":
+                continue
+            part = Part(self, event[1], event[2])
+            yield part
+            async for _ in part:
+                pass
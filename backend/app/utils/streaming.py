@@ -0,0 +1,56 @@
+from typing import Iterable, Iterator, Mapping, Sequence
+
+try:
+    import orjson
+
+    def encode_json(value) -> bytes:
+        return orjson.dumps(value)
+
+except ImportError:  # pragma: no cover - orjson is listed in requirements.txt
+    import json
+
+    def encode_json(value) -> bytes:
+        return json.dumps(value, separators=(",", ":"), default=str).encode()
+
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def rows_as_dicts(rows: Iterable[tuple], keys: Sequence[str]) -> Iterator[dict]:
+    """Map database rows onto dicts with the given keys."""
+    for row in rows:
+        yield dict(zip(keys, row))
+
+
+def json_object_stream(
+    fields: Mapping[str, Iterable], chunk_bytes: int = STREAM_CHUNK_BYTES
+) -> Iterator[bytes]:
+    """
+    Encode ``{"field": [item, ...], ...}`` incrementally.
+
+    Each field's items are consumed lazily, so a cursor can be streamed
+    straight to the client without materializing the list. Output is yielded
+    in chunks of roughly ``chunk_bytes``.
+
+    Args:
+        fields (Mapping[str, Iterable]): Top-level keys and the items of their arrays
+        chunk_bytes (int): Target size of each yielded chunk
+
+    Yields:
+        bytes: Consecutive pieces of the JSON document
+    """
+    buffer = bytearray(b"{")
+    for field_index, (name, items) in enumerate(fields.items()):
+        if field_index:
+            buffer += b","
+        buffer += encode_json(name) + b":["
+        for item_index, item in enumerate(items):
+            if item_index:
+                buffer += b","
+            buffer += encode_json(item)
+            if len(buffer) >= chunk_bytes:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b"]"
+    buffer += b"}"
+    yield bytes(buffer)
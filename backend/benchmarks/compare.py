@@ -0,0 +1,68 @@
+"""
+Compare two benchmark result files produced by ``benchmarks.run``.
+
+    python -m benchmarks.compare base.json head.json --threshold 0.10
+
+Exits with status 1 when any scenario regresses by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+
+# Metrics where a larger value is worse; everything else is a throughput figure.
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+THROUGHPUT_METRICS = ("ops_per_s", "mb_per_s")
+
+
+def compare(base: dict, head: dict, threshold: float):
+    """
+    Compute relative changes between two benchmark reports.
+
+    Args:
+        base (dict): Baseline report
+        head (dict): Report under test
+        threshold (float): Relative change treated as a regression, e.g. 0.1
+
+    Returns:
+        List[Tuple[str, str, float, float, float, bool]]: One row per scenario
+        and metric with the base value, head value, relative change and whether
+        it counts as a regression
+    """
+    rows = []
+    for scenario, base_result in sorted(base["results"].items()):
+        head_result = head["results"].get(scenario)
+        if head_result is None:
+            continue
+        for metric in LATENCY_METRICS + THROUGHPUT_METRICS:
+            if metric not in base_result or metric not in head_result:
+                continue
+            old, new = base_result[metric], head_result[metric]
+            change = (new - old) / old if old else 0.0
+            worse = change if metric in LATENCY_METRICS else -change
+            rows.append((scenario, metric, old, new, change, worse > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    with open(args.base) as base_file, open(args.head) as head_file:
+        rows = compare(json.load(base_file), json.load(head_file), args.threshold)
+
+    regressions = 0
+    for scenario, metric, old, new, change, regressed in rows:
+        marker = "REGRESSION" if regressed else ""
+        regressions += regressed
+        print(
+            f"{scenario:<24} {metric:<10} {old:>12.2f} {new:>12.2f} {change:>+8.1%} {marker}"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""
+Benchmark and load-test runner for the API.
+
+Seeds a throwaway database and upload directory, starts the app under a local
+uvicorn process pointed at them, drives it over HTTP and writes the results as
+JSON. Run from the backend directory:
+
+    python -m benchmarks.run --profile quick --output results.json
+    python -m benchmarks.compare base.json results.json
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks import seed
+
+BACKEND_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KB = 1024
+MB = 1024 * KB
+
+PROFILES = {
+    "quick": {
+        "file_sizes": [KB, 64 * KB, MB],
+        "transfer_iterations": 20,
+        "login_iterations": 20,
+        "listing_rows": [10_000],
+        "listing_iterations": 5,
+        "share_links": 200,
+        "concurrency": 8,
+    },
+    "full": {
+        "file_sizes": [KB, 64 * KB, MB, 16 * MB, 64 * MB],
+        "transfer_iterations": 50,
+        "login_iterations": 100,
+        "listing_rows": [10_000, 100_000, 1_000_000],
+        "listing_iterations": 5,
+        "share_links": 2_000,
+        "concurrency": 32,
+    },
+}
+
+
+def summarize(durations, payload_bytes=0, wall_time=None):
+    """
+    Summarize request latencies.
+
+    Args:
+        durations (List[float]): Per-request durations in seconds
+        payload_bytes (int): Bytes moved per request, for throughput figures
+        wall_time (float, optional): Elapsed time when requests ran concurrently
+
+    Returns:
+        dict: Latency percentiles in milliseconds and throughput figures
+    """
+    ordered = sorted(durations)
+    elapsed = wall_time if wall_time is not None else sum(ordered)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    result = {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000,
+        "ops_per_s": len(ordered) / elapsed if elapsed else 0.0,
+    }
+    if payload_bytes:
+        result["mb_per_s"] = payload_bytes * len(ordered) / MB / elapsed
+    return result
+
+
+def timed(call):
+    start = time.perf_counter()
+    response = call()
+    duration = time.perf_counter() - start
+    response.raise_for_status()
+    return duration
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BACKEND_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Server:
+    """uvicorn subprocess serving the app against the benchmark data."""
+
+    def __init__(self, env: dict, port: int):
+        self.env = env
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(self.port),
+                "--log-level",
+                "warning",
+            ],
+            cwd=BACKEND_DIRECTORY,
+            env=self.env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("uvicorn exited during startup")
+            try:
+                httpx.get(self.base_url + "/", timeout=1)
+                return self
+            except httpx.TransportError:
+                time.sleep(0.1)
+        raise RuntimeError("uvicorn did not start within 30 seconds")
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+def login(client: httpx.Client, username: str) -> dict:
+    response = client.post(
+        "/auth/login", json={"username": username, "password": seed.DEFAULT_PASSWORD}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def bench_transfers(client, headers, blob_ids, profile):
+    results = {}
+    for size in profile["file_sizes"]:
+        payload = os.urandom(size)
+        durations = [
+            timed(
+                lambda: client.post(
+                    "/files/upload",
+                    headers=headers,
+                    files={
+                        "file": ("bench.bin", payload, "application/octet-stream"),
+                        "iv": ("iv", os.urandom(12), "application/octet-stream"),
+                        "salt": ("salt", os.urandom(16), "application/octet-stream"),
+                    },
+                )
+            )
+            for _ in range(profile["transfer_iterations"])
+        ]
+        results[f"upload_{size}"] = summarize(durations, payload_bytes=size)
+
+        durations = [
+            timed(
+                lambda: client.get(f"/files/download/{blob_ids[size]}", headers=headers)
+            )
+            for _ in range(profile["transfer_iterations"])
+        ]
+        results[f"download_{size}"] = summarize(durations, payload_bytes=size)
+    return results
+
+
+def bench_login(client, profile):
+    credentials = {"password": seed.DEFAULT_PASSWORD}
+    results = {}
+    for name, username in (("login", "bench_plain0"), ("login_mfa", "bench_mfa0")):
+        durations = [
+            timed(
+                lambda: client.post(
+                    "/auth/login", json={"username": username, **credentials}
+                )
+            )
+            for _ in range(profile["login_iterations"])
+        ]
+        results[name] = summarize(durations)
+    return results
+
+
+def bench_listing(client, profile):
+    results = {}
+    for rows in profile["listing_rows"]:
+        headers = login(client, f"bench_list_{rows}_0")
+        durations = [
+            timed(lambda: client.get("/files/list", headers=headers))
+            for _ in range(profile["listing_iterations"])
+        ]
+        results[f"list_{rows}"] = summarize(durations)
+    return results
+
+
+def bench_share_fanout(client, tokens, profile):
+    def fetch(token):
+        return timed(
+            lambda: client.get(f"/files/shared/{token}", params={"password": "x"})
+        )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=profile["concurrency"]) as pool:
+        durations = list(pool.map(fetch, tokens))
+    wall_time = time.perf_counter() - start
+    return {
+        "share_link_fanout": summarize(durations, payload_bytes=KB, wall_time=wall_time)
+    }
+
+
+def prepare(work_directory: str, profile: dict, seed_value: int):
+    """
+    Create the schema and seed users, blobs, listing rows and share links.
+
+    Returns:
+        Tuple[dict, dict, List[str]]: Server environment, blob IDs by size and
+        share tokens
+    """
+    database_path = os.path.join(work_directory, "bench.db")
+    upload_directory = os.path.join(work_directory, "uploads")
+    os.makedirs(upload_directory, exist_ok=True)
+    server_key = os.urandom(32)
+
+    env = dict(
+        os.environ,
+        DATABASE_PATH=database_path,
+        UPLOAD_DIRECTORY=upload_directory,
+        SERVER_KEY=base64.b64encode(server_key).decode(),
+        MFA_DELIVERY="log",
+        # The load generator is a single client hammering a handful of accounts;
+        # measure raw handler cost rather than the limits meant for real clients.
+        RATE_LIMIT_ENABLED="0",
+        MAX_CONCURRENT_DECRYPTS=str(profile["concurrency"]),
+    )
+    os.environ["DATABASE_PATH"] = database_path
+
+    from app.services.database import init_db
+    from app.services.security import SecurityService
+
+    init_db()
+    password_hash = SecurityService.hash_password(seed.DEFAULT_PASSWORD)
+
+    conn = seed.connect(database_path)
+    try:
+        (owner_id,) = seed.seed_users(conn, "bench_plain", 1, password_hash)
+        seed.seed_users(conn, "bench_mfa", 1, password_hash, mfa_enabled=True)
+        blob_ids = {
+            size: seed.seed_blob(
+                conn, owner_id, size, upload_directory, server_key, seed_value
+            )
+            for size in profile["file_sizes"]
+        }
+        for rows in profile["listing_rows"]:
+            (list_user_id,) = seed.seed_users(
+                conn, f"bench_list_{rows}_", 1, password_hash
+            )
+            seed.seed_file_rows(
+                conn, list_user_id, rows, upload_directory, seed=seed_value
+            )
+        share_file_id = seed.seed_blob(
+            conn, owner_id, KB, upload_directory, server_key, seed_value + 1
+        )
+        tokens = seed.seed_share_links(
+            conn, share_file_id, owner_id, profile["share_links"], seed_value
+        )
+    finally:
+        conn.close()
+    return env, blob_ids, tokens
+
+
+def run(profile_name: str, seed_value: int) -> dict:
+    profile = PROFILES[profile_name]
+    with tempfile.TemporaryDirectory(prefix="sfs-bench-") as work_directory:
+        env, blob_ids, tokens = prepare(work_directory, profile, seed_value)
+        with Server(env, free_port()) as server:
+            with httpx.Client(base_url=server.base_url, timeout=300) as client:
+                headers = login(client, "bench_plain0")
+                results = {}
+                results.update(bench_transfers(client, headers, blob_ids, profile))
+                results.update(bench_login(client, profile))
+                results.update(bench_listing(client, profile))
+                results.update(bench_share_fanout(client, tokens, profile))
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "profile": profile_name,
+            "seed": seed_value,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run(args.profile, args.seed), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Deterministic data generator for the benchmark suite.
+
+Seeds a SQLite database and an upload directory directly, bypassing the HTTP
+API, so that large listings (up to millions of rows) can be prepared in seconds.
+Blobs are written in the same format as ``encrypt_file``: AES-GCM ciphertext
+of the payload under SERVER_KEY with the row's IV.
+"""
+
+import os
+import random
+import sqlite3
+import uuid
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+DEFAULT_PASSWORD = "benchpass123"
+
+
+def connect(database_path: str) -> sqlite3.Connection:
+    """
+    Open the benchmark database with settings tuned for bulk loading.
+
+    Args:
+        database_path (str): Path of the SQLite database to seed
+
+    Returns:
+        sqlite3.Connection: Connection with synchronous writes disabled
+    """
+    conn = sqlite3.connect(database_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    return conn
+
+
+def seed_users(
+    conn: sqlite3.Connection,
+    prefix: str,
+    count: int,
+    password_hash: str,
+    role: str = "user",
+    mfa_enabled: bool = False,
+):
+    """
+    Insert ``count`` users named ``{prefix}{n}`` sharing one password hash.
+
+    Args:
+        conn (sqlite3.Connection): Benchmark database connection
+        prefix (str): Username prefix
+        count (int): Number of users to create
+        password_hash (str): Precomputed bcrypt hash, so seeding skips bcrypt
+        role (str): Role assigned to every user
+        mfa_enabled (bool): Whether the users require MFA at login
+
+    Returns:
+        List[int]: IDs of the created users, in creation order
+    """
+    rows = [
+        (f"{prefix}{n}", f"{prefix}{n}@bench.local", password_hash, role, mfa_enabled)
+        for n in range(count)
+    ]
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (username, email, password, role, mfa_enabled) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    placeholders = ",".join("?" * len(rows))
+    return [
+        row[0]
+        for row in conn.execute(
+            f"SELECT id FROM users WHERE username IN ({placeholders}) ORDER BY id",
+            [row[0] for row in rows],
+        )
+    ]
+
+
+def seed_file_rows(
+    conn: sqlite3.Connection,
+    user_id: int,
+    count: int,
+    upload_directory: str,
+    seed: int = 0,
+    batch_size: int = 50_000,
+):
+    """
+    Insert ``count`` metadata-only rows into ``files`` for one user.
+
+    The rows point at blobs that do not exist; they are meant for listing and
+    search benchmarks, which never touch the blob store.
+
+    Args:
+        conn (sqlite3.Connection): Benchmark database connection
+        user_id (int): Owner of the rows
+        count (int): Number of rows to insert
+        upload_directory (str): Directory used to build ``file_path`` values
+        seed (int): Random seed, so filenames are identical between runs
+        batch_size (int): Rows per ``executemany`` call
+    """
+    rng = random.Random(seed)
+    words = ["report", "invoice", "photo", "draft", "notes", "backup", "scan", "plan"]
+    extensions = ["pdf", "txt", "png", "docx", "csv"]
+    iv = bytes(12)
+    salt = bytes(16)
+    for start in range(0, count, batch_size):
+        rows = []
+        for n in range(start, min(start + batch_size, count)):
+            filename = f"{rng.choice(words)}_{n}.{rng.choice(extensions)}"
+            file_path = os.path.join(upload_directory, f"seed-{user_id}-{n}")
+            rows.append((filename, user_id, file_path, iv, salt))
+        conn.executemany(
+            "INSERT INTO files (filename, user_id, file_path, iv, salt) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+
+
+def seed_blob(
+    conn: sqlite3.Connection,
+    user_id: int,
+    size: int,
+    upload_directory: str,
+    server_key: bytes,
+    seed: int = 0,
+) -> int:
+    """
+    Write one encrypted blob of ``size`` bytes and its ``files`` row.
+
+    Args:
+        conn (sqlite3.Connection): Benchmark database connection
+        user_id (int): Owner of the file
+        size (int): Plaintext size in bytes
+        upload_directory (str): Directory receiving the blob
+        server_key (bytes): AES key the server under test was started with
+        seed (int): Random seed for the payload and IV
+
+    Returns:
+        int: ID of the inserted ``files`` row
+    """
+    rng = random.Random(seed)
+    payload = rng.randbytes(size)
+    iv = rng.randbytes(12)
+    salt = rng.randbytes(16)
+    filename = f"bench_{size}.bin"
+    file_path = os.path.join(
+        upload_directory, f"{uuid.UUID(int=rng.getrandbits(128))}_{filename}"
+    )
+    ciphertext = AESGCM(server_key).encrypt(iv, payload, None)
+    with open(file_path, "wb") as blob:
+        blob.write(ciphertext)
+    cursor = conn.execute(
+        "INSERT INTO files (filename, user_id, file_path, iv, salt, size_bytes) VALUES (?, ?, ?, ?, ?, ?)",
+        (filename, user_id, file_path, iv, salt, len(ciphertext)),
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def seed_share_links(
+    conn: sqlite3.Connection, file_id: int, shared_by: int, count: int, seed: int = 0
+):
+    """
+    Create ``count`` public share links for one file, valid for a day.
+
+    Each link also gets its ``share_tokens`` row, the global index the server
+    resolves tokens through, in the same transaction.
+
+    Args:
+        conn (sqlite3.Connection): Benchmark database connection
+        file_id (int): File to share
+        shared_by (int): Owner creating the links
+        count (int): Number of links
+        seed (int): Random seed for the tokens
+
+    Returns:
+        List[str]: Share tokens
+    """
+    rng = random.Random(seed)
+    tokens = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(count)]
+    for token in tokens:
+        share_id = conn.execute(
+            """INSERT INTO file_shares
+               (file_id, shared_by, shared_with, permissions, token, expires_at)
+               VALUES (?, ?, NULL, 'download', ?, datetime('now', '+1 day'))""",
+            (file_id, shared_by, token),
+        ).lastrowid
+        conn.execute(
+            "INSERT INTO share_tokens (token, share_id, file_id) VALUES (?, ?, ?)",
+            (token, share_id, file_id),
+        )
+    conn.commit()
+    return tokens
@@ -0,0 +1,79 @@
+"""Minimal in-memory S3 stand-in, served as an ASGI app through httpx.ASGITransport."""
+
+import uuid
+from urllib.parse import parse_qs
+
+
+class FakeS3:
+    """Implements the object and multipart calls used by S3Storage."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.requests = []
+
+    async def __call__(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        headers = dict(scope["headers"])
+        if not headers.get(b"authorization", b"").startswith(b"AWS4-HMAC-SHA256"):
+            await self._respond(send, 403)
+            return
+
+        method = scope["method"]
+        key = scope["path"]
+        query = {
+            name: values[0]
+            for name, values in parse_qs(
+                scope["query_string"].decode(), keep_blank_values=True
+            ).items()
+        }
+        self.requests.append((method, key, query))
+
+        if method == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            xml = f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            await self._respond(send, 200, xml.encode())
+        elif method == "PUT" and "uploadId" in query:
+            self.uploads[query["uploadId"]][int(query["partNumber"])] = body
+            etag = f'"{uuid.uuid4().hex}"'
+            await self._respond(send, 200, headers=[(b"etag", etag.encode())])
+        elif method == "POST" and "uploadId" in query:
+            parts = self.uploads.pop(query["uploadId"])
+            self.objects[key] = b"".join(parts[number] for number in sorted(parts))
+            await self._respond(send, 200, b"<CompleteMultipartUploadResult/>")
+        elif method == "DELETE" and "uploadId" in query:
+            self.uploads.pop(query["uploadId"], None)
+            await self._respond(send, 204)
+        elif method == "PUT":
+            self.objects[key] = body
+            await self._respond(send, 200)
+        elif method in ("GET", "HEAD"):
+            if key not in self.objects:
+                await self._respond(send, 404)
+            elif method == "GET":
+                await self._respond(send, 200, self.objects[key])
+            else:
+                await self._respond(send, 200)
+        elif method == "DELETE":
+            self.objects.pop(key, None)
+            await self._respond(send, 204)
+        else:
+            await self._respond(send, 400)
+
+    @staticmethod
+    async def _respond(send, status, body=b"", headers=()):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-length", str(len(body)).encode()), *headers],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
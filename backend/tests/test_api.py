@@ -1,10 +1,15 @@
+import asyncio
 import pytest
+import httpx
 from fastapi.testclient import TestClient
 import os
 import tempfile
+import threading
+import uuid
 from unittest.mock import patch
 from app.main import app
-from app.services.database import init_db, DATABASE_PATH
+from app.services.database import init_db, DATABASE_PATH, WRITERS
+from app.services.ratelimit import LIMITERS, DECRYPT_BUDGET, UPLOAD_BUDGET
 
 client = TestClient(app)
 
@@ -29,6 +34,13 @@ def setup_test_db():
     DATABASE_PATH = original_path
 
 
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """Give every test fresh rate-limit buckets"""
+    for limiter in LIMITERS:
+        limiter.reset()
+
+
 @pytest.fixture(autouse=True)
 def cleanup_uploaded_files():
     """Clean up any uploaded test files after each test"""
@@ -134,6 +146,37 @@ async def test_upload_file(test_user_token):
     os.unlink(tmp_file.name)
 
 
+@pytest.mark.parametrize("file_first", [False, True])
+def test_upload_streams_in_either_field_order(test_user_token, file_first):
+    content = os.urandom(200_000)
+    name = f"test-stream-{uuid.uuid4().hex}.bin"
+    fields = [
+        ("iv", ("iv", os.urandom(12), "application/octet-stream")),
+        ("salt", ("salt", b"mock_salt", "application/octet-stream")),
+    ]
+    upload = ("file", (name, content, "application/octet-stream"))
+    fields = [upload] + fields if file_first else fields + [upload]
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+
+    response = client.post("/files/upload", files=fields, headers=headers)
+    assert response.status_code == 200
+
+    owned = client.get("/files/list", headers=headers).json()["owned_files"]
+    file_id = next(f["id"] for f in owned if f["filename"] == name)
+    response = client.get(f"/files/download/{file_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.content == content
+    client.delete(f"/files/delete/{file_id}", headers=headers)
+
+
+def test_upload_rejects_missing_fields(test_user_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    files = {"file": ("test.txt", b"test content", "text/plain")}
+
+    response = client.post("/files/upload", files=files, headers=headers)
+    assert response.status_code == 400
+
+
 def test_list_files(test_user_token):
     headers = {"Authorization": f"Bearer {test_user_token}"}
     response = client.get("/files/list", headers=headers)
@@ -162,15 +205,22 @@ def test_mfa_flow(mock_send_mfa):
     assert response.json()["require_mfa"] == True
 
     mock_send_mfa.assert_called_once()
+    code = mock_send_mfa.call_args[0][1]
     response = client.post(
         "/auth/verify-mfa",
         json={
             "username": "mfauser",
-            "code": "123456",
+            "code": "123456" if code != "123456" else "654321",
         },
     )
     assert response.status_code == 401
 
+    response = client.post(
+        "/auth/verify-mfa", json={"username": "mfauser", "code": code}
+    )
+    assert response.status_code == 200
+    assert "access_token" in response.json()
+
 
 def test_file_sharing(test_user_token, admin_token):
     with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
@@ -227,3 +277,527 @@ def test_cleanup():
     for filename in os.listdir("uploads"):
         if filename.startswith("test"):
             os.remove(os.path.join("uploads", filename))
+
+
+def test_metrics_endpoint(test_user_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    client.get("/files/list", headers=headers)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/files/list",status="200"}' in body
+    assert 'stage_duration_seconds_count{operation="login_user",stage="bcrypt"}' in body
+    assert 'db_query_duration_seconds_bucket{helper="fetch_one",le="+Inf"}' in body
+
+
+def test_profiling_captures_sampled_requests(admin_token):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    response = client.put(
+        "/admin/profiling",
+        headers=headers,
+        json={"enabled": True, "sample_rate": 1.0, "interval_ms": 1},
+    )
+    assert response.status_code == 200
+
+    client.post("/auth/login", json={"username": "admin", "password": "adminpass123"})
+    client.put("/admin/profiling", headers=headers, json={"enabled": False})
+
+    response = client.get(
+        "/admin/profiling/profile",
+        headers=headers,
+        params={"route": "/auth/login", "format": "collapsed"},
+    )
+    assert response.status_code == 200
+    assert "login_user" in response.text
+
+
+def test_profile_snapshot_is_detached_from_live_profile():
+    from collections import Counter
+    from app.services.profiling import SamplingProfiler
+
+    profiler = SamplingProfiler()
+    profiler.finish(profiler.start(), "/route", 0.01)
+    profiler.profiles["/route"].merge(Counter({"a;b": 2}), 0.01)
+    snapshot = profiler.snapshot("/route")
+    profiler.profiles["/route"].merge(Counter({"a;c": 1}), 0.01)
+
+    assert snapshot.collapsed() == "a;b 2\n"
+    assert snapshot.requests == 2
+    assert profiler.snapshot("/missing") is None
+
+
+def test_profiling_requires_admin(test_user_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    response = client.get("/admin/profiling", headers=headers)
+    assert response.status_code == 403
+
+
+def test_login_rate_limited_per_user():
+    for _ in range(5):
+        client.post("/auth/login", json={"username": "nobody", "password": "wrong"})
+
+    response = client.post(
+        "/auth/login", json={"username": "nobody", "password": "wrong"}
+    )
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_download_rejected_when_decrypt_budget_exhausted(test_user_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    slots = DECRYPT_BUDGET.slots
+    DECRYPT_BUDGET.slots = 0
+    try:
+        response = client.get("/files/download/1", headers=headers)
+    finally:
+        DECRYPT_BUDGET.slots = slots
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def upload_test_file(headers, filename, content=b"test content"):
+    files = {
+        "file": (filename, content, "text/plain"),
+        "iv": ("iv", os.urandom(12), "application/octet-stream"),
+        "salt": ("salt", b"mock_salt", "application/octet-stream"),
+    }
+    response = client.post("/files/upload", files=files, headers=headers)
+    assert response.status_code == 200
+    return response
+
+
+def test_search_files_by_prefix(test_user_token, admin_token):
+    tag = uuid.uuid4().hex[:8]
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    upload_test_file(headers, f"test {tag} quarterly report.txt")
+    upload_test_file(headers, f"test {tag} holiday.png")
+
+    response = client.get(
+        "/files/search", headers=headers, params={"q": f"{tag} quart"}
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert [result["filename"] for result in body["results"]] == [
+        f"test {tag} quarterly report.txt"
+    ]
+    assert body["results"][0]["owned"] is True
+
+    response = client.get(
+        "/files/search", headers=headers, params={"q": tag, "limit": 1}
+    )
+    assert len(response.json()["results"]) == 1
+    assert response.json()["has_more"] is True
+
+    client.post(
+        "/auth/register",
+        json={
+            "username": "searchother",
+            "email": "searchother@example.com",
+            "password": "password123",
+        },
+    )
+    other_token = client.post(
+        "/auth/login", json={"username": "searchother", "password": "password123"}
+    ).json()["access_token"]
+    response = client.get(
+        "/files/search",
+        headers={"Authorization": f"Bearer {other_token}"},
+        params={"q": tag},
+    )
+    assert response.json()["results"] == []
+
+
+def test_storage_usage_and_quota(admin_token):
+    client.post(
+        "/auth/register",
+        json={
+            "username": "quotauser",
+            "email": "quota@example.com",
+            "password": "password123",
+        },
+    )
+    token = client.post(
+        "/auth/login", json={"username": "quotauser", "password": "password123"}
+    ).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+
+    def usage():
+        response = client.get("/admin/storage/usage", headers=admin_headers)
+        assert response.status_code == 200
+        return next(
+            user for user in response.json()["users"] if user["username"] == "quotauser"
+        )
+
+    before = usage()
+    upload_test_file(headers, "test_quota.txt", b"x" * 100)
+    after = usage()
+    assert after["bytes_used"] == before["bytes_used"] + 116
+    assert after["file_count"] == before["file_count"] + 1
+
+    response = client.put(
+        f"/admin/users/{after['user_id']}/quota",
+        headers=admin_headers,
+        json={"quota_bytes": after["bytes_used"] + 50},
+    )
+    assert response.status_code == 200
+    files = {
+        "file": ("test_quota.txt", b"x" * 100, "text/plain"),
+        "iv": ("iv", os.urandom(12), "application/octet-stream"),
+        "salt": ("salt", b"mock_salt", "application/octet-stream"),
+    }
+    response = client.post("/files/upload", files=files, headers=headers)
+    assert response.status_code == 413
+
+    file_id = client.get("/files/list", headers=headers).json()["owned_files"][-1]["id"]
+    client.delete(f"/files/delete/{file_id}", headers=headers)
+    assert usage()["bytes_used"] == before["bytes_used"]
+
+
+def test_audit_log_records_share_and_download(test_user_token, admin_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+    upload_test_file(headers, "test_audit.txt", b"audited content")
+    file_id = client.get("/files/list", headers=headers).json()["owned_files"][-1]["id"]
+
+    response = client.post(
+        "/files/share",
+        headers=headers,
+        json={"file_id": file_id, "permissions": "download", "expires_in_hours": 1},
+    )
+    token = response.json()["share_token"]
+    response = client.get(f"/files/shared/{token}", params={"password": "x"})
+    assert response.content == b"audited content"
+
+    response = client.get(
+        "/admin/audit", headers=admin_headers, params={"file_id": file_id}
+    )
+    assert response.status_code == 200
+    actions = [event["action"] for event in response.json()["events"]]
+    assert actions == ["shared_download", "share_create"]
+    assert response.json()["events"][1]["actor"] == "testuser"
+
+
+def test_batch_share(test_user_token, admin_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    upload_test_file(headers, "test_batch_a.txt")
+    upload_test_file(headers, "test_batch_b.txt")
+    owned = client.get("/files/list", headers=headers).json()["owned_files"]
+    file_ids = [owned[-2]["id"], owned[-1]["id"]]
+
+    response = client.post(
+        "/files/share/batch",
+        headers=headers,
+        json={
+            "file_ids": file_ids + [999999999],
+            "usernames": ["admin", "no_such_user"],
+            "permissions": "download",
+        },
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["shared"] == 2
+    statuses = {(r["file_id"], r["username"]): r["status"] for r in body["results"]}
+    assert statuses[(file_ids[0], "admin")] == "shared"
+    assert statuses[(file_ids[1], "no_such_user")] == "user_not_found"
+    assert statuses[(999999999, "admin")] == "file_not_found"
+
+
+def test_batch_share_schedules_only_its_own_shares(test_user_token, admin_token):
+    from datetime import datetime as real_datetime
+
+    from app.services.database import fetch_all
+    from app.services.expiry import EXPIRY_WHEEL
+
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    upload_test_file(headers, "test_batch_expiry.txt")
+    file_id = client.get("/files/list", headers=headers).json()["owned_files"][-1]["id"]
+
+    class FrozenDatetime(real_datetime):
+        @classmethod
+        def utcnow(cls):
+            return real_datetime(2030, 1, 1)
+
+    def share():
+        with patch("app.routes.files.datetime", FrozenDatetime):
+            response = client.post(
+                "/files/share/batch",
+                headers=headers,
+                json={"file_ids": [file_id], "usernames": ["admin"]},
+            )
+        assert response.json()["shared"] == 1
+        return fetch_all(
+            "SELECT MAX(id) FROM file_shares WHERE file_id = ?", (file_id,)
+        )[0][0]
+
+    first = share()
+    assert EXPIRY_WHEEL.cancel("share", first) is True
+    second = share()
+    assert second != first
+    # Same sharer and expiry: the first batch's share must not be rescheduled.
+    assert EXPIRY_WHEEL.cancel("share", first) is False
+    assert EXPIRY_WHEEL.cancel("share", second) is True
+
+
+def test_streamed_listings_match_buffered(test_user_token, admin_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    upload_test_file(headers, "test_stream.txt")
+    buffered = client.get("/files/list", headers=headers)
+    streamed = client.get("/files/list", params={"stream": True}, headers=headers)
+    assert streamed.status_code == 200
+    assert streamed.headers["content-type"] == "application/json"
+    assert streamed.json() == buffered.json()
+
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+    buffered = client.get("/auth/users", headers=admin_headers)
+    streamed = client.get("/auth/users", params={"stream": True}, headers=admin_headers)
+    assert streamed.status_code == 200
+    assert streamed.json() == buffered.json()
+
+
+def test_concurrent_uploads_share_a_group_commit(test_user_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    uploads = 5
+    submitted, insert_batches = [], []
+    release = threading.Event()
+
+    def gated(writer):
+        submit, commit = writer.submit, writer._commit
+
+        def counting_submit(query, *args, **kwargs):
+            if "INSERT INTO files" in query:
+                submitted.append(query)
+            return submit(query, *args, **kwargs)
+
+        def held_commit(batch):
+            inserts = sum("INSERT INTO files" in entry[0] for entry in batch)
+            if inserts:
+                # Park the writer on the first upload until every upload has
+                # queued its insert, as a slow commit would.
+                release.wait(5)
+                insert_batches.append(inserts)
+            return commit(batch)
+
+        return [
+            patch.object(writer, "submit", counting_submit),
+            patch.object(writer, "_commit", held_commit),
+        ]
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as async_client:
+            requests = [
+                asyncio.ensure_future(
+                    async_client.post(
+                        "/files/upload",
+                        headers=headers,
+                        files={
+                            "iv": ("iv", os.urandom(12), "application/octet-stream"),
+                            "salt": ("salt", b"salt", "application/octet-stream"),
+                            "file": (f"test_batch{n}.txt", b"data", "text/plain"),
+                        },
+                    )
+                )
+                for n in range(uploads)
+            ]
+            for _ in range(500):
+                if len(submitted) == uploads:
+                    break
+                await asyncio.sleep(0.01)
+            release.set()
+            return await asyncio.gather(*requests)
+
+    patches = [p for writer in WRITERS for p in gated(writer)]
+    patches.append(patch.object(UPLOAD_BUDGET, "slots", uploads))
+    for p in patches:
+        p.start()
+    try:
+        responses = asyncio.run(scenario())
+    finally:
+        for p in patches:
+            p.stop()
+
+    assert [response.status_code for response in responses] == [200] * uploads
+    # The first insert may commit alone; the others wait for it together and
+    # form one batch instead of committing one after another.
+    assert sum(insert_batches) == uploads
+    assert len(insert_batches) <= 2
+
+
+def test_file_versions(test_user_token):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    original = os.urandom(300_000)
+    upload_test_file(headers, "test_versions.bin", original)
+    file_id = client.get("/files/list", headers=headers).json()["owned_files"][-1]["id"]
+
+    def upload_version(content):
+        response = client.post(
+            f"/files/{file_id}/versions",
+            headers=headers,
+            files={
+                "file": ("test_versions.bin", content, "application/octet-stream"),
+                "iv": ("iv", os.urandom(12), "application/octet-stream"),
+                "salt": ("salt", b"mock_salt", "application/octet-stream"),
+            },
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    assert upload_version(original)["version"] == 2
+    edited = original[:1000] + b"inserted" + original[1000:]
+    result = upload_version(edited)
+    assert result["version"] == 3
+    assert result["new_chunks"] < result["chunks"]
+
+    versions = client.get(f"/files/{file_id}/versions", headers=headers).json()
+    assert [v["version"] for v in versions["versions"]] == [1, 2, 3]
+    assert client.get(f"/files/download/{file_id}", headers=headers).content == edited
+    response = client.get(f"/files/{file_id}/versions/1", headers=headers)
+    assert response.content == original
+
+    response = client.post(f"/files/{file_id}/versions/1/restore", headers=headers)
+    assert response.json()["version"] == 4
+    assert client.get(f"/files/download/{file_id}", headers=headers).content == original
+    assert (
+        client.get(f"/files/{file_id}/versions/9", headers=headers).status_code == 404
+    )
+
+    response = client.delete(f"/files/delete/{file_id}", headers=headers)
+    assert response.status_code == 200
+
+
+def test_share_expiry_is_scheduled_and_cancelled(test_user_token):
+    from app.services.database import fetch_one
+    from app.services.expiry import EXPIRY_WHEEL
+
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    upload_test_file(headers, "test_expiry.txt")
+    file_id = client.get("/files/list", headers=headers).json()["owned_files"][-1]["id"]
+    response = client.post(
+        "/files/share",
+        headers=headers,
+        json={"file_id": file_id, "permissions": "download", "expires_in_hours": 1},
+    )
+    assert response.status_code == 200
+    share_id = fetch_one(
+        "SELECT MAX(id) FROM file_shares WHERE file_id = ?", (file_id,)
+    )[0]
+    assert EXPIRY_WHEEL.cancel("share", share_id) is True
+    EXPIRY_WHEEL.schedule("share", share_id, 0, file_id)
+
+    response = client.delete(f"/files/revoke-share/{share_id}", headers=headers)
+    assert response.status_code == 200
+    assert EXPIRY_WHEEL.cancel("share", share_id) is False
+
+
+def test_change_feed_follows_uploads_shares_and_deletes(test_user_token, admin_token):
+    from app.services.database import fetch_one
+
+    client.post(
+        "/auth/register",
+        json={
+            "username": "feeduser",
+            "email": "feed@example.com",
+            "password": "feedpass123",
+            "role": "user",
+            "mfa_enabled": False,
+        },
+    )
+    recipient_token = client.post(
+        "/auth/login", json={"username": "feeduser", "password": "feedpass123"}
+    ).json()["access_token"]
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    recipient_headers = {"Authorization": f"Bearer {recipient_token}"}
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+
+    def changes(request_headers, since):
+        response = client.get(
+            "/files/changes", params={"since": since}, headers=request_headers
+        )
+        assert response.status_code == 200
+        assert not response.json()["reset"]
+        return response.json()
+
+    listing = client.get("/files/list", headers=headers)
+    since = int(listing.headers["X-Changes-Version"])
+    upload_test_file(headers, "test_feed.txt")
+    delta = changes(headers, since)
+    file = delta["changes"][-1]["file"]
+    assert delta["changes"][-1]["list"] == "owned"
+    assert file.pop("owner_username") == "testuser"
+    assert file["filename"] == "test_feed.txt"
+    assert file in client.get("/files/list", headers=headers).json()["owned_files"]
+
+    response = client.post(
+        "/files/share/batch",
+        headers=headers,
+        json={"file_ids": [file["id"]], "usernames": ["feeduser"]},
+    )
+    assert response.json()["shared"] == 1
+    shared = changes(recipient_headers, delta["version"])["changes"]
+    assert shared[-1]["list"] == "shared" and shared[-1]["file"]["id"] == file["id"]
+    assert shared[-1]["file"] in (
+        client.get("/files/list", headers=recipient_headers).json()["shared_files"]
+    )
+
+    share_id = fetch_one(
+        "SELECT MAX(id) FROM file_shares WHERE file_id = ?", (file["id"],)
+    )[0]
+    client.delete(f"/files/revoke-share/{share_id}", headers=headers)
+    revoked = changes(recipient_headers, delta["version"])["changes"]
+    assert revoked[-1] == {"list": "shared", "file_id": file["id"], "file": None}
+
+    client.delete(f"/files/delete/{file['id']}", headers=headers)
+    deleted = {"list": "owned", "file_id": file["id"], "file": None}
+    assert changes(headers, since)["changes"][-1] == deleted
+    assert changes(admin_headers, since)["changes"][-1] == deleted
+
+    response = client.get("/files/changes", params={"since": 10**12}, headers=headers)
+    assert response.json()["reset"]
+
+
+def test_change_feed_follows_account_deletion(test_user_token, admin_token):
+    username = f"gone{uuid.uuid4().hex[:8]}"
+    client.post(
+        "/auth/register",
+        json={
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": "gonepass123",
+            "role": "user",
+            "mfa_enabled": False,
+        },
+    )
+    token = client.post(
+        "/auth/login", json={"username": username, "password": "gonepass123"}
+    ).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    recipient_headers = {"Authorization": f"Bearer {test_user_token}"}
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+
+    upload_test_file(headers, "test_gone.txt")
+    file_id = client.get("/files/list", headers=headers).json()["owned_files"][0]["id"]
+    response = client.post(
+        "/files/share/batch",
+        headers=headers,
+        json={"file_ids": [file_id], "usernames": ["testuser"]},
+    )
+    assert response.json()["shared"] == 1
+    since = int(
+        client.get("/files/list", headers=admin_headers).headers["X-Changes-Version"]
+    )
+
+    assert client.delete("/auth/account", headers=headers).status_code == 200
+
+    def changes(request_headers):
+        return client.get(
+            "/files/changes", params={"since": since}, headers=request_headers
+        ).json()["changes"]
+
+    assert {"list": "shared", "file_id": file_id, "file": None} in changes(
+        recipient_headers
+    )
+    assert {"list": "owned", "file_id": file_id, "file": None} in changes(admin_headers)
@@ -0,0 +1,43 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+import pytest
+
+from app.services.audit import AuditLog
+
+
+def test_failed_flush_keeps_events_and_the_writer_running():
+    with tempfile.TemporaryDirectory() as directory:
+        audit = AuditLog(os.path.join(directory, "audit.db"), flush_interval=0.01)
+        audit.init_db()
+        connect = audit._connect
+        audit._connect = lambda: sqlite3.connect(
+            os.path.join(directory, "missing", "x.db")
+        )
+        try:
+            audit.record("download", actor="alice")
+            audit.record("share_create", actor="alice")
+            time.sleep(0.1)
+            with pytest.raises(sqlite3.OperationalError):
+                audit.flush()
+            audit.record("share_revoke", actor="alice")
+            assert [event[1] for event in audit._buffer] == [
+                "download",
+                "share_create",
+                "share_revoke",
+            ]
+            assert audit._writer.is_alive()
+        finally:
+            audit._connect = connect
+
+        deadline = time.monotonic() + 2
+        while audit._buffer and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [event["action"] for event in audit.query(actor="alice")] == [
+            "share_revoke",
+            "share_create",
+            "download",
+        ]
+        audit.close()
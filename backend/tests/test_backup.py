@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter against its own databases, since a restore
+# overwrites the database files.
+SCENARIO = """
+import asyncio, gc, os, sqlite3
+from app.services.backup import blob_path, create_backup, restore_backup
+from app.services.database import (
+    POOLS, SHARD_PATHS, WRITERS, execute_query, fetch_one, init_db, next_row_id,
+    shard_for_user,
+)
+from app.services.packs import PackedStorage
+from app.services.storage import LocalStorage
+
+root = os.environ["SCENARIO_DIR"]
+backups = os.path.join(root, "backups")
+init_db()
+storage = LocalStorage(os.environ["UPLOAD_DIRECTORY"])
+packs = os.path.join(root, "packs")
+if os.environ["SCENARIO_PACKING"] == "1":
+    storage = PackedStorage(storage, packs)
+
+async def add(user_id, name):
+    key = storage.new_key(name)
+    await storage.write(key, name.encode())
+    shard = shard_for_user(user_id)
+    execute_query(
+        f"INSERT INTO files (id, filename, user_id, file_path, iv, salt) "
+        f"VALUES ({next_row_id('files', shard)}, ?, ?, ?, ?, ?)",
+        (name, user_id, key, b"0" * 12, b"salt"),
+        shard=shard,
+    )
+    return key
+
+async def main():
+    a = await add(1, "a")
+    b = await add(2, "b")
+    first = await create_backup(storage, backups, workers=2, bytes_per_second=0)
+    assert first["blobs"]["copied"] == 2, first
+
+    c = await add(1, "c")
+    second = await create_backup(storage, backups, workers=2, bytes_per_second=10**6)
+    assert second["blobs"]["copied"] == 1, second
+    assert second["previous"] == first["id"]
+    assert os.path.exists(blob_path(os.path.join(backups, "blobs"), c))
+    journal = fetch_one("SELECT COUNT(*) FROM blob_journal", shard=shard_for_user(1))
+    assert journal[0] == 0
+
+    third = await create_backup(storage, backups, full=True)
+    assert third["blobs"] == {
+        "copied": 0, "bytes": 0, "present": 3, "missing": 0, "missing_sample": []
+    }, third
+
+    await storage.delete(a)
+    await storage.delete(c)
+    if isinstance(storage, PackedStorage):
+        # The restored database still has the addresses of the lost packs.
+        storage.seal_active()
+        for name in os.listdir(packs):
+            os.remove(os.path.join(packs, name))
+        expected = {"restored": 2, "present": 0, "missing": 0}
+    else:
+        expected = {"restored": 1, "present": 1, "missing": 0}
+    for writer in WRITERS:
+        writer.stop()
+    for pool in POOLS:
+        pool.close()
+    gc.collect()  # a restore needs every connection to the live files closed
+    report = await restore_backup(storage, first["id"], backups)
+    assert report == expected, report
+
+    names = set()
+    for path in SHARD_PATHS:
+        with sqlite3.connect(path) as conn:
+            names.update(row[0] for row in conn.execute("SELECT filename FROM files"))
+    assert names == {"a", "b"}, names
+    assert await storage.read_all(a) == b"a"
+    assert await storage.read_all(b) == b"b"
+    await storage.close()
+
+asyncio.run(main())
+print("ok")
+"""
+
+
+@pytest.mark.parametrize("shards, packing", [("1", "0"), ("2", "0"), ("1", "1")])
+def test_incremental_backup_and_restore(shards, packing):
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            DB_SHARDS=shards,
+            DATABASE_PATH=os.path.join(directory, "app.db"),
+            UPLOAD_DIRECTORY=os.path.join(directory, "uploads"),
+            AUDIT_DATABASE_PATH=os.path.join(directory, "audit.db"),
+            SCENARIO_DIR=directory,
+            SCENARIO_PACKING=packing,
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", SCENARIO],
+            cwd=BACKEND_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == "ok"
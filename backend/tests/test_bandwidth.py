@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+from app.services.bandwidth import FairShareScheduler, shape
+
+
+async def download(scheduler, key, chunks, size=1000):
+    for _ in range(chunks):
+        await scheduler.acquire(key, size)
+    return time.monotonic()
+
+
+def test_small_download_is_not_stuck_behind_heavy_hitter():
+    # 200 KB/s with 1 KB quanta: the heavy flow alone needs 0.75 s.
+    scheduler = FairShareScheduler(
+        rate=200_000, flow_rate=0, quantum=1000, burst_seconds=0
+    )
+
+    async def run():
+        start = time.monotonic()
+        heavy = [
+            asyncio.create_task(download(scheduler, "user:heavy", 50)) for _ in range(3)
+        ]
+        await asyncio.sleep(0.02)
+        light = await download(scheduler, "user:light", 3)
+        return light - start, max(await asyncio.gather(*heavy)) - start
+
+    light_done, heavy_done = asyncio.run(run())
+    assert light_done < 0.15
+    assert heavy_done > 0.6
+
+
+def test_per_flow_rate_caps_one_flow_only():
+    scheduler = FairShareScheduler(
+        rate=0, flow_rate=100_000, quantum=1000, burst_seconds=0
+    )
+
+    async def run():
+        start = time.monotonic()
+        slow, other = await asyncio.gather(
+            download(scheduler, "user:a", 20), download(scheduler, "share:1", 2)
+        )
+        return slow - start, other - start
+
+    slow, other = asyncio.run(run())
+    assert slow >= 0.15
+    assert other < 0.05
+
+
+def test_cancelled_waiters_are_skipped():
+    scheduler = FairShareScheduler(
+        rate=10_000, flow_rate=0, quantum=1000, burst_seconds=0
+    )
+
+    async def run():
+        await scheduler.acquire("user:a", 1000)
+        stuck = asyncio.create_task(scheduler.acquire("user:a", 1000))
+        await asyncio.sleep(0)
+        stuck.cancel()
+        start = time.monotonic()
+        await scheduler.acquire("user:b", 1000)
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 0.2
+    assert len(scheduler) == 0
+
+
+def test_shape_splits_into_quanta_and_passes_through_when_disabled():
+    async def collect(scheduler, content):
+        return [piece async for piece in shape(content, "user:a", "user", scheduler)]
+
+    async def body():
+        yield b"a" * 2500
+        yield b"b" * 10
+
+    enabled = FairShareScheduler(rate=10**9, flow_rate=0, quantum=1000)
+    assert [len(p) for p in asyncio.run(collect(enabled, b"x" * 2500))] == [
+        1000,
+        1000,
+        500,
+    ]
+    assert b"".join(asyncio.run(collect(enabled, body()))) == b"a" * 2500 + b"b" * 10
+
+    disabled = FairShareScheduler(rate=0, flow_rate=0)
+    assert not disabled.enabled
+    assert b"".join(asyncio.run(collect(disabled, b"x" * 2500))) == b"x" * 2500
@@ -0,0 +1,34 @@
+import random
+import tempfile
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.database import DATABASE_PATH, init_db
+from app.services.security import get_server_key
+from benchmarks import run, seed
+
+client = TestClient(app)
+
+
+def test_share_fanout_links_resolve():
+    init_db()
+    with tempfile.TemporaryDirectory() as upload_directory:
+        conn = seed.connect(DATABASE_PATH)
+        try:
+            (owner_id,) = seed.seed_users(
+                conn, f"bench_smoke_{uuid.uuid4().hex[:8]}_", 1, "unused"
+            )
+            file_id = seed.seed_blob(
+                conn, owner_id, run.KB, upload_directory, get_server_key()
+            )
+            tokens = seed.seed_share_links(
+                conn, file_id, owner_id, 4, seed=random.getrandbits(32)
+            )
+        finally:
+            conn.close()
+
+        results = run.bench_share_fanout(client, tokens, {"concurrency": 2})
+
+    assert results["share_link_fanout"]["n"] == len(tokens)
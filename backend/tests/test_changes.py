@@ -0,0 +1,99 @@
+import asyncio
+import json
+import random
+
+from starlette.concurrency import run_in_threadpool
+
+from app.services.changes import ChangeFeed
+from app.services.database import init_db
+
+
+def new_user_id():
+    # The feed lives in the shared test database; keep tests apart by user.
+    return random.randint(10**8, 10**9)
+
+
+def parse_event(message: bytes) -> tuple:
+    fields = dict(line.split(": ", 1) for line in message.decode().strip().splitlines())
+    return int(fields["id"]), json.loads(fields["data"])
+
+
+def test_changes_since_collapses_repeated_changes():
+    init_db()
+    feed = ChangeFeed()
+    user_id = new_user_id()
+    since = feed.current_version()
+    feed.publish(
+        [
+            (user_id, "owned", 1, {"id": 1, "filename": "a"}),
+            (user_id, "owned", 2, {"id": 2, "filename": "b"}),
+            (user_id, "owned", 1, None),
+            (new_user_id(), "owned", 3, {"id": 3, "filename": "c"}),
+        ]
+    )
+
+    delta = feed.changes_since(user_id, False, since)
+    assert delta["version"] == feed.current_version() == since + 4
+    assert not delta["reset"] and not delta["more"]
+    assert delta["changes"] == [
+        {"list": "owned", "file_id": 2, "file": {"id": 2, "filename": "b"}},
+        {"list": "owned", "file_id": 1, "file": None},
+    ]
+    assert feed.changes_since(user_id, False, delta["version"])["changes"] == []
+
+    admin_delta = feed.changes_since(0, True, since)
+    assert [change["file_id"] for change in admin_delta["changes"]] == [2, 1, 3]
+
+
+def test_changes_are_paged():
+    init_db()
+    feed = ChangeFeed(page_size=2)
+    user_id = new_user_id()
+    since = feed.current_version()
+    feed.publish([(user_id, "shared", i, {"id": i}) for i in range(3)])
+
+    first = feed.changes_since(user_id, False, since)
+    assert first["more"] and len(first["changes"]) == 2
+    second = feed.changes_since(user_id, False, first["version"])
+    assert not second["more"]
+    assert [change["file_id"] for change in second["changes"]] == [2]
+
+
+def test_trimmed_or_unknown_versions_reset():
+    init_db()
+    feed = ChangeFeed(retention=2)
+    user_id = new_user_id()
+    since = feed.current_version()
+    feed.publish([(user_id, "owned", i, {"id": i}) for i in range(5)])
+
+    assert feed.changes_since(user_id, False, since)["reset"]
+    assert not feed.changes_since(user_id, False, since + 3)["reset"]
+    assert feed.changes_since(user_id, False, since + 100)["reset"]
+
+
+def test_stream_sends_changes_as_they_are_published():
+    init_db()
+    feed = ChangeFeed(heartbeat_seconds=0.2)
+    user_id = new_user_id()
+
+    async def scenario():
+        stream = feed.stream(user_id, False, None)
+        try:
+            first = await stream.__anext__()
+            pending = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.02)
+            await run_in_threadpool(feed.publish, [(user_id, "owned", 7, {"id": 7})])
+            update = await asyncio.wait_for(pending, 1)
+            keepalive = await asyncio.wait_for(stream.__anext__(), 1)
+            return first, update, keepalive
+        finally:
+            await stream.aclose()
+
+    first, update, keepalive = asyncio.run(scenario())
+    version, delta = parse_event(first)
+    assert delta["changes"] == [] and version == delta["version"]
+    version, delta = parse_event(update)
+    assert version == feed.current_version()
+    assert delta["changes"] == [{"list": "owned", "file_id": 7, "file": {"id": 7}}]
+    assert keepalive == b": keepalive\n\n"
+    assert feed._subscribers == {}
@@ -0,0 +1,61 @@
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+from app.services.database import WriteQueue
+
+
+def test_write_queue_group_commits_concurrent_writes():
+    with tempfile.NamedTemporaryFile(suffix=".db") as handle:
+        conn = sqlite3.connect(handle.name)
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT UNIQUE)")
+        conn.commit()
+        writer = WriteQueue(handle.name, window=0.005)
+        batches = []
+        commit = writer._commit
+        writer._commit = lambda batch: batches.append(len(batch)) or commit(batch)
+
+        ids = []
+        start = threading.Barrier(16)
+
+        def insert(worker):
+            start.wait()
+            for index in range(20):
+                result = writer.execute(
+                    "INSERT INTO items (value) VALUES (?)", (f"{worker}-{index}",)
+                )
+                ids.append(result.lastrowid)
+
+        threads = [threading.Thread(target=insert, args=(n,)) for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(ids) == list(range(1, 321))
+        assert sum(batches) == 320
+        assert len(batches) < 320
+
+        # A failing statement is rolled back alone; its batch still commits.
+        good = writer.submit("INSERT INTO items (value) VALUES ('good')")
+        duplicate = writer.submit("INSERT INTO items (value) VALUES ('0-0')")
+        with pytest.raises(sqlite3.IntegrityError):
+            duplicate.result()
+        assert good.result().rowcount == 1
+
+        result = writer.execute(
+            "DELETE FROM items WHERE value = ? RETURNING id", ("good",)
+        )
+        assert result.fetchone() == (321,)
+        many = writer.execute(
+            "UPDATE items SET value = value || '!' WHERE id = ?",
+            [(1,), (2,)],
+            many=True,
+        )
+        assert many.rowcount == 2
+        writer.stop()
+
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone() == (320,)
+        conn.close()
@@ -0,0 +1,65 @@
+import random
+
+from app.services.expiry import TimingWheel
+
+
+def make_wheel():
+    fired = []
+    wheel = TimingWheel(tick_seconds=1.0, clock=lambda: 0.0)
+    wheel.on_expire("share", lambda events: fired.extend(events))
+    return wheel, fired
+
+
+def test_fires_each_timer_once_and_never_early():
+    wheel, fired = make_wheel()
+    rng = random.Random(0)
+    deadlines = {key: rng.uniform(0, 300_000) for key in range(2000)}
+    deadlines.update({2000: 0.5, 2001: 63.5, 2002: 64.0, 2003: 4096.0, 2004: 4097.0})
+    for key, deadline in deadlines.items():
+        wheel.schedule("share", key, deadline, payload=deadline)
+
+    fired_at = {}
+    now = 0
+    while len(fired_at) < len(deadlines):
+        now += rng.randint(1, 3000)
+        wheel.advance(now)
+        for key, deadline in fired:
+            assert key not in fired_at
+            fired_at[key] = now
+        fired.clear()
+
+    for key, deadline in deadlines.items():
+        assert fired_at[key] >= deadline
+    assert len(wheel) == 0
+
+
+def test_exact_timing_cancel_and_reschedule():
+    wheel, fired = make_wheel()
+    wheel.schedule("share", "a", 10.0)
+    wheel.schedule("share", "b", 5000.0)
+    wheel.schedule("share", "c", 20.0)
+    wheel.schedule("share", "c", 30.0)
+    assert wheel.cancel("share", "b")
+    assert not wheel.cancel("share", "missing")
+
+    wheel.advance(9.9)
+    assert fired == []
+    wheel.advance(10.0)
+    assert fired == [("a", None)]
+    wheel.advance(29.0)
+    assert fired == [("a", None)]
+    wheel.advance(30.0)
+    assert fired == [("a", None), ("c", None)]
+    wheel.advance(10_000.0)
+    assert len(fired) == 2
+
+
+def test_past_and_out_of_range_deadlines():
+    wheel, fired = make_wheel()
+    wheel.schedule("share", "far", float(64**5 * 2))
+    wheel.schedule("share", "past", -50.0)
+    wheel.advance(0)
+    assert fired == [("past", None)]
+    wheel.advance(100_000)
+    assert fired == [("past", None)]
+    assert len(wheel) == 1
@@ -0,0 +1,79 @@
+import os
+import uuid
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.services.database import execute_query, fetch_all, init_db, shard_for_user
+from app.services.ingest import BulkIngester, derive_user_key
+
+
+def write_tree(root, files):
+    for relative, content in files.items():
+        path = os.path.join(root, *relative.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as handle:
+            handle.write(content)
+
+
+def test_ingest_encrypts_like_uploads_and_resumes(tmp_path):
+    init_db()
+    owner = f"ingest_{uuid.uuid4().hex[:8]}"
+    user_id = execute_query(
+        "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+        (owner, f"{owner}@example.com", "x"),
+    ).lastrowid
+    tree = tmp_path / "tree"
+    files = {
+        "readme.txt": b"hello",
+        "docs/q3 report.pdf": os.urandom(3 * 1024 * 1024 + 5),
+        "docs/empty": b"",
+    }
+    write_tree(tree, files)
+    server_key = os.urandom(32)
+
+    def ingest():
+        return BulkIngester(
+            str(tree),
+            owner,
+            "download password",
+            server_key,
+            storage_root=str(tmp_path / "uploads"),
+            workers=2,
+            batch_size=2,
+            checkpoint_path=str(tmp_path / "checkpoint.json"),
+        ).run()
+
+    report = ingest()
+    assert (report["files"], report["skipped"], report["failed"]) == (3, 0, 0)
+    assert report["bytes"] == sum(map(len, files.values()))
+    assert report["batches"] == 2
+
+    rows = fetch_all(
+        "SELECT filename, file_path, iv, salt, size_bytes FROM files WHERE user_id = ?",
+        (user_id,),
+        shard=shard_for_user(user_id),
+    )
+    names = {"readme.txt": "readme.txt", "docs_q3 report.pdf": "docs/q3 report.pdf"}
+    names["docs_empty"] = "docs/empty"
+    assert sorted(row[0] for row in rows) == sorted(names)
+    for filename, file_path, iv, salt, size_bytes in rows:
+        with open(file_path, "rb") as handle:
+            blob = handle.read()
+        assert len(blob) == size_bytes
+        uploaded = AESGCM(server_key).decrypt(iv, blob, None)
+        user_key = derive_user_key("download password", salt)
+        assert AESGCM(user_key).decrypt(iv, uploaded, None) == files[names[filename]]
+
+    write_tree(tree, {"docs/late.txt": b"added later"})
+    report = ingest()
+    assert (report["files"], report["skipped"]) == (1, 3)
+    assert (
+        len(
+            fetch_all(
+                "SELECT id FROM files WHERE user_id = ?",
+                (user_id,),
+                shard=shard_for_user(user_id),
+            )
+        )
+        == 4
+    )
@@ -0,0 +1,86 @@
+from app.services.database import init_db
+from app.services.expiry import TimingWheel
+from app.services.mfa import DatabaseMFAStore, MemoryMFAStore, hash_code
+
+
+def make_store(**kwargs):
+    now = [1000.0]
+    wheel = TimingWheel(tick_seconds=1.0, clock=lambda: now[0])
+    return MemoryMFAStore(wheel=wheel, ttl_seconds=600, **kwargs), wheel, now
+
+
+def test_codes_are_single_use_and_stored_hashed():
+    store, wheel, _ = make_store()
+    store.issue(1, "123456")
+
+    assert store._challenges[1][0] == hash_code(1, "123456")
+    assert "123456" not in repr(store._challenges)
+    assert hash_code(2, "123456") != hash_code(1, "123456")
+
+    assert store.verify(1, "123456")
+    assert not store.verify(1, "123456")
+    assert len(store) == 0 and len(wheel) == 0
+
+
+def test_new_challenge_replaces_old_one():
+    store, _, _ = make_store()
+    store.issue(1, "111111")
+    store.issue(1, "222222")
+
+    assert not store.verify(1, "111111")
+    assert store.verify(1, "222222")
+
+
+def test_wrong_answers_exhaust_the_challenge():
+    store, wheel, _ = make_store(max_attempts=3)
+    store.issue(1, "123456")
+
+    assert not store.verify(1, "000000")
+    assert not store.verify(1, "000001")
+    assert len(store) == 1
+    assert not store.verify(1, "000002")
+    assert not store.verify(1, "123456")
+    assert len(store) == 0 and len(wheel) == 0
+
+
+def test_challenges_expire_on_the_wheel():
+    store, wheel, now = make_store()
+    store.issue(1, "123456")
+    store.issue(2, "654321")
+
+    now[0] += 599
+    wheel.advance()
+    assert len(store) == 2
+
+    now[0] += 2
+    assert not store.verify(2, "654321")
+    wheel.advance()
+    assert len(store) == 0
+
+
+def test_oldest_challenges_are_evicted_when_full():
+    store, wheel, _ = make_store(max_pending=3)
+    for user_id in range(5):
+        store.issue(user_id, "123456")
+
+    assert list(store._challenges) == [2, 3, 4]
+    assert len(wheel) == 3
+    assert not store.verify(0, "123456")
+    assert store.verify(4, "123456")
+
+
+def test_database_store():
+    init_db()
+    store = DatabaseMFAStore(max_attempts=2)
+    user_id = 987_654_321
+    store.issue(user_id, "123456")
+    store.issue(user_id, "222222")
+
+    assert not store.verify(user_id, "123456")
+    assert store.verify(user_id, "222222")
+    assert not store.verify(user_id, "222222")
+
+    store.issue(user_id, "333333")
+    assert not store.verify(user_id, "000000")
+    assert not store.verify(user_id, "000000")
+    assert not store.verify(user_id, "333333")
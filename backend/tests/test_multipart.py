@@ -0,0 +1,91 @@
+import asyncio
+import os
+
+import pytest
+
+from app.utils.multipart import MultipartError, MultipartStream
+
+BOUNDARY = "testboundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def encode(fields):
+    body = b""
+    for name, filename, value in fields:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += (
+            f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode()
+            + value
+            + b"\r\n"
+        )
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def body_in(chunks, size):
+    for offset in range(0, len(chunks), size):
+        yield chunks[offset : offset + size]
+
+
+def collect(body, chunk_size):
+    async def run():
+        form = MultipartStream(CONTENT_TYPE, body_in(body, chunk_size))
+        parts = []
+        async for part in form.parts():
+            pieces = [chunk async for chunk in part]
+            parts.append((part.name, part.filename, b"".join(pieces), len(pieces)))
+        return parts
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096, 1 << 20])
+def test_parts_stream_in_body_order(chunk_size):
+    content = os.urandom(100_000)
+    body = encode(
+        [("iv", None, b"i" * 12), ("salt", None, b"s" * 16), ("file", "a.bin", content)]
+    )
+
+    parts = collect(body, chunk_size)
+
+    assert [(name, filename, value) for name, filename, value, _ in parts] == [
+        ("iv", None, b"i" * 12),
+        ("salt", None, b"s" * 16),
+        ("file", "a.bin", content),
+    ]
+    if chunk_size < len(content):
+        assert parts[2][3] > 1
+
+
+def test_unread_parts_are_skipped():
+    body = encode([("skip", None, b"x" * 5000), ("iv", None, b"i" * 12)])
+
+    async def run():
+        form = MultipartStream(CONTENT_TYPE, body_in(body, 1000))
+        return [
+            (part.name, await part.read(64))
+            async for part in form.parts()
+            if part.name == "iv"
+        ]
+
+    assert asyncio.run(run()) == [("iv", b"i" * 12)]
+
+
+def test_malformed_bodies_raise():
+    with pytest.raises(MultipartError):
+        MultipartStream("application/json", body_in(b"{}", 2))
+
+    truncated = encode([("file", "a.bin", b"x" * 1000)])[:-200]
+    with pytest.raises(MultipartError):
+        collect(truncated, 100)
+
+    async def oversized():
+        form = MultipartStream(
+            CONTENT_TYPE, body_in(encode([("iv", None, b"i" * 100)]), 10)
+        )
+        async for part in form.parts():
+            await part.read(12)
+
+    with pytest.raises(MultipartError):
+        asyncio.run(oversized())
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.services.database import execute_query, fetch_one, init_db
+from app.services.packs import PackedStorage, compact
+from app.services.reconcile import reconcile
+from app.services.scrubber import verify_blob
+from app.services.storage import LocalStorage
+
+init_db()
+
+
+def forget_packs(root):
+    execute_query("DELETE FROM packed_blobs WHERE storage_key LIKE ?", (f"{root}%",))
+    execute_query("DELETE FROM packs WHERE path LIKE ?", (f"{root}%",))
+
+
+async def read(storage, key):
+    return b"".join([chunk async for chunk in storage.read(key)])
+
+
+def test_small_blobs_share_a_pack_and_compact():
+    async def scenario(root):
+        storage = PackedStorage(
+            LocalStorage(root, io_threads=2),
+            os.path.join(root, ".packs"),
+            small_blob_bytes=1024,
+            segment_bytes=4096,
+        )
+        blobs = {
+            storage.new_key(f"small{index}"): os.urandom(300) for index in range(8)
+        }
+        for key, data in blobs.items():
+            assert await storage.write(key, data) == 300
+        large = storage.new_key("large")
+        await storage.write(large, os.urandom(5000))
+
+        assert os.path.exists(large)
+        assert not any(os.path.exists(key) for key in blobs)
+        assert len(os.listdir(os.path.join(root, ".packs"))) == 1
+        for key, data in blobs.items():
+            assert await storage.exists(key)
+            assert await read(storage, key) == data
+
+        storage.seal_active()
+        keys = list(blobs)
+        for key in keys[:6]:
+            assert await storage.delete(key)
+            del blobs[key]
+        assert not await storage.exists(keys[0])
+
+        report = compact(storage, min_dead_ratio=0.5, grace_seconds=0)
+        assert report["compacted"] >= 1 and report["moved_blobs"] >= 2
+        for key, data in blobs.items():
+            assert await read(storage, key) == data
+
+        execute_query(
+            "UPDATE packs SET retired_at = datetime('now', '-1 minute') "
+            "WHERE state = 'retired' AND path LIKE ?",
+            (f"{root}%",),
+        )
+        assert compact(storage, grace_seconds=0)["deleted"] >= 1
+        for key, data in blobs.items():
+            assert await read(storage, key) == data
+        await storage.close()
+
+    with tempfile.TemporaryDirectory() as root:
+        asyncio.run(scenario(root))
+        forget_packs(root)
+
+
+def test_packed_blobs_are_scrubbed_and_reconciled():
+    key_bytes = AESGCM.generate_key(bit_length=256)
+    iv = b"1" * 12
+    ciphertext = AESGCM(key_bytes).encrypt(iv, b"packed content", None)
+
+    async def scenario(root):
+        storage = PackedStorage(
+            LocalStorage(root, io_threads=1), os.path.join(root, ".packs")
+        )
+        padding = storage.new_key("padding")
+        await storage.write(padding, os.urandom(100))
+        key = storage.new_key("packed")
+        await storage.write(key, ciphertext)
+        await storage.close()
+        return padding, key
+
+    with tempfile.TemporaryDirectory() as root:
+        padding, key = asyncio.run(scenario(root))
+        execute_query(
+            """
+            INSERT INTO files (filename, user_id, file_path, iv, salt)
+            VALUES ('test_packs', 0, ?, ?, ?)
+            """,
+            (key, iv, b"salt"),
+        )
+        path, offset, length = fetch_one(
+            """
+            SELECT p.path, b.pack_offset, b.length
+            FROM packed_blobs b JOIN packs p ON p.id = b.pack_id
+            WHERE b.storage_key = ?
+            """,
+            (key,),
+        )
+        assert offset == 100
+        assert verify_blob(path, iv, key_bytes, offset, length) == "ok"
+        assert verify_blob(path, iv, key_bytes, 0, length) == "corrupt"
+
+        report = reconcile(root, min_age=0)
+        assert report["dangling_rows"] == 0
+        assert report["orphaned_sample"] == [padding]
+        forget_packs(root)
+    execute_query("DELETE FROM files WHERE filename = 'test_packs'")
+
+
+def test_evicted_pack_fd_stays_open_until_its_reader_finishes(monkeypatch):
+    monkeypatch.setattr("app.services.packs.PACK_MAX_OPEN_FILES", 1)
+    with tempfile.TemporaryDirectory() as root:
+        storage = PackedStorage(LocalStorage(root), os.path.join(root, ".packs"))
+        paths = []
+        for index in range(2):
+            paths.append(os.path.join(root, f"{index}.pack"))
+            with open(paths[-1], "wb") as handle:
+                handle.write(bytes([index]) * 10)
+
+        with storage._fd(1, paths[0]) as fd:
+            # Another thread's read evicts this pack while it is borrowed.
+            assert storage.read_range(2, paths[1], 0, 4) == b"\x01" * 4
+            assert 1 not in storage._fds
+            assert os.pread(fd, 4, 0) == b"\x00" * 4
+        with pytest.raises(OSError):
+            os.fstat(fd)
+        asyncio.run(storage.close())
+
+
+def test_only_overwrites_clear_a_packed_address(monkeypatch):
+    async def scenario(root):
+        storage = PackedStorage(
+            LocalStorage(root, io_threads=2),
+            os.path.join(root, ".packs"),
+            small_blob_bytes=1024,
+        )
+        cleared = []
+        delete_address = storage.delete_address
+        monkeypatch.setattr(
+            storage,
+            "delete_address",
+            lambda key: cleared.append(key) or delete_address(key),
+        )
+        key = storage.new_key("blob")
+        await storage.write(key, b"small")
+        assert cleared == []
+
+        large = os.urandom(2000)
+        await storage.write(key, large)
+        assert cleared == [key]
+        assert storage.address(key) is None
+        assert await read(storage, key) == large
+        await storage.close()
+        forget_packs(root)
+
+    with tempfile.TemporaryDirectory() as root:
+        asyncio.run(scenario(root))
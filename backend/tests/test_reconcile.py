@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+from app.services.database import execute_query, fetch_all
+from app.services.reconcile import reconcile, sorted_blob_paths
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as handle:
+        handle.write(b"blob")
+
+
+def test_sorted_blob_paths_merges_runs():
+    with tempfile.TemporaryDirectory() as root:
+        names = [f"{index:03d}_file" for index in range(50)]
+        for name in reversed(names):
+            touch(os.path.join(root, name))
+        touch(os.path.join(root, "pending.part"))
+
+        paths = list(sorted_blob_paths(root, min_age=0, run_size=7))
+
+    assert paths == [os.path.join(root, name) for name in names]
+
+
+def test_reconcile_reports_and_quarantines():
+    with tempfile.TemporaryDirectory() as root:
+        kept = os.path.join(root, "a_kept")
+        orphan = os.path.join(root, "b_orphan")
+        dangling = os.path.join(root, "c_dangling")
+        touch(kept)
+        touch(orphan)
+        file_ids = []
+        for path in (kept, dangling):
+            execute_query(
+                """
+                INSERT INTO files (filename, user_id, file_path, iv, salt)
+                VALUES ('test_reconcile', 0, ?, ?, ?)
+                """,
+                (path, b"0" * 12, b"salt"),
+            )
+            file_ids.append(fetch_all("SELECT MAX(id) FROM files")[0][0])
+
+        report = reconcile(
+            root, quarantine=True, mark_missing=True, min_age=0, run_size=1
+        )
+
+        assert report["blobs"] == 2
+        assert report["rows"] == 2
+        assert report["orphaned_sample"] == [orphan]
+        assert report["dangling_sample"] == [
+            {"file_id": file_ids[1], "file_path": dangling}
+        ]
+        assert not os.path.exists(orphan)
+        assert os.path.exists(os.path.join(root, ".quarantine", "b_orphan"))
+        assert reconcile(root, min_age=0)["orphaned_blobs"] == 0
+
+    statuses = fetch_all(
+        "SELECT integrity_status FROM files WHERE id IN (?, ?) ORDER BY id",
+        tuple(file_ids),
+    )
+    assert statuses == [(None,), ("missing",)]
+    execute_query("DELETE FROM files WHERE id IN (?, ?)", tuple(file_ids))
@@ -0,0 +1,67 @@
+import os
+import tempfile
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from app.services.database import execute_query, fetch_all
+from app.services.scrubber import Scrubber, verify_blob
+
+KEY = AESGCM.generate_key(bit_length=256)
+IV = b"0" * 12
+
+
+def write_blob(directory, name, data):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as handle:
+        handle.write(data)
+    return path
+
+
+def test_verify_blob_detects_damage():
+    ciphertext = AESGCM(KEY).encrypt(IV, b"x" * 3_000_000, None)
+    with tempfile.TemporaryDirectory() as directory:
+        good = write_blob(directory, "good", ciphertext)
+        flipped = bytearray(ciphertext)
+        flipped[1234] ^= 1
+        corrupt = write_blob(directory, "corrupt", bytes(flipped))
+        truncated = write_blob(directory, "truncated", ciphertext[:10])
+
+        assert verify_blob(good, IV, KEY) == "ok"
+        assert verify_blob(corrupt, IV, KEY) == "corrupt"
+        assert verify_blob(truncated, IV, KEY) == "corrupt"
+        assert verify_blob(os.path.join(directory, "gone"), IV, KEY) == "missing"
+
+
+def test_scrubber_records_results():
+    ciphertext = AESGCM(KEY).encrypt(IV, b"scrub me", None)
+    with tempfile.TemporaryDirectory() as directory:
+        good = write_blob(directory, "good", ciphertext)
+        bad = write_blob(directory, "bad", ciphertext[:-1] + b"\x00")
+        file_ids = []
+        for path in (good, bad, os.path.join(directory, "gone")):
+            execute_query(
+                """
+                INSERT INTO files (filename, user_id, file_path, iv, salt, size_bytes)
+                VALUES ('test_scrub', 0, ?, ?, ?, ?)
+                """,
+                (path, IV, b"salt", len(ciphertext)),
+            )
+            file_ids.append(fetch_all("SELECT MAX(id) FROM files")[0][0])
+
+        report = Scrubber(KEY, workers=2).run()
+
+    assert report["checked"] >= 3
+    statuses = dict(
+        fetch_all(
+            f"SELECT id, integrity_status FROM files WHERE id IN ({','.join('?' * 3)})",
+            tuple(file_ids),
+        )
+    )
+    assert statuses == {
+        file_ids[0]: "ok",
+        file_ids[1]: "corrupt",
+        file_ids[2]: "missing",
+    }
+    assert file_ids[1] in report["corrupt"]
+    assert Scrubber(KEY).due_files(10) == []
+    execute_query("DELETE FROM files WHERE id IN (?, ?, ?)", tuple(file_ids))
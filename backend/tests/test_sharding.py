@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter: the shard count is read when the database
+# module is imported.
+SCENARIO = """
+import os, sqlite3
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.database import SHARD_PATHS, shard_for_row, shard_for_user
+from app.services.expiry import EXPIRY_WHEEL
+from app.services.mfa import DatabaseMFAStore
+
+with TestClient(app) as client:
+    tokens = {}
+    for index, role in enumerate(["admin", "user", "user", "user", "user"]):
+        name = f"shard_user{index}"
+        client.post("/auth/register", json={
+            "username": name, "email": f"{name}@example.com",
+            "password": "Password123!", "role": role, "mfa_enabled": False,
+        })
+        login = client.post("/auth/login", json={"username": name, "password": "Password123!"})
+        tokens[name] = {"Authorization": "Bearer " + login.json()["access_token"]}
+
+    file_ids = {}
+    for name, headers in list(tokens.items())[1:]:
+        response = client.post("/files/upload", headers=headers, files={
+            "file": (f"{name}_report.txt", name.encode(), "text/plain"),
+            "iv": ("iv", os.urandom(12), "application/octet-stream"),
+            "salt": ("salt", b"salt", "application/octet-stream"),
+        })
+        assert response.status_code == 200, response.text
+        owned = client.get("/files/list", headers=headers).json()["owned_files"]
+        assert len(owned) == 1
+        file_ids[name] = owned[0]["id"]
+        assert shard_for_row(owned[0]["id"]) == shard_for_user(owned[0]["user_id"])
+
+    per_shard = [
+        sqlite3.connect(path).execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        for path in SHARD_PATHS
+    ]
+    assert sum(per_shard) == 4 and max(per_shard) < 4, per_shard
+
+    owner, recipient = "shard_user1", "shard_user2"
+    response = client.post("/files/share", headers=tokens[owner], json={
+        "file_id": file_ids[owner], "shared_with_username": recipient,
+        "permissions": "download", "expires_in_hours": 1,
+    })
+    assert response.status_code == 200, response.text
+    shared = client.get("/files/list", headers=tokens[recipient]).json()["shared_files"]
+    assert [f["id"] for f in shared] == [file_ids[owner]]
+    assert client.get(f"/files/download/{file_ids[owner]}", headers=tokens[recipient]).content == owner.encode()
+
+    token = client.post("/files/share", headers=tokens[owner], json={
+        "file_id": file_ids[owner], "permissions": "download", "expires_in_hours": 1,
+    }).json()["share_token"]
+    assert client.get(f"/files/shared/{token}", params={"password": "x"}).content == owner.encode()
+
+    admin = tokens["shard_user0"]
+    assert len(client.get("/files/list", headers=admin).json()["owned_files"]) == 4
+    results = client.get("/files/search", params={"q": "report", "limit": 3}, headers=admin).json()
+    assert len(results["results"]) == 3 and results["has_more"]
+    usage = client.get("/admin/storage/usage", headers=admin).json()
+    assert sum(user["file_count"] for user in usage["users"]) == 4
+
+    assert client.delete("/auth/account", headers=tokens[owner]).status_code == 200
+    assert client.get(f"/files/shared/{token}", params={"password": "x"}).status_code == 404
+    assert len(client.get("/files/list", headers=admin).json()["owned_files"]) == 3
+
+# MFA code ids are unique across shards, so their expiry timers do not collide.
+store = DatabaseMFAStore()
+for user_id in (1, 2, 3):
+    store.issue(user_id, "123456")
+codes = [key for kind, key in EXPIRY_WHEEL._timers if kind == "mfa_code"]
+assert len(codes) == 3, codes
+assert sorted(shard_for_row(code) for code in codes) == [0, 1, 2], codes
+assert store.verify(2, "123456")
+print("ok")
+"""
+
+
+def test_sharded_mode_end_to_end():
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            DB_SHARDS="3",
+            DATABASE_PATH=os.path.join(directory, "app.db"),
+            UPLOAD_DIRECTORY=os.path.join(directory, "uploads"),
+            AUDIT_DATABASE_PATH=os.path.join(directory, "audit.db"),
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", SCENARIO],
+            cwd=BACKEND_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == "ok"
+        for name in ("app.shard0.db", "app.shard1.db", "app.shard2.db"):
+            assert os.path.exists(os.path.join(directory, name))
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TIME_BUDGET_SECONDS = float(os.environ.get("IMPORT_TIME_BUDGET_SECONDS", "2"))
+
+PROBE = """
+import os, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+heavy = [name for name in ("passlib", "jose", "smtplib") if name in sys.modules]
+print(elapsed, os.path.exists(os.environ["DATABASE_PATH"]), ",".join(heavy))
+"""
+
+
+def test_import_is_fast_and_side_effect_free():
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            DATABASE_PATH=os.path.join(directory, "app.db"),
+            UPLOAD_DIRECTORY=os.path.join(directory, "uploads"),
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=BACKEND_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        elapsed, db_created, heavy = result.stdout.split(" ")
+
+        assert float(elapsed) < IMPORT_TIME_BUDGET_SECONDS
+        assert db_created == "False"
+        assert not os.path.exists(env["UPLOAD_DIRECTORY"])
+        assert heavy.strip() == ""
+
+
+def test_lifespan_migrates_and_warms_up():
+    with TestClient(app) as client:
+        assert client.get("/").status_code == 200
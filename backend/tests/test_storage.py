@@ -0,0 +1,70 @@
+import asyncio
+import os
+
+import httpx
+
+from app.services.storage import LocalStorage, S3Storage
+from tests.fake_s3 import FakeS3
+
+
+def make_s3(fake, **kwargs):
+    return S3Storage(
+        endpoint_url="http://s3.test",
+        bucket="blobs",
+        access_key="test-access",
+        secret_key="test-secret",
+        transport=httpx.ASGITransport(app=fake),
+        **kwargs,
+    )
+
+
+def test_local_storage_round_trip(tmp_path):
+    async def scenario():
+        storage = LocalStorage(str(tmp_path))
+        key = storage.new_key("report.pdf")
+        payload = os.urandom(3 * 1024 * 1024 + 17)
+
+        assert await storage.write(key, payload) == len(payload)
+        assert await storage.exists(key)
+        assert await storage.read_all(key) == payload
+        assert await storage.delete(key)
+        assert not await storage.delete(key)
+        assert os.listdir(tmp_path) == []
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_s3_storage_single_put_and_delete():
+    fake = FakeS3()
+
+    async def scenario():
+        storage = make_s3(fake)
+        await storage.write("a/key.bin", b"ciphertext")
+        assert fake.objects["/blobs/a/key.bin"] == b"ciphertext"
+        assert await storage.read_all("a/key.bin") == b"ciphertext"
+        assert await storage.delete("a/key.bin")
+        assert not await storage.exists("a/key.bin")
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_s3_storage_multipart_upload_from_stream():
+    fake = FakeS3()
+    payload = os.urandom(5 * 1024 * 1024 + 123)
+
+    async def chunks():
+        for offset in range(0, len(payload), 300_000):
+            yield payload[offset : offset + 300_000]
+
+    async def scenario():
+        storage = make_s3(fake, multipart_threshold=1024 * 1024, part_size=1024 * 1024)
+        assert await storage.write("big.bin", chunks()) == len(payload)
+        assert await storage.read_all("big.bin") == payload
+        await storage.close()
+
+    asyncio.run(scenario())
+    part_uploads = [request for request in fake.requests if "partNumber" in request[2]]
+    assert len(part_uploads) == 6
+    assert fake.uploads == {}
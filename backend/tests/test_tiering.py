@@ -0,0 +1,85 @@
+import asyncio
+import os
+import tempfile
+
+from app.services.database import execute_query, fetch_one, init_db
+from app.services.storage import LocalStorage
+from app.services.tiering import AccessTracker, demote, promote, read_blob
+
+
+def insert_file(path, created_at="2000-01-01 00:00:00"):
+    return execute_query(
+        """
+        INSERT INTO files (filename, user_id, file_path, iv, salt, created_at)
+        VALUES ('test_tiering', 0, ?, ?, ?, ?) RETURNING id
+        """,
+        (path, b"0" * 12, b"salt", created_at),
+    ).fetchone()[0]
+
+
+def file_row(file_id):
+    return fetch_one(
+        "SELECT file_path, access_count, last_accessed_at FROM files WHERE id = ?",
+        (file_id,),
+    )
+
+
+def test_access_tracker_batches_counts():
+    init_db()
+    file_id = insert_file("test_tiering_tracked")
+    tracker = AccessTracker(flush_interval=3600)
+    for _ in range(3):
+        tracker.record(file_id)
+
+    assert file_row(file_id)[1] == 0
+    assert tracker.flush() == 1
+    _, count, last_accessed = file_row(file_id)
+    assert count == 3 and last_accessed > "2000"
+    tracker.stop()
+    execute_query("DELETE FROM files WHERE id = ?", (file_id,))
+
+
+def test_demote_and_promote():
+    init_db()
+    with tempfile.TemporaryDirectory() as root:
+        hot_root = os.path.join(root, "hot")
+        cold_root = os.path.join(hot_root, ".cold")
+
+        async def scenario():
+            storage = LocalStorage(hot_root, io_threads=1)
+            idle, recent, gone = (
+                os.path.join(hot_root, name)
+                for name in ("a_idle", "b_recent", "c_gone")
+            )
+            await storage.write(idle, b"idle blob")
+            await storage.write(recent, b"recent blob")
+            ids = [insert_file(idle), insert_file(recent), insert_file(gone)]
+            execute_query(
+                "UPDATE files SET last_accessed_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (ids[1],),
+            )
+
+            report = await demote(
+                storage, hot_root, cold_root, cold_after_days=7, bytes_per_second=0
+            )
+            assert report["moved"] == 1 and report["failed"] == 1
+            cold_key = os.path.join(cold_root, "a_idle")
+            assert file_row(ids[0])[0] == cold_key
+            assert not os.path.exists(idle)
+            assert file_row(ids[1])[0] == recent
+
+            # A reader holding the old key follows the row to the new one.
+            content, key = await read_blob(storage, ids[0], idle)
+            assert (content, key) == (b"idle blob", cold_key)
+
+            await promote(storage, ids[0], cold_key, content)
+            hot_key = file_row(ids[0])[0]
+            assert hot_key.startswith(hot_root) and hot_key.endswith("_idle")
+            assert not os.path.exists(cold_key)
+            assert await storage.read_all(hot_key) == b"idle blob"
+
+            for file_id in ids:
+                execute_query("DELETE FROM files WHERE id = ?", (file_id,))
+            await storage.close()
+
+        asyncio.run(scenario())
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import random
+
+from app.services.versions import ChunkStore, chunk_boundaries
+
+
+def test_chunk_boundaries_survive_insertions():
+    data = random.Random(0).randbytes(2_000_000)
+    edited = data[:500_000] + b"an edit in the middle" + data[500_000:]
+
+    before = chunk_boundaries(data)
+    after = chunk_boundaries(edited)
+
+    assert before[-1] == len(data) and after[-1] == len(edited)
+    sizes = [end - start for start, end in zip([0] + before, before)]
+    assert all(size <= 256 * 1024 for size in sizes)
+    assert 16 * 1024 <= sum(sizes) / len(sizes) <= 256 * 1024
+
+    def chunks(content, boundaries):
+        return {content[s:e] for s, e in zip([0] + boundaries, boundaries)}
+
+    shared = chunks(data, before) & chunks(edited, after)
+    assert len(shared) >= len(before) - 2
+
+
+def test_chunk_boundaries_small_input():
+    assert chunk_boundaries(b"") == []
+    assert chunk_boundaries(os.urandom(100)) == [100]
+
+
+def test_streamed_chunks_match_whole_content():
+    data = random.Random(1).randbytes(3_000_000)
+    store = ChunkStore(os.urandom(32), storage=None)
+
+    async def pieces():
+        for offset in range(0, len(data), 100_000):
+            yield data[offset : offset + 100_000]
+
+    async def streamed():
+        return [
+            chunk async for batch in store._split_stream(pieces()) for chunk in batch
+        ]
+
+    chunks = asyncio.run(streamed())
+    assert b"".join(chunk for _, chunk in chunks) == data
+    assert chunks == store._split(data)[0]
@@ -9,8 +9,15 @@ import { Download, Share2, Trash2, Plus } from "lucide-react";
 import { FileUploadModal } from "./FileUploadModal";
 
 export const FileManagement = () => {
-  const { ownedFiles, sharedFiles, fetchFiles, deleteFile, isLoading, error } =
-    useFileStore();
+  const {
+    ownedFiles,
+    sharedFiles,
+    fetchFiles,
+    watchChanges,
+    deleteFile,
+    isLoading,
+    error,
+  } = useFileStore();
   const [selectedFileId, setSelectedFileId] = useState<number | null>(null);
   const [shareFileId, setShareFileId] = useState<number | null>(null);
   const [shareFileName, setShareFileName] = useState("");
@@ -19,8 +26,17 @@ export const FileManagement = () => {
   const isGuest = currentUser.role === "guest";
 
   useEffect(() => {
-    fetchFiles();
-  }, [fetchFiles]);
+    // Load the list once, then keep it current from the change feed.
+    let stopWatching = () => {};
+    let cancelled = false;
+    fetchFiles().then(() => {
+      if (!cancelled) stopWatching = watchChanges();
+    });
+    return () => {
+      cancelled = true;
+      stopWatching();
+    };
+  }, [fetchFiles, watchChanges]);
 
   const FileRow = ({
     file,
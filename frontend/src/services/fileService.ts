@@ -1,5 +1,6 @@
-import { axiosInstance } from "../config/axios";
-import { FileListResponse, FileShareRequest } from "../types/file";
+import { API_URL, axiosInstance } from "../config/axios";
+import { useAuthStore } from "../store/authStore";
+import { FileChanges, FileListResponse, FileShareRequest } from "../types/file";
 import {
   sanitizeFileName,
   sanitizePassword,
@@ -131,9 +132,10 @@ class FileService {
     const { encryptedFile, iv } = await FileEncryption.encryptFile(file, key);
 
     const formData = new FormData();
-    formData.append("file", encryptedFile, sanitizedFileName);
+    // iv and salt go first so the server can encrypt the file as it streams in
     formData.append("iv", new Blob([iv]));
     formData.append("salt", new Blob([salt]));
+    formData.append("file", encryptedFile, sanitizedFileName);
 
     const response = await axiosInstance.post("/files/upload", formData, {
       headers: {
@@ -145,9 +147,61 @@ class FileService {
 
   async listFiles(): Promise<FileListResponse> {
     const response = await axiosInstance.get("/files/list");
+    return {
+      ...response.data,
+      version: Number(response.headers["x-changes-version"] ?? 0),
+    };
+  }
+
+  async listChanges(since: number): Promise<FileChanges> {
+    const response = await axiosInstance.get("/files/changes", {
+      params: { since },
+    });
     return response.data;
   }
 
+  /**
+   * Follows the server-sent change feed until the stream ends or `signal`
+   * is aborted. Uses fetch because EventSource cannot send the
+   * Authorization header.
+   */
+  async streamChanges(
+    since: number,
+    onChanges: (changes: FileChanges) => void,
+    signal: AbortSignal
+  ): Promise<void> {
+    const token = useAuthStore.getState().token;
+    const response = await fetch(
+      `${API_URL}/files/changes/stream?since=${since}`,
+      {
+        headers: token ? { Authorization: `Bearer ${token}` } : {},
+        signal,
+      }
+    );
+    if (!response.ok || !response.body) {
+      throw new Error(`Change feed failed with status ${response.status}`);
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = "";
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) return;
+      buffer += value;
+      let end: number;
+      while ((end = buffer.indexOf("\n\n")) >= 0) {
+        const data = buffer
+          .slice(0, end)
+          .split("\n")
+          .filter((line) => line.startsWith("data: "))
+          .map((line) => line.slice("data: ".length))
+          .join("\n");
+        buffer = buffer.slice(end + 2);
+        if (data) onChanges(JSON.parse(data));
+      }
+    }
+  }
+
   async shareFile(shareDetails: FileShareRequest) {
     const response = await axiosInstance.post("/files/share", shareDetails);
     return response.data;
@@ -1,13 +1,24 @@
 import { create } from "zustand";
 import { fileService } from "../services/fileService";
-import { File, FileShareRequest, ShareResponse } from "../types/file";
+import {
+  File,
+  FileChanges,
+  FileShareRequest,
+  ShareResponse,
+} from "../types/file";
+
+const CHANGE_FEED_RETRY_MS = 5000;
 
 interface FileStore {
   ownedFiles: File[];
   sharedFiles: File[];
+  version: number;
   isLoading: boolean;
   error: string | null;
   fetchFiles: () => Promise<void>;
+  applyChanges: (changes: FileChanges) => Promise<void>;
+  syncChanges: () => Promise<void>;
+  watchChanges: () => () => void;
   deleteFile: (id: number) => Promise<void>;
   uploadFile: (file: Blob, password: string) => Promise<void>;
   shareFile: (request: FileShareRequest) => Promise<ShareResponse | undefined>;
@@ -25,9 +36,18 @@ interface ShareResponse {
   share_token?: string;
 }
 
-export const useFileStore = create<FileStore>((set) => ({
+const applyChange = (files: File[], fileId: number, file: File | null) => {
+  const index = files.findIndex((existing) => existing.id === fileId);
+  if (!file) return index < 0 ? files : files.filter((_, i) => i !== index);
+  return index < 0
+    ? [...files, file]
+    : files.map((existing, i) => (i === index ? file : existing));
+};
+
+export const useFileStore = create<FileStore>((set, get) => ({
   ownedFiles: [],
   sharedFiles: [],
+  version: 0,
   isLoading: false,
   error: null,
 
@@ -38,6 +58,7 @@ export const useFileStore = create<FileStore>((set) => ({
       set({
         ownedFiles: response.owned_files || [],
         sharedFiles: response.shared_files || [],
+        version: response.version,
         isLoading: false,
       });
     } catch (error) {
@@ -45,6 +66,55 @@ export const useFileStore = create<FileStore>((set) => ({
     }
   },
 
+  applyChanges: async (delta: FileChanges) => {
+    if (delta.reset) {
+      // The changes since our version are gone; start over from a full list.
+      await get().fetchFiles();
+      return;
+    }
+    set((state) => {
+      let { ownedFiles, sharedFiles } = state;
+      for (const change of delta.changes) {
+        if (change.list === "owned") {
+          ownedFiles = applyChange(ownedFiles, change.file_id, change.file);
+        } else {
+          sharedFiles = applyChange(sharedFiles, change.file_id, change.file);
+        }
+      }
+      return { ownedFiles, sharedFiles, version: delta.version };
+    });
+  },
+
+  syncChanges: async () => {
+    let delta: FileChanges;
+    do {
+      delta = await fileService.listChanges(get().version);
+      await get().applyChanges(delta);
+    } while (delta.more && !delta.reset);
+  },
+
+  watchChanges: () => {
+    const controller = new AbortController();
+    const follow = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          await fileService.streamChanges(
+            get().version,
+            (delta) => get().applyChanges(delta),
+            controller.signal
+          );
+        } catch (error) {
+          if (controller.signal.aborted) return;
+        }
+        await new Promise((resolve) =>
+          setTimeout(resolve, CHANGE_FEED_RETRY_MS)
+        );
+      }
+    };
+    follow();
+    return () => controller.abort();
+  },
+
   deleteFile: async (id: number) => {
     try {
       await fileService.deleteFile(id);
@@ -61,12 +131,9 @@ export const useFileStore = create<FileStore>((set) => ({
     set({ isLoading: true, error: null });
     try {
       await fileService.uploadFile(file, password);
-      const response = await fileService.listFiles();
-      set({
-        ownedFiles: response.owned_files || [],
-        sharedFiles: response.shared_files || [],
-        isLoading: false,
-      });
+      // Fetch just the new entry rather than waiting for the stream.
+      await get().syncChanges();
+      set({ isLoading: false });
     } catch (error) {
       set({ error: "Failed to upload file", isLoading: false });
     }
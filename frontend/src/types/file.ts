@@ -23,6 +23,20 @@ export interface File {
 export interface FileListResponse {
   owned_files: File[];
   shared_files: File[];
+  version: number;
+}
+
+export interface FileChange {
+  list: "owned" | "shared";
+  file_id: number;
+  file: File | null; // null when the file left the list
+}
+
+export interface FileChanges {
+  version: number;
+  changes: FileChange[];
+  more: boolean;
+  reset: boolean;
 }
 
 export interface FileShareRequest {